@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+
+## Benchmark player frame assembly, frames per second of the collage with subtitles at 1080p
+#
+# python bin/bench_compositor.py [--width 1920] [--height 1080] [--frames 200] [--new_image_every 10]
+#
+# Times the old per frame path, PIL collage then BGR round trip with a full
+# frame blend per subtitle line, against the layered compositor.
+#
+
+import os
+import sys
+import time
+import argparse
+import textwrap
+import cv2
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lifeAIcompositor import Compositor
+from lifeAIimageVariants import VariantCache
+
+TEXT = "The groovy buddha sits on the tibetan mountain at sunset and talks about the meaning of life with a wild hippie girl"
+BANNER = "someone asked what is the meaning of life and why is the sky blue"
+
+def legacy_frame(center, thumbs, width, height, text, banner):
+    """ The frame path the player used before the compositor, kept here as the baseline """
+    size = height // 3
+    image = Image.new('RGB', (width, height))
+    for i, thumb in enumerate(thumbs):
+        image.paste(thumb, (0 if i < 3 else width - size, (i % 3) * size))
+    image.paste(center, ((width - height) // 2, 0))
+
+    image = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
+    ((_, text_height), _) = cv2.getTextSize(banner, cv2.FONT_HERSHEY_DUPLEX, 1, 2)
+    overlay = image.copy()
+    cv2.rectangle(overlay, (0, 0), (width, text_height + 20), (0, 0, 0), -1)
+    cv2.putText(image, banner, (7, text_height + 8), cv2.FONT_HERSHEY_DUPLEX, 1, (0, 0, 0), 2)
+    image = cv2.addWeighted(overlay, 0.5, image, 0.5, 0)
+    cv2.putText(image, banner, (5, text_height + 10), cv2.FONT_HERSHEY_DUPLEX, 1, (255, 255, 0), 2)
+
+    y = height
+    for line in reversed(textwrap.wrap(text, width=50)):
+        ((text_width, text_height), baseline) = cv2.getTextSize(line, cv2.FONT_HERSHEY_DUPLEX, 2, 6)
+        x = (width - text_width) // 2
+        y -= baseline + text_height + 10
+        overlay = image.copy()
+        cv2.rectangle(overlay, (x - 10, y - text_height - 10), (x + text_width + 10, y + 18), (0, 0, 0), -1)
+        image = cv2.addWeighted(overlay, 0.0, image, 1.0, 0)
+        cv2.putText(image, line, (x + 4, y + 4), cv2.FONT_HERSHEY_DUPLEX, 2, (0, 0, 0), 6)
+        cv2.putText(image, line, (x, y), cv2.FONT_HERSHEY_DUPLEX, 2, (0, 0, 0), 15)
+        cv2.putText(image, line, (x, y), cv2.FONT_HERSHEY_DUPLEX, 2, (255, 255, 255), 6)
+    image = Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+    return np.copy(image)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--width", type=int, default=1920, help="Frame width")
+    parser.add_argument("--height", type=int, default=1080, help="Frame height")
+    parser.add_argument("--frames", type=int, default=200, help="Frames to time per path")
+    parser.add_argument("--new_image_every", type=int, default=10, help="Frames between new unique images, the rest only change text")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    sources = [Image.fromarray(rng.integers(0, 255, (512, 512, 3), dtype=np.uint8)) for _ in range(8)]
+    variants = VariantCache(args.width, args.height)
+    images = [variants.get(source) for source in sources]
+
+    def pick(frame_number):
+        first = frame_number // args.new_image_every
+        return images[first % len(images)], [images[(first + i + 1) % len(images)] for i in range(6)]
+
+    start = time.perf_counter()
+    for n in range(args.frames):
+        center, sides = pick(n)
+        legacy_frame(center.center, [side.thumb for side in sides], args.width, args.height, f"{n} {TEXT}", BANNER)
+    legacy = args.frames / (time.perf_counter() - start)
+
+    compositor = Compositor(args.width, args.height)
+    start = time.perf_counter()
+    for n in range(args.frames):
+        center, sides = pick(n)
+        compositor.set_background(center, sides)
+        compositor.compose(f"{n} {TEXT}", BANNER)
+    layered = args.frames / (time.perf_counter() - start)
+
+    print(f"{args.width}x{args.height}, new image every {args.new_image_every} frames:")
+    print(f"  legacy     {legacy:7.1f} frames/sec")
+    print(f"  compositor {layered:7.1f} frames/sec, {compositor.metrics()}")
+
+if __name__ == "__main__":
+    main()
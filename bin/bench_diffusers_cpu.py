@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+
+## Benchmark diffusers text to image on the CPU, seconds per 512x512 image
+#
+# python bin/bench_diffusers_cpu.py [--hg_model stabilityai/sd-turbo] [--hg_dtype fp32 bf16] [--threads 8] [--images 4]
+#
+# Every dtype given is loaded and timed in turn, after a warmup render.
+#
+
+import os
+import sys
+import time
+import logging
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lifeAIdiffusers import DiffusersBackend, set_threads
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--hg_model", type=str, default="stabilityai/sd-turbo", help="Huggingface model to time")
+    parser.add_argument("--hg_dtype", type=str, nargs="+", default=["fp32", "bf16"], help="Precisions to compare")
+    parser.add_argument("--hg_scheduler", type=str, default="default", help="Scheduler: default, dpm, euler_a, unipc, lcm")
+    parser.add_argument("--hg_steps", type=int, default=0, help="Inference steps, 0 picks the model default")
+    parser.add_argument("--hg_lcm_lora", type=str, default="", help="LCM LoRA to fuse for few step generation")
+    parser.add_argument("--hg_compile", action="store_true", default=False, help="torch.compile the unet")
+    parser.add_argument("--threads", type=int, default=0, help="Torch CPU threads, 0 leaves the torch default")
+    parser.add_argument("--images", type=int, default=4, help="Images to time per dtype")
+    parser.add_argument("--width", type=int, default=512, help="Image width")
+    parser.add_argument("--height", type=int, default=512, help="Image height")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    set_threads(args.threads)
+
+    prompts = [f"groovy buddha segment {i} tibetan mountains at sunset" for i in range(args.images)]
+    for dtype in args.hg_dtype:
+        backend = DiffusersBackend(args.hg_model, device="cpu", dtype=dtype, nsfw=True, scheduler=args.hg_scheduler,
+                                   steps=args.hg_steps, lcm_lora=args.hg_lcm_lora, compile_unet=args.hg_compile)
+        warmup = backend.warmup(args.width, args.height)
+        start = time.perf_counter()
+        for prompt in prompts:
+            backend.generate([prompt], "", args.width, args.height)
+        elapsed = time.perf_counter() - start
+        print(f"{args.hg_model} {dtype} {backend.steps} steps {args.width}x{args.height}: "
+              f"warmup {warmup:.1f}s, {elapsed / len(prompts):.2f} seconds/image")
+        del backend
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+
+## Microbenchmark of lifeAItts speaker resolution on episode scripts
+#
+# python bin/bench_speakers.py [--script episode.txt ...] [--iterations 20]
+#
+# Compares the old per line regex + if/elif name chain + list scan voice lookup
+# against the precomputed SpeakerIndex / VoiceAllocator used by lifeAItts.
+#
+
+import os
+import sys
+import re
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lifeAIspeakers import SpeakerIndex, VoiceAllocator
+
+try:
+    import gender_guesser.detector as gender_guess
+except ImportError:
+    gender_guess = None
+
+SPEAKERS = ["narrator", "he-man", "skeletor", "teela", "goku", "santa_claus", "mrs_claus",
+            "sailor_moon", "amuro_ray", "buddha", "alice", "bob", "michael", "sarah", "scene", "title"]
+
+def synth_episode(lines=400):
+    """ Build an episode script shaped like the LLM output, one speaker line per segment """
+    words = "the quick brown fox jumps over the lazy dog while the groovy ai sings".split()
+    segments = []
+    for i in range(lines):
+        speaker = random.choice(SPEAKERS)
+        marker = random.choice(["", "", "", " [m]", " [f]"])
+        body = ' '.join(random.choice(words) for _ in range(random.randint(8, 40)))
+        if i % 7 == 0:
+            segments.append(f"{body}\n<<{speaker}>>{marker} {body}")
+        else:
+            segments.append(f"{speaker}:{marker} {body}\n{body}")
+    return segments
+
+def legacy_resolve(segments, male_voices, female_voices, detector):
+    """ The previous lifeAItts logic, kept here as the baseline """
+    speaker_map = {"narrator": {"gender": "female", "voice": female_voices[0]}}
+    male_voice_index = 0
+    female_voice_index = 0
+    for text in segments:
+        speaker_pattern = r'(?:(?:\[/INST\])?<<([A-Za-z0-9_\)\(\-]+)>>|^(?:\[\w+\])?([A-Za-z0-9_\)\(\-)]+):)'
+        for line in text.split('\n'):
+            speaker_match = re.search(speaker_pattern, line)
+            if speaker_match:
+                new_speaker = (speaker_match.group(1) or speaker_match.group(2)).strip().lower()
+                if new_speaker in ("opening_shot", "closing_shot", "next_episode_summary", "scene", "title", "episode", "question", "plotline", "host") and new_speaker not in speaker_map:
+                    speaker_map[new_speaker] = speaker_map["narrator"]
+                for speaker_key in speaker_map:
+                    if speaker_key in new_speaker or new_speaker in speaker_key:
+                        break
+                if new_speaker not in speaker_map:
+                    gender = None
+                    if re.search(r'\[m\]', line):
+                        gender = "male"
+                    elif re.search(r'\[f\]', line):
+                        gender = "female"
+                    elif re.search(r'\[n\]', line):
+                        gender = "nonbinary"
+                    if gender is None:
+                        if new_speaker in ("he-man", "skeletor", "shiva", "elon", "santa_claus", "santa", "goku", "amuro_ray", "amuro", "gundam_0079"):
+                            gender = "male"
+                        elif new_speaker in ("she-ra", "teela", "shakti", "sailor_moon", "mrs_claus", "excel"):
+                            gender = "female"
+                        elif detector:
+                            guessed_gender = detector.get_gender(new_speaker.split('_')[0])
+                            if guessed_gender in ['male', 'mostly_male']:
+                                gender = "male"
+                            elif guessed_gender in ['female', 'mostly_female']:
+                                gender = "female"
+                    if gender == "male":
+                        voice = male_voices[male_voice_index % len(male_voices)]
+                        male_voice_index += 1
+                    else:
+                        voice = female_voices[female_voice_index % len(female_voices)]
+                        female_voice_index += 1
+                    speaker_map[new_speaker] = {"voice": voice, "gender": gender or "female"}
+                else:
+                    voice = speaker_map[new_speaker]['voice']
+                    if voice not in female_voices and voice not in male_voices:
+                        voice = female_voices[0]
+                break
+
+def index_resolve(segments, speaker_index, voices):
+    allocator = VoiceAllocator(voices)
+    voice_map = allocator.table("bench", {"gender": "female", "voice": voices.default})
+    speaker_map = voice_map.speakers
+    for text in segments:
+        new_speaker, line = speaker_index.find_speaker(text)
+        if new_speaker:
+            if new_speaker in speaker_index.narrator_aliases and new_speaker not in speaker_map:
+                speaker_map[new_speaker] = speaker_map["narrator"]
+            entry = speaker_map.get(new_speaker)
+            if entry is None:
+                entry = voice_map.add(new_speaker, speaker_index.gender_of(new_speaker, line) or "female")
+            elif entry['voice'] not in voices:
+                voice_map.next_voice(entry['gender'])
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--script", type=str, nargs="*", default=[], help="Episode script files, segments separated by blank lines")
+    parser.add_argument("--speakers_file", type=str, default="speakers.json", help="Speaker table to load")
+    parser.add_argument("--service", type=str, default="mimic3", help="Voice list to use, mimic3 or openai")
+    parser.add_argument("--iterations", type=int, default=20, help="Passes over the episode scripts")
+    args = parser.parse_args()
+
+    random.seed(0)
+    segments = []
+    for path in args.script:
+        with open(path, 'r') as f:
+            segments.extend(s for s in f.read().split("\n\n") if s.strip())
+    if not segments:
+        segments = synth_episode()
+
+    detector = gender_guess.Detector(case_sensitive=False) if gender_guess else None
+    speaker_index = SpeakerIndex.from_file(args.speakers_file, detector)
+    voices = speaker_index.voices(args.service)
+
+    for name, fn, fn_args in [("legacy", legacy_resolve, (segments, voices.male, voices.female, detector)),
+                              ("index", index_resolve, (segments, speaker_index, voices))]:
+        start = time.perf_counter()
+        for _ in range(args.iterations):
+            fn(*fn_args)
+        elapsed = time.perf_counter() - start
+        per_segment = elapsed / (args.iterations * len(segments)) * 1e6
+        print(f"{name:8s} {len(segments)} segments x {args.iterations}: {elapsed:.3f}s total, {per_segment:.2f} us/segment")
+
+if __name__ == "__main__":
+    main()
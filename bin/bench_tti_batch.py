@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+
+## Benchmark batched sdwebui txt2img, images/sec versus batch size
+#
+# python bin/bench_tti_batch.py [--webui_url 127.0.0.1:7860] [--images 16] [--batch_sizes 1 2 4 8]
+#                               [--streams 1 4] [--segments 12] [--arrival 0.2]
+#
+# Without --webui_url a mock sdwebui (bin/mock_sdwebui.py) is started in process.
+# --streams also runs segments from that many answers at once through the TTI
+# coalescing queue, the batches it forms are what lifeAItti renders.
+#
+
+import os
+import sys
+import time
+import argparse
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import webuiapi
+import lifeAIsdwebui
+import mock_sdwebui
+from lifeAIttiQueue import ImageSlot, CoalescingQueue
+
+def run_streams(sdui_api, layout, streams, segments, arrival, batch_size, negative_prompt):
+    """ segments per answer arriving every arrival seconds for streams answers at once, rendered like lifeAItti does """
+    work_queue = CoalescingQueue()
+    slots = []
+    batches = {}
+
+    def produce():
+        for i in range(segments):
+            for stream in range(streams):
+                header = {"mediaid": f"answer{stream}", "segment_number": i}
+                slot = ImageSlot(header, f"groovy buddha answer {stream} segment {i} tibetan mountains at sunset")
+                slots.append(slot)
+                work_queue.put(slot)
+            time.sleep(arrival)
+
+    producer = threading.Thread(target=produce, daemon=True)
+    start = time.perf_counter()
+    producer.start()
+    rendered = 0
+    while producer.is_alive() or len(work_queue):
+        if not len(work_queue):
+            time.sleep(0.01)
+            continue
+        batch = work_queue.get_batch(batch_size)
+        batches[len(batch)] = batches.get(len(batch), 0) + 1
+        images = lifeAIsdwebui.txt2img_batch(sdui_api, [slot.prompt for slot in batch], negative_prompt, layout)
+        for slot, image in zip(batch, images):
+            slot.resolve(image, "generated")
+            rendered += 1
+    elapsed = time.perf_counter() - start
+    sizes = ", ".join(f"{count}x{size}" for size, count in sorted(batches.items()))
+    print(f"streams {streams} batch_size {batch_size}: {len(slots)} segments, {rendered} rendered in batches {sizes}, "
+          f"{work_queue.superseded} superseded, {rendered / elapsed:.2f} images/sec")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--webui_url", type=str, default="", help="sdwebui host:port, default starts the mock server")
+    parser.add_argument("--images", type=int, default=16, help="Images to render per batch size")
+    parser.add_argument("--batch_sizes", type=int, nargs="+", default=[1, 2, 4, 8], help="Batch sizes to compare")
+    parser.add_argument("--negative_prompt", type=str, default="Disfigured, cartoon, blurry", help="Negative prompt")
+    parser.add_argument("--streams", type=int, nargs="*", default=[], help="Answers at once to run through the coalescing queue, like 1 4")
+    parser.add_argument("--segments", type=int, default=12, help="Segments per answer for --streams")
+    parser.add_argument("--arrival", type=float, default=0.2, help="Seconds between segments of an answer for --streams")
+    args = parser.parse_args()
+
+    if args.webui_url:
+        host, port = args.webui_url.split(":")
+    else:
+        server, state = mock_sdwebui.serve("127.0.0.1", 0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        host, port = "127.0.0.1", server.server_port
+        print(f"Mock sdwebui: {state.call_overhead}s per call, {state.image_time}s per image, {state.batch_factor} batch factor")
+
+    sdui_api = webuiapi.WebUIApi(host=host, port=int(port), use_https=False)
+    layout = lifeAIsdwebui.batch_script_layout(sdui_api)
+    print(f"Batch script args: {layout}")
+
+    prompts = [f"groovy buddha segment {i} tibetan mountains at sunset" for i in range(args.images)]
+    for batch_size in args.batch_sizes:
+        start = time.perf_counter()
+        rendered = 0
+        for i in range(0, len(prompts), batch_size):
+            images = lifeAIsdwebui.txt2img_batch(sdui_api, prompts[i:i + batch_size], args.negative_prompt, layout)
+            rendered += sum(1 for image in images if image is not None)
+        elapsed = time.perf_counter() - start
+        print(f"batch_size {batch_size:2d}: {rendered} images in {elapsed:.2f}s, {rendered / elapsed:.2f} images/sec")
+
+    for streams in args.streams:
+        for batch_size in args.batch_sizes:
+            run_streams(sdui_api, layout, streams, args.segments, args.arrival, batch_size, args.negative_prompt)
+
+if __name__ == "__main__":
+    main()
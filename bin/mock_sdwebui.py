@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+
+## Mock Stable Diffusion WebUI API server for testing and benchmarking lifeAItti
+#
+# python bin/mock_sdwebui.py --port 7860 [--call_overhead 0.15] [--image_time 0.35] [--batch_factor 0.6]
+#
+# Serves the handful of /sdapi/v1 endpoints webuiapi uses. Jobs run one at a time
+# like sdwebui, each call costs call_overhead plus image_time for the first image
+# and image_time * batch_factor for every extra image in the batch.
+#
+
+import time
+import json
+import zlib
+import struct
+import base64
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+BATCH_SCRIPT = "prompts from file or textbox"
+
+def solid_png(width, height, color):
+    """ Encode a solid color RGB PNG with the standard library only """
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff)
+    row = b"\x00" + bytes(color) * width
+    raw = zlib.compress(row * height, 1)
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", raw) + chunk(b"IEND", b"")
+
+class MockState:
+    def __init__(self, call_overhead=0.15, image_time=0.35, batch_factor=0.6):
+        self.call_overhead = call_overhead
+        self.image_time = image_time
+        self.batch_factor = batch_factor
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.images = 0
+        self.options = {"sd_model_checkpoint": "sd_xl_turbo"}
+
+def make_handler(state):
+    class Handler(BaseHTTPRequestHandler):
+        def reply(self, payload):
+            body = json.dumps(payload).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            path = self.path.split("?")[0]
+            if path.endswith("/scripts"):
+                self.reply({"txt2img": [BATCH_SCRIPT], "img2img": [BATCH_SCRIPT]})
+            elif path.endswith("/script-info"):
+                self.reply([{"name": BATCH_SCRIPT, "is_alwayson": False, "is_img2img": False,
+                             "args": [{"label": "Iterate seed every line"}, {"label": "Use same random seed for all lines"},
+                                      {"label": "Insert prompts at the"}, {"label": "List of prompt inputs"}]}])
+            elif path.endswith("/progress"):
+                self.reply({"progress": 0.0, "state": {"job_count": 0}})
+            elif path.endswith("/sd-models"):
+                self.reply([{"title": "sd_xl_turbo", "model_name": "sd_xl_turbo", "sha256": ""}])
+            elif path.endswith("/options"):
+                self.reply(state.options)
+            else:
+                self.reply({})
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+            path = self.path.split("?")[0]
+            if path.endswith("/options"):
+                state.options.update(request)
+                self.reply(None)
+                return
+            if not path.endswith("/txt2img"):
+                self.reply({})
+                return
+
+            width = int(request.get("width", 512))
+            height = int(request.get("height", 512))
+            count = int(request.get("batch_size", 1)) * int(request.get("n_iter", 1))
+            if (request.get("script_name") or "").lower() == BATCH_SCRIPT:
+                lines = [line for line in str(request["script_args"][-1]).split("\n") if line.strip()]
+                count = len(lines) * int(request.get("batch_size", 1))
+
+            with state.lock:
+                time.sleep(state.call_overhead + state.image_time * (1 + (count - 1) * state.batch_factor))
+                state.calls += 1
+                state.images += count
+
+            images = [base64.b64encode(solid_png(width, height, ((i * 40) % 256, 64, 128))).decode() for i in range(count)]
+            if count > 1:
+                # sdwebui returns the batch grid first
+                images.insert(0, base64.b64encode(solid_png(width, height, (0, 0, 0))).decode())
+            self.reply({"images": images, "parameters": request, "info": json.dumps({"prompt": request.get("prompt", "")})})
+
+    return Handler
+
+def serve(host="127.0.0.1", port=7860, state=None):
+    state = state or MockState()
+    server = ThreadingHTTPServer((host, port), make_handler(state))
+    return server, state
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Host to listen on")
+    parser.add_argument("--port", type=int, default=7860, help="Port to listen on")
+    parser.add_argument("--call_overhead", type=float, default=0.15, help="Seconds of fixed cost per txt2img call")
+    parser.add_argument("--image_time", type=float, default=0.35, help="Seconds to render one image")
+    parser.add_argument("--batch_factor", type=float, default=0.6, help="Cost of each extra image in a batch relative to the first")
+    args = parser.parse_args()
+
+    server, state = serve(args.host, args.port, MockState(args.call_overhead, args.image_time, args.batch_factor))
+    print(f"Mock sdwebui listening on {args.host}:{server.server_port}")
+    server.serve_forever()
+
+if __name__ == "__main__":
+    main()
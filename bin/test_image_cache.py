@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+
+## Check the image cache index survives a crash, stores past the journal compaction then reloads without close()
+#
+# python bin/test_image_cache.py [--images 600]
+#
+
+import os
+import sys
+import shutil
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lifeAIimageCache import ImageCache
+
+def store_image(cache, i):
+    cache.store(f"groovy buddha segment {i} tibetan mountains at sunset", f"image {i}".encode())
+
+def check_reload(directory, expected, label):
+    # a crash, a copy of the files as they are now is opened while the cache is still open and unclosed
+    copy = directory + "_crash"
+    shutil.rmtree(copy, ignore_errors=True)
+    shutil.copytree(directory, copy)
+    reloaded = ImageCache(copy)
+    missing = set(expected) - set(reloaded.entries)
+    assert not missing, f"{label}: {len(missing)} of {len(expected)} images lost on reload"
+    extra = set(reloaded.entries) - set(expected)
+    assert not extra, f"{label}: {len(extra)} evicted images came back on reload"
+    reloaded.close()
+    shutil.rmtree(copy)
+    print(f"{label}: {len(expected)} images reloaded")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--images", type=int, default=600, help="Images to store, enough for a few 256 line journal compactions")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix="lifeai_image_cache_")
+    try:
+        # room for about a hundred images, each store past that also evicts one
+        cache = ImageCache(directory, max_bytes=1000)
+        compactions = 0
+        for i in range(args.images):
+            lines = cache.journal_lines
+            store_image(cache, i)
+            if cache.journal_lines <= lines:
+                compactions += 1
+                # the image whose store compacted must be in the rewritten index
+                check_reload(directory, list(cache.entries), f"compaction {compactions} at image {i}")
+        assert compactions, f"no compaction in {args.images} images, raise --images"
+        check_reload(directory, list(cache.entries), "after the last store")
+
+        # an eviction long enough to compact part way, the removed images must stay removed
+        cache.max_bytes = 1 << 30
+        for i in range(args.images, args.images + 200):
+            store_image(cache, i)
+        before = len(cache.entries)
+        cache.max_bytes = 100
+        store_image(cache, args.images + 200)
+        assert cache.journal_lines < before - len(cache.entries), "the eviction did not compact"
+        check_reload(directory, list(cache.entries), f"after evicting {before} images down to {len(cache.entries)}")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    print("ok")
+
+if __name__ == "__main__":
+    main()
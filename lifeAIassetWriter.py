@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+
+## Life AI asset writer, received segments saved in the background as their original bytes with a SQLite index
+#
+# Chris Kennedy 2023 (C) GPL
+#
+# Free to use for any use as in truly free software
+# as Richard Stallman intended it to be.
+#
+
+import os
+import json
+import queue
+import sqlite3
+import hashlib
+import logging
+import threading
+
+logger = logging.getLogger('lifeAIplayer')
+
+INDEX_SCHEMA = '''CREATE TABLE IF NOT EXISTS assets
+                  (mediaid TEXT,
+                   stream TEXT,
+                   segment INTEGER,
+                   timestamp REAL,
+                   hash TEXT,
+                   path TEXT,
+                   PRIMARY KEY (mediaid, stream, segment))'''
+
+def asset_extension(data, stream):
+    """ File extension from the bytes themselves, producers send PNG, JPEG or WebP images and WAV or AAC audio """
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        return ".png"
+    if data[:3] == b"\xff\xd8\xff":
+        return ".jpg"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return ".webp"
+    if data[:4] == b"RIFF" and data[8:12] == b"WAVE":
+        return ".wav"
+    if data[:2] in (b"\xff\xf1", b"\xff\xf9"):
+        return ".aac"
+    return ".png" if stream == "image" else ".wav"
+
+class AssetWriter(threading.Thread):
+    """ Saves received segments off the receive path.
+
+    save() only queues the header and the asset bytes as they came off the
+    wire, nothing is re-encoded. This thread writes the header as JSON next
+    to the asset like before, and the asset once per content hash: a resent
+    image or clip gets its own JSON and index row pointing at the file
+    already written. The index in directory/index.db has a row per segment
+    of (mediaid, stream, segment, timestamp, hash, path) for replay and
+    cleanup without walking the tree. When the queue is full the segment is
+    not saved rather than holding up playback.
+    """
+    def __init__(self, directory="assets", max_queue=256, commit_every=32):
+        super().__init__(name="asset_writer", daemon=True)
+        self.directory = directory
+        self.commit_every = commit_every
+        self.items = queue.Queue(maxsize=max_queue)
+        os.makedirs(directory, exist_ok=True)
+        self.index_path = os.path.join(directory, "index.db")
+
+        self.written = 0
+        self.deduplicated = 0
+        self.dropped = 0
+        self.bytes_written = 0
+        self.errors = 0
+
+    def save(self, header, asset):
+        """ Queue a segment to be saved, returns False if it was dropped """
+        try:
+            # a copy, the player keeps adding to its header while this thread dumps it
+            self.items.put_nowait((dict(header), asset))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            logger.error(f"Asset writer behind, not saving {header['stream']} segment #{header['segment_number']}.")
+            return False
+
+    def run(self):
+        # sqlite connections stay on the thread that made them
+        db = sqlite3.connect(self.index_path)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute(INDEX_SCHEMA)
+        db.execute("CREATE INDEX IF NOT EXISTS assets_hash ON assets (hash)")
+        db.commit()
+        pending = 0
+        while True:
+            item = self.items.get()
+            if item is None:
+                break
+            header, asset = item
+            try:
+                self.write(db, header, asset)
+                pending += 1
+            except Exception as e:
+                self.errors += 1
+                logger.error(f"Error saving {header.get('stream')} asset: {e}")
+            # one transaction for a burst of segments, committed once the burst is written
+            if pending >= self.commit_every or (pending and self.items.empty()):
+                db.commit()
+                pending = 0
+        db.commit()
+        db.close()
+        logger.info(f"Asset writer: {self.metrics()}")
+
+    def write(self, db, header, asset):
+        mediaid = header["mediaid"]
+        stream = header["stream"]
+        segment_number = header["segment_number"]
+        # images already carry the hash of their bytes as their id
+        content_hash = header.get("image_id") or hashlib.md5(asset).hexdigest()
+
+        directory = os.path.join(self.directory, str(mediaid), stream)
+        os.makedirs(directory, exist_ok=True)
+        name = f"{mediaid}_{stream}_{segment_number}"
+
+        row = db.execute("SELECT path FROM assets WHERE hash = ? LIMIT 1", (content_hash,)).fetchone()
+        if row is not None and os.path.exists(row[0]):
+            path = row[0]
+            self.deduplicated += 1
+        else:
+            path = os.path.join(directory, name + asset_extension(asset, stream))
+            with open(path, 'wb') as f:
+                f.write(asset)
+            self.written += 1
+            self.bytes_written += len(asset)
+
+        header["asset_path"] = path
+        header["asset_hash"] = content_hash
+        with open(os.path.join(directory, f"{name}.json"), 'w') as json_file:
+            json.dump(header, json_file)
+
+        db.execute("INSERT OR REPLACE INTO assets (mediaid, stream, segment, timestamp, hash, path) VALUES (?, ?, ?, ?, ?, ?)",
+                   (str(mediaid), stream, segment_number, header.get("timestamp"), content_hash, path))
+
+    def metrics(self):
+        return (f"{self.written} assets written {self.bytes_written / 1e6:.1f} MB, {self.deduplicated} deduplicated, "
+                f"{self.dropped} dropped, {self.errors} errors")
+
+    def stop(self):
+        if self.is_alive():
+            self.items.put(None)
+            self.join(timeout=10.0)
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+
+## Life AI audio helpers, silence trimming, loudness normalization and chunk crossfades
+#
+# Chris Kennedy 2023 (C) GPL
+#
+# Free to use for any use as in truly free software
+# as Richard Stallman intended it to be.
+#
+
+import io
+import wave
+import time
+import logging
+import threading
+import numpy as np
+
+logger = logging.getLogger('tts')
+
+def wav_to_pcm(wav_data):
+    """ Decode 16-bit WAV bytes into an int16 (frames, channels) array and the sample rate """
+    with wave.open(io.BytesIO(wav_data), 'rb') as wav_file:
+        channels = wav_file.getnchannels()
+        sample_rate = wav_file.getframerate()
+        sample_width = wav_file.getsampwidth()
+        frames = wav_file.readframes(wav_file.getnframes())
+    if sample_width != 2:
+        raise ValueError(f"Unsupported WAV sample width: {sample_width * 8} bits")
+    samples = np.frombuffer(frames, dtype=np.int16).reshape(-1, channels)
+    return samples, sample_rate
+
+def pcm_to_wav(samples, sample_rate):
+    """ Encode an int16 (frames, channels) array as WAV bytes """
+    wav_io = io.BytesIO()
+    with wave.open(wav_io, 'wb') as wav_file:
+        wav_file.setnchannels(samples.shape[1])
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(sample_rate)
+        wav_file.writeframes(np.ascontiguousarray(samples, dtype=np.int16).tobytes())
+    return wav_io.getvalue()
+
+def frame_energy_db(samples, sample_rate, frame_ms=10):
+    """ Mean square energy in dBFS per frame_ms frame, vectorized over the whole buffer """
+    frame = max(1, int(sample_rate * frame_ms / 1000))
+    n_frames = len(samples) // frame
+    if n_frames == 0:
+        return np.zeros(0, dtype=np.float32), frame
+    x = samples[:n_frames * frame].astype(np.float32) / 32768.0
+    energy = np.square(x).reshape(n_frames, -1).mean(axis=1)
+    return 10.0 * np.log10(energy + 1e-12), frame
+
+def trim_silence(samples, sample_rate, threshold_db=-45.0, pad_s=0.1, frame_ms=10):
+    """ Cut leading and trailing frames quieter than threshold_db, keeping pad_s seconds of air """
+    energy_db, frame = frame_energy_db(samples, sample_rate, frame_ms)
+    voiced = np.flatnonzero(energy_db > threshold_db)
+    if len(voiced) == 0:
+        return samples
+    pad = int(pad_s * sample_rate)
+    start = max(0, voiced[0] * frame - pad)
+    end = min(len(samples), (voiced[-1] + 1) * frame + pad)
+    return samples[start:end]
+
+def normalize(samples, sample_rate, target_db=-20.0, max_gain_db=20.0, ceiling_db=-1.0, threshold_db=-45.0, frame_ms=10):
+    """ RMS normalize the voiced frames to target_db then soft limit peaks under ceiling_db """
+    if len(samples) == 0:
+        return samples
+    energy_db, frame = frame_energy_db(samples, sample_rate, frame_ms)
+    voiced = energy_db[energy_db > threshold_db]
+    if len(voiced) == 0:
+        return samples
+
+    # loudness of the speech only, so pauses don't pull the gain up
+    rms_db = 10.0 * np.log10(np.mean(np.power(10.0, voiced / 10.0)))
+    gain_db = float(np.clip(target_db - rms_db, -max_gain_db, max_gain_db))
+
+    y = samples.astype(np.float32) * (10.0 ** (gain_db / 20.0) / 32768.0)
+
+    # soft knee limiter, linear below the knee then tanh into the ceiling
+    ceiling = 10.0 ** (ceiling_db / 20.0)
+    knee = ceiling * 0.8
+    magnitude = np.abs(y)
+    over = magnitude > knee
+    if over.any():
+        y[over] = np.sign(y[over]) * (knee + (ceiling - knee) * np.tanh((magnitude[over] - knee) / (ceiling - knee)))
+
+    return np.clip(np.rint(y * 32767.0), -32768, 32767).astype(np.int16)
+
+def equal_power_fades(length):
+    """ Fade out and fade in curves whose powers sum to one, so a crossfade keeps the level steady """
+    t = np.linspace(0.0, 1.0, length, dtype=np.float32) * (np.pi / 2)
+    return np.cos(t), np.sin(t)
+
+class OverlapAdd:
+    """ Stitch consecutive float chunks that overlap by overlap samples with an equal power crossfade.
+
+    The last overlap samples of each chunk are held back and mixed with the
+    start of the next chunk, which must cover the same stretch of time.
+    """
+    def __init__(self, overlap):
+        self.overlap = overlap
+        self.fade_out, self.fade_in = equal_power_fades(overlap)
+        self.tail = None
+
+    def push(self, chunk):
+        """ Samples ready to play, everything but the held back tail """
+        chunk = np.asarray(chunk, dtype=np.float32)
+        if self.overlap == 0:
+            return chunk
+        if self.tail is not None and len(chunk) >= self.overlap:
+            head = self.tail * self.fade_out + chunk[:self.overlap] * self.fade_in
+            chunk = np.concatenate([head, chunk[self.overlap:]])
+        elif self.tail is not None:
+            chunk = np.concatenate([self.tail, chunk])
+        if len(chunk) <= self.overlap:
+            self.tail = chunk[-self.overlap:]
+            return chunk[:0]
+        self.tail = chunk[-self.overlap:].copy()
+        return chunk[:-self.overlap]
+
+    def flush(self):
+        """ The held back tail, faded out, ending the stream """
+        if self.tail is None:
+            return np.zeros(0, dtype=np.float32)
+        tail = self.tail * self.fade_out[:len(self.tail)]
+        self.tail = None
+        return tail
+
+class DeadAirStats:
+    """ Running totals of seconds trimmed versus seconds sent, reported as seconds removed per hour """
+    def __init__(self, report_interval=300):
+        self.trimmed = 0.0
+        self.output = 0.0
+        self.segments = 0
+        self.process_time = 0.0
+        self.report_interval = report_interval
+        self.last_report = time.time()
+        self.lock = threading.Lock()
+
+    def add(self, input_seconds, output_seconds, process_time):
+        with self.lock:
+            self.trimmed += max(0.0, input_seconds - output_seconds)
+            self.output += output_seconds
+            self.process_time += process_time
+            self.segments += 1
+            report = time.time() - self.last_report >= self.report_interval
+            if report:
+                self.last_report = time.time()
+        if report:
+            self.report()
+
+    def per_hour(self):
+        if self.output <= 0:
+            return 0.0
+        return self.trimmed / (self.output / 3600.0)
+
+    def report(self):
+        logger.info(f"TTS Post: {self.segments} segments, {self.trimmed:.1f}s of dead air removed from {self.output:.1f}s sent, "
+                    f"{self.per_hour():.1f}s removed per hour, {self.process_time * 1000 / max(1, self.segments):.2f} ms/segment.")
+
+def postprocess(samples, sample_rate, args):
+    """ Trim silence and normalize loudness, args carry the lifeAItts command line settings """
+    samples = trim_silence(samples, sample_rate, args.silence_threshold, args.silence_pad)
+    return normalize(samples, sample_rate, args.target_loudness, args.max_gain, args.limiter_ceiling, args.silence_threshold)
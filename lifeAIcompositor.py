@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+
+## Life AI compositor, player frames assembled from a cached background layer and ROI text
+#
+# Chris Kennedy 2023 (C) GPL
+#
+# Free to use for any use as in truly free software
+# as Richard Stallman intended it to be.
+#
+
+import logging
+import textwrap
+import cv2
+import numpy as np
+from lifeAItextSprites import TextRenderer, TextStyle
+
+logger = logging.getLogger('lifeAIplayer')
+
+# Subtitle and banner styling, colors are RGB since frames stay RGB end to end
+SUBTITLE_STYLE = TextStyle(scale=2, thickness=6, border=15, shadow=(4, 4))
+BANNER_STYLE = TextStyle(scale=1, thickness=2, border=1, shadow=(2, -2), color=(0, 255, 255))
+
+class Compositor:
+    """ Player frame assembly in layers.
+
+    The background layer, the 16:9 collage of the current image with the
+    last six thumbnails or the current image fit to the frame, is built
+    only when the images on screen change. Each frame is one copy of the
+    background into a preallocated output buffer with the banner and
+    subtitle lines blended on top from cached text sprites.
+    A returned frame stays untouched for the next buffers - 1 compose() calls.
+    """
+    def __init__(self, width, height, font_path="", text_cache_mb=16, buffers=1):
+        self.width = width
+        self.height = height
+        self.thumb_size = height // 3
+        # side panels only fit when the frame is wide enough for a thumbnail column each side
+        self.collage = width - height >= 2 * self.thumb_size
+        self.background = np.zeros((height, width, 3), dtype=np.uint8)
+        self.outputs = [np.zeros_like(self.background) for _ in range(buffers)]
+        self.text = TextRenderer(font_path, text_cache_mb * 1024 * 1024)
+        self.background_key = None
+        self.backgrounds_built = 0
+        self.frames = 0
+
+    def set_background(self, center, sides=()):
+        """ Rebuild the background layer from ImageVariants if they differ from what is already there """
+        sides = list(sides)[:6]
+        collage = self.collage and len(sides) == 6
+        key = (center.image_id,) + tuple(side.image_id for side in sides) if collage else (center.image_id,)
+        if key == self.background_key:
+            return False
+
+        background = self.background
+        if collage:
+            background.fill(0)
+            size = self.thumb_size
+            for i, side in enumerate(sides):
+                x = 0 if i < 3 else self.width - size
+                y = (i % 3) * size
+                background[y:y + size, x:x + size] = np.asarray(side.thumb)
+            x = (self.width - self.height) // 2
+            background[:, x:x + self.height] = np.asarray(center.center)
+        else:
+            background[:] = np.asarray(center.frame)
+
+        self.background_key = key
+        self.backgrounds_built += 1
+        return True
+
+    def draw_banner(self, frame, banner):
+        banner = banner[:self.width - 10]
+        (_, text_height), _ = self.text.text_size(banner, BANNER_STYLE)
+        y = text_height + 10
+
+        # half dark strip behind the banner, blended in place over just those rows
+        strip = frame[:min(y + 11, self.height)]
+        cv2.convertScaleAbs(strip, dst=strip, alpha=0.5)
+        self.text.draw(frame, banner, BANNER_STYLE, (5, y))
+
+    def draw_subtitles(self, frame, text):
+        wrap_width = 50 if self.width > self.height else 30
+        lines = textwrap.wrap(text, width=wrap_width, fix_sentence_endings=False, break_long_words=False, break_on_hyphens=False)
+        y = self.height
+        for line in reversed(lines):
+            line = line[:self.width]
+            (text_width, text_height), baseline = self.text.text_size(line, SUBTITLE_STYLE)
+            y -= baseline + text_height + 10
+            self.text.draw(frame, line, SUBTITLE_STYLE, ((self.width - text_width) // 2, y))
+
+    def compose(self, text, banner=""):
+        """ RGB frame of the background with the banner and subtitles, in the next of the output buffers """
+        frame = self.outputs[self.frames % len(self.outputs)]
+        np.copyto(frame, self.background)
+        if banner:
+            self.draw_banner(frame, banner)
+        if text:
+            self.draw_subtitles(frame, text)
+        self.frames += 1
+        return frame
+
+    def metrics(self):
+        return f"{self.frames} frames composed, {self.backgrounds_built} backgrounds built, {self.text.metrics()}"
@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+
+## Life AI Huggingface diffusers backend for Text to Image, CPU, CUDA or Metal
+#
+# Chris Kennedy 2023 (C) GPL
+#
+# Free to use for any use as in truly free software
+# as Richard Stallman intended it to be.
+#
+
+import time
+import logging
+import torch
+from collections import OrderedDict
+
+logger = logging.getLogger('TTI')
+
+# --hg_scheduler names to diffusers scheduler classes, the few step ones matter most on CPU
+SCHEDULERS = {
+    "default": None,
+    "dpm": "DPMSolverMultistepScheduler",
+    "euler_a": "EulerAncestralDiscreteScheduler",
+    "unipc": "UniPCMultistepScheduler",
+    "lcm": "LCMScheduler",
+}
+
+# Distilled models that want a handful of steps and no classifier free guidance
+FEW_STEP_MODELS = ("turbo", "lcm", "lightning")
+
+def pick_device(metal=False, cuda=False):
+    if cuda and torch.cuda.is_available():
+        return "cuda"
+    if metal and torch.backends.mps.is_available():
+        return "mps"
+    if cuda or metal:
+        logger.error(f"Requested {'cuda' if cuda else 'mps'} is not available, running diffusers on the CPU.")
+    return "cpu"
+
+def pick_dtype(device, dtype="auto"):
+    """ fp16 weights only pay off on a GPU, the CPU wants fp32 or bf16 """
+    if dtype == "fp32":
+        return torch.float32
+    if dtype == "bf16":
+        return torch.bfloat16
+    if dtype == "fp16":
+        if device == "cpu":
+            logger.error("fp16 is not usable on the CPU, using fp32.")
+            return torch.float32
+        return torch.float16
+    return torch.float32 if device == "cpu" else torch.float16
+
+def set_threads(threads):
+    """ Pin torch's intra op threads, interop threads must be set before any torch work runs """
+    if threads <= 0:
+        return
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass
+
+class EmbeddingCache:
+    """ Negative prompt encoder outputs keyed by text and padded length, least recently used evicted by tensor memory """
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        tensor = self.entries.get(key)
+        if tensor is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return tensor
+
+    def put(self, key, tensor):
+        size = tensor.element_size() * tensor.nelement()
+        if size > self.max_bytes:
+            return
+        if key in self.entries:
+            self.total_bytes -= self.entries[key].element_size() * self.entries[key].nelement()
+        self.entries[key] = tensor
+        self.entries.move_to_end(key)
+        self.total_bytes += size
+        while self.total_bytes > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.total_bytes -= evicted.element_size() * evicted.nelement()
+
+    def metrics(self):
+        lookups = self.hits + self.misses
+        hit_rate = 100.0 * self.hits / lookups if lookups else 0.0
+        return f"hits {self.hits} misses {self.misses} ({hit_rate:.1f}% hit rate), {len(self.entries)} embeddings {self.total_bytes / 1e6:.1f} MB"
+
+class DiffusersBackend:
+    """ Diffusers text to image pipeline with device, precision and scheduler selection """
+    def __init__(self, model_id, device="cpu", dtype="auto", nsfw=False, scheduler="default", steps=0, guidance_scale=-1.0,
+                 lcm_lora="", attention_slicing=True, compile_unet=False, embedding_cache_mb=64):
+        from diffusers import AutoPipelineForText2Image
+
+        self.model_id = model_id
+        self.device = device
+        self.dtype = pick_dtype(device, dtype)
+        self.embeddings = EmbeddingCache(embedding_cache_mb * 1024 * 1024)
+
+        kwargs = {"torch_dtype": self.dtype}
+        if self.dtype == torch.float16:
+            kwargs["variant"] = "fp16"
+        if nsfw:
+            kwargs["safety_checker"] = None
+            kwargs["requires_safety_checker"] = False
+
+        start_time = time.time()
+        try:
+            self.pipe = AutoPipelineForText2Image.from_pretrained(model_id, **kwargs)
+        except (OSError, ValueError):
+            # not every model publishes an fp16 variant
+            kwargs.pop("variant", None)
+            self.pipe = AutoPipelineForText2Image.from_pretrained(model_id, **kwargs)
+
+        few_step = any(name in model_id.lower() for name in FEW_STEP_MODELS)
+        if lcm_lora:
+            self.pipe.load_lora_weights(lcm_lora)
+            self.pipe.fuse_lora()
+            scheduler = "lcm"
+            few_step = True
+
+        scheduler_class = SCHEDULERS.get(scheduler)
+        if scheduler not in SCHEDULERS:
+            logger.error(f"Unknown scheduler {scheduler}, keeping the model default. Choices: {', '.join(SCHEDULERS)}")
+        elif scheduler_class:
+            import diffusers
+            self.pipe.scheduler = getattr(diffusers, scheduler_class).from_config(self.pipe.scheduler.config)
+
+        # turbo/LCM models render in 1-4 steps and ignore guidance, regular ones want ~20 steps with guidance
+        self.steps = steps if steps > 0 else (4 if few_step else 20)
+        if guidance_scale >= 0:
+            self.guidance_scale = guidance_scale
+        else:
+            self.guidance_scale = (1.0 if lcm_lora else 0.0) if few_step else 7.5
+
+        self.pipe = self.pipe.to(device)
+        self.pipe.set_progress_bar_config(disable=True)
+        if attention_slicing:
+            self.pipe.enable_attention_slicing()
+        if device == "cpu":
+            self.pipe.unet.to(memory_format=torch.channels_last)
+        if compile_unet:
+            # cuda graphs only exist on the GPU
+            mode = "reduce-overhead" if device == "cuda" else "max-autotune-no-cudagraphs"
+            self.pipe.unet = torch.compile(self.pipe.unet, mode=mode, fullgraph=False)
+
+        logger.info(f"Diffusers {model_id} loaded on {device} {self.dtype} in {time.time() - start_time:.1f} seconds, "
+                    f"{type(self.pipe.scheduler).__name__} {self.steps} steps guidance {self.guidance_scale}.")
+
+    def encode_ids(self, input_ids):
+        """ Encoder output a 77 token window at a time, uncached as every segment's text is new """
+        max_length = self.pipe.tokenizer.model_max_length
+        return torch.cat([self.pipe.text_encoder(input_ids[i: i + max_length].unsqueeze(0).to(self.device))[0]
+                          for i in range(0, input_ids.shape[-1], max_length)], dim=1)
+
+    def encode_long_prompt(self, prompt, negative_prompt=""):
+        """ Prompt embeddings past the 77 token CLIP limit, encoded a window at a time """
+        tokenizer = self.pipe.tokenizer
+        max_length = tokenizer.model_max_length
+        prompt_length = len(tokenizer(prompt, truncation=False).input_ids)
+        negative_length = len(tokenizer(negative_prompt, truncation=False).input_ids)
+        # padded to whole windows like the pipeline pads to one, so the negative's key doesn't change with every prompt length
+        length = -(-max(prompt_length, negative_length) // max_length) * max_length
+        input_ids = tokenizer(prompt, truncation=False, padding="max_length", max_length=length, return_tensors="pt").input_ids[0]
+
+        # the negative prompt is the same every call, encode it once per window count
+        negative_key = ("negative", negative_prompt, length)
+        negative_prompt_embeds = self.embeddings.get(negative_key)
+        if negative_prompt_embeds is None:
+            negative_ids = tokenizer(negative_prompt, truncation=False, padding="max_length", max_length=length,
+                                     return_tensors="pt").input_ids[0]
+            negative_prompt_embeds = self.encode_ids(negative_ids)
+            self.embeddings.put(negative_key, negative_prompt_embeds)
+
+        prompt_embeds = self.encode_ids(input_ids)
+        logger.debug(f"Negative prompt embedding cache {self.embeddings.metrics()}")
+        return prompt_embeds, negative_prompt_embeds
+
+    def generate(self, prompts, negative_prompt="", width=512, height=512, extend_prompt=False):
+        """ PIL images for the prompts, in order """
+        options = {"num_inference_steps": self.steps, "guidance_scale": self.guidance_scale, "width": width, "height": height}
+        with torch.inference_mode():
+            if extend_prompt:
+                images = []
+                for prompt in prompts:
+                    prompt_embeds, negative_prompt_embeds = self.encode_long_prompt(prompt, negative_prompt)
+                    images.append(self.pipe(prompt_embeds=prompt_embeds, negative_prompt_embeds=negative_prompt_embeds,
+                                            **options).images[0])
+                return images
+            negative_prompts = [negative_prompt] * len(prompts) if negative_prompt else None
+            return self.pipe(prompts, negative_prompt=negative_prompts, **options).images
+
+    def warmup(self, width=512, height=512):
+        """ One throwaway render so the first real segment doesn't pay for allocation and compilation """
+        start_time = time.time()
+        self.generate(["warmup"], "", width, height)
+        elapsed = time.time() - start_time
+        logger.info(f"Diffusers warmup took {elapsed:.1f} seconds.")
+        return elapsed
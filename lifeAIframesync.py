@@ -12,61 +12,10 @@ import zmq
 import argparse
 import logging
 import time
-import queue
 import threading
-from queue import PriorityQueue
 import hashlib
-
-def sync_media_buffers(audio_buffer, music_buffer, image_buffer, sender, logger, max_delay):
-    master_clock = None  # Initialize the master clock to None
-    mux_pq = PriorityQueue()
-
-    while True:
-        try:
-            # Process music buffer
-            if not music_buffer.empty():
-                music_message, music_asset = music_buffer.get()
-                sender.send_json(music_message, zmq.SNDMORE)
-                sender.send(music_asset)
-                logger.info(f"Sent music segment #{music_message['segment_number']} at timestamp {music_message['timestamp']}")
-
-            if not image_buffer.empty():
-                if media_type == 'image':
-                    image_message, image_asset = image_buffer.get()
-                    sender.send_json(image_message, zmq.SNDMORE)
-                    sender.send(image_asset)
-                    logger.info(f"Sent {media_type} segment #{image_message['segment_number']} at timestamp {image_message['timestamp']}")
-                    master_clock = image_message['timestamp']
-
-            # Process audio and image buffers
-            if not mux_pq.empty() or (not audio_buffer.empty()):
-                if not audio_buffer.empty():
-                    audio_message, audio_asset = audio_buffer.get()
-                    mux_pq.put((audio_message['timestamp'], ('audio', audio_message, audio_asset)))
-              
-                # Send out assets in timestamp order, waiting for images to catch up to audio
-                if not mux_pq.empty():
-                    _, (media_type, message, asset) = mux_pq.get()
-                    current_time = time.time()
-
-                    if media_type == 'audio' and (master_clock is None or message['timestamp'] <= master_clock):
-                        sender.send_json(message, zmq.SNDMORE)
-                        sender.send(asset)
-                        logger.info(f"Sent {media_type} segment #{message['segment_number']} at timestamp {message['timestamp']}")
-                        master_clock = message['timestamp']
-                        continue
-
-                    # Check for delay
-                    if current_time - message['timestamp'] > max_delay:
-                        logger.warning(f"Dropping {media_type} segment #{message['segment_number']} due to high delay.")
-                    else:
-                        # queue the audio again
-                        mux_pq.put((message['timestamp'], (media_type, message, asset)))
-
-                    time.sleep(0.01)  # Sleep to prevent CPU overuse
-
-        except Exception as e:
-            logger.error(f"Error while syncing media buffers: {e}")
+from lifeAImux import MuxEngine
+from lifeAItimeline import PresentationTimeline
 
 def main():
     while True:
@@ -120,43 +69,14 @@ def main():
             logger.error(f"Framesync: No stream type in header message: {header_message}")
             continue
 
-        timestamp = 0
-        duration = 0
-        is_audio = False
-        is_music = False
-        is_image = False
-        if 'duration' in header_message:
-            duration = "%d" % int(header_message["duration"])
-        if 'timestamp' in header_message:
-            timestamp = "%d" % int(header_message["timestamp"])
-
-        type = header_message["stream"]
-        if type == "speek":
-            is_audio = True
-        elif type == "music":
-            is_music = True
-        elif type == "image":
-            is_image = True
-        else:
-            logger.error(f"Unknown type: {type}")
+        if header_message["stream"] not in ("speek", "music", "image"):
+            logger.error(f"Unknown type: {header_message['stream']}")
             continue
 
-        ## buffer messages till we have one audio, one music, and one image
-        ## once we have all three, send them out in order
-        ## use the timestamp and segment number to sync them up
-        ## duplicate frames if necessary
-        ## duplicate the music and send it continusouly till a new one comes in too
-        ## do not repeat the audio though, just send it once
-        # Add the received messages to the appropriate buffers
-        if is_audio:
-            audio_buffer.put((header_message, asset))
-        elif is_music:
-            music_buffer.put((header_message, asset))
-        elif is_image:
-            image_buffer.put((header_message, asset))
-
-        logger.info(f"Framesync: {type} buffered segment #{segment_number} timestamp {timestamp}")
-      
+        # the mux pairs speech with images per mediaid and sends them out in order
+        mux.add(header_message, asset)
+        logger.debug(f"Framesync: {stream} buffered segment #{segment_number} timestamp {timestamp}")
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--input_port", type=int, default=6002, required=False, help="Port for receiving text input")
@@ -164,10 +84,17 @@ if __name__ == "__main__":
     parser.add_argument("--input_host", type=str, default="127.0.0.1", required=False, help="Port for receiving text input")
     parser.add_argument("--output_host", type=str, default="127.0.0.1", required=False, help="Port for sending image output")
     parser.add_argument("-ll", "--loglevel", type=str, default="info", help="Logging level: debug, info...")
-    parser.add_argument("--max_delay", type=int, default=60, help="Maximum allowed delay in seconds for image frames before they are dropped")
-    parser.add_argument("--nopassthrough", action="store_true", help="Pass through all messages without synchronization")
-    parser.add_argument("--max_segment_diff", type=int, default=2, help="Maximum allowed segment number difference before older segments are skipped")
-    parser.add_argument("--buffer_delay", type=int, default=0, help="Delay in seconds to buffer messages before sending them out")
+    parser.add_argument("--max_delay", type=int, default=60, help="Maximum allowed delay in seconds for speech segments before they are dropped")
+    parser.add_argument("--nopassthrough", action="store_true", help="Mux speech with images per mediaid instead of passing every message straight through")
+    parser.add_argument("--max_segment_diff", type=int, default=2, help="Maximum segment number difference for pairing speech with an earlier image, older images are dropped")
+    parser.add_argument("--buffer_delay", type=float, default=2.0, help="Seconds speech waits for its own image before pairing with the nearest or last image")
+    parser.add_argument("--report_interval", type=int, default=300, help="Seconds between pairing reports")
+    parser.add_argument("--timeline", action="store_true", default=False, help="Also publish the muxed segments as a constant frame rate timeline with PTS, implies --nopassthrough")
+    parser.add_argument("--timeline_host", type=str, default="127.0.0.1", help="Host for the timeline output")
+    parser.add_argument("--timeline_port", type=int, default=6005, help="Port for the timeline output")
+    parser.add_argument("--fps", type=float, default=30.0, help="Timeline frames per second")
+    parser.add_argument("--sample_rate", type=int, default=48000, help="Timeline audio sample rate")
+    parser.add_argument("--audio_block", type=int, default=0, help="Timeline samples per audio block, 0 is one frame of audio")
     args = parser.parse_args()
 
     LOGLEVEL = logging.INFO
@@ -200,14 +127,33 @@ if __name__ == "__main__":
     logger.info("binded to ZMQ out: %s:%d" % (args.output_host, args.output_port))
     sender.bind(f"tcp://{args.output_host}:{args.output_port}")
 
-    if not args.nopassthrough:
-        # Define the buffer queues for each media type
-        audio_buffer = queue.Queue()
-        music_buffer = queue.Queue()
-        image_buffer = queue.Queue()
+    if args.timeline and not args.nopassthrough:
+        logger.info("Timeline output needs the mux, enabling --nopassthrough.")
+        args.nopassthrough = True
+
+    timeline = None
+    if args.timeline:
+        timeline_sender = context.socket(zmq.PUB)
+        logger.info("binded to ZMQ timeline out: %s:%d" % (args.timeline_host, args.timeline_port))
+        timeline_sender.bind(f"tcp://{args.timeline_host}:{args.timeline_port}")
+
+        def emit_timeline(header_message, payload):
+            timeline_sender.send_json(header_message, zmq.SNDMORE)
+            timeline_sender.send(payload)
+
+        timeline = PresentationTimeline(emit_timeline, args.fps, args.sample_rate, block_size=args.audio_block)
+        threading.Thread(target=timeline.run, daemon=True).start()
+
+    mux = None
+    if args.nopassthrough:
+        def emit(header_message, asset):
+            sender.send_json(header_message, zmq.SNDMORE)
+            sender.send(asset)
+            if timeline is not None:
+                timeline.add(header_message, asset)
 
-        # Start the sync_media_buffers function in a separate thread
-        threading.Thread(target=sync_media_buffers, args=(audio_buffer, music_buffer, image_buffer, sender, logger, args.max_delay), daemon=True).start()
+        mux = MuxEngine(emit, args.buffer_delay, args.max_delay, args.max_segment_diff, report_interval=args.report_interval)
+        threading.Thread(target=mux.run, daemon=True).start()
 
     main()
 
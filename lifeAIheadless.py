@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+
+## Life AI headless output, player frames and mixed audio into ffmpeg or a raw frame pipe
+#
+# Chris Kennedy 2023 (C) GPL
+#
+# Free to use for any use as in truly free software
+# as Richard Stallman intended it to be.
+#
+
+import os
+import sys
+import time
+import queue
+import shlex
+import logging
+import threading
+import subprocess
+import numpy as np
+
+logger = logging.getLogger('lifeAIplayer')
+
+FFMPEG_OPTIONS = "-c:v libx264 -preset veryfast -pix_fmt yuv420p -g 60 -c:a aac -b:a 160k"
+
+def ffmpeg_command(ffmpeg, output, width, height, fps, sample_rate, channels, audio_fd=None, options=FFMPEG_OPTIONS):
+    """ ffmpeg reading raw RGB frames on stdin and float PCM on audio_fd, encoding to a file, RTMP or HLS """
+    command = [ffmpeg, "-hide_banner", "-loglevel", "warning", "-y",
+               "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{width}x{height}", "-r", str(fps), "-i", "pipe:0"]
+    if audio_fd is not None:
+        command += ["-f", "f32le", "-ar", str(sample_rate), "-ac", str(channels), "-i", f"/dev/fd/{audio_fd}"]
+    command += shlex.split(options)
+    if output.startswith("rtmp://") or output.startswith("rtmps://"):
+        command += ["-f", "flv"]
+    elif output.endswith(".m3u8"):
+        command += ["-f", "hls", "-hls_time", "4", "-hls_list_size", "10", "-hls_flags", "delete_segments"]
+    return command + [output]
+
+class PipeWriter(threading.Thread):
+    """ Writes queued buffers to a file object, so encoding the video never waits on the audio or the other way """
+    def __init__(self, pipe, name, max_buffers=8):
+        super().__init__(name=name, daemon=True)
+        self.pipe = pipe
+        self.buffers = queue.Queue(maxsize=max_buffers)
+        self.error = None
+
+    def write(self, data):
+        # blocks while the reader is behind, output is never dropped
+        self.buffers.put(data)
+
+    def run(self):
+        while True:
+            data = self.buffers.get()
+            if data is None:
+                break
+            if self.error is not None:
+                continue
+            try:
+                self.pipe.write(data)
+            except (BrokenPipeError, OSError) as e:
+                self.error = e
+                logger.error(f"Headless: {self.name} pipe closed: {e}")
+
+    def close(self):
+        self.buffers.put(None)
+        self.join(timeout=10.0)
+        try:
+            self.pipe.close()
+        except OSError:
+            pass
+
+class HeadlessSink(threading.Thread):
+    """ Player output with no display or sound card, for render servers and CI.
+
+    Like the NDI sender, the current frame goes out at a fixed fps with the
+    audio pulled from audio_source, like Mixer.mix, one frame's worth at a
+    time, so the player runs on the same clock and schedule as live. Frames
+    and audio go into an ffmpeg process encoding to a file, RTMP or HLS, or
+    with raw set only the RGB frames go to output, a path, named pipe or -
+    for stdout, the audio left to the mixer's taps.
+
+    speed paces the clock at that many times realtime, 0 runs as fast as the
+    output is taken, and off realtime the clock starts with the first frame.
+    After duration seconds of output, if set, it stops.
+    """
+    def __init__(self, output, width, height, fps=30.0, sample_rate=48000, channels=2, audio_source=None,
+                 speed=1.0, duration=0.0, raw=False, ffmpeg="ffmpeg", options=FFMPEG_OPTIONS):
+        super().__init__(daemon=True)
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.audio_source = audio_source
+        self.speed = speed
+        self.duration = duration
+        self.lock = threading.Lock()
+        self.running = True
+
+        # the player writes the back buffer, this thread sends the front one
+        self.front = np.zeros((height, width, 3), dtype=np.uint8)
+        self.back = np.zeros_like(self.front)
+        self.frame_ready = False
+
+        self.process = None
+        self.audio = None
+        if raw:
+            self.video = PipeWriter(sys.stdout.buffer if output == "-" else open(output, "wb"), "video")
+        else:
+            audio_fd = None
+            if audio_source is not None:
+                audio_fd, audio_write = os.pipe()
+            command = ffmpeg_command(ffmpeg, output, width, height, fps, sample_rate, channels, audio_fd, options)
+            logger.info(f"Headless: {' '.join(command)}")
+            self.process = subprocess.Popen(command, stdin=subprocess.PIPE, pass_fds=() if audio_fd is None else (audio_fd,))
+            self.video = PipeWriter(self.process.stdin, "video")
+            if audio_fd is not None:
+                os.close(audio_fd)
+                self.audio = PipeWriter(os.fdopen(audio_write, "wb"), "audio")
+        self.video.start()
+        if self.audio is not None:
+            self.audio.start()
+
+        self.frames_sent = 0
+        self.samples_sent = 0
+        self.stalls = 0
+        self.start_time = None
+
+    def set_frame(self, image):
+        """ Show an RGB frame from now on, a copy is taken so the caller can reuse its buffer """
+        image = np.asarray(image)
+        with self.lock:
+            np.copyto(self.back, image[:, :, :3])
+            self.frame_ready = True
+
+    def media_time(self):
+        return self.frames_sent / self.fps
+
+    def send_frame(self):
+        with self.lock:
+            if self.frame_ready:
+                self.front, self.back = self.back, self.front
+                self.frame_ready = False
+        # tobytes copies, the writer can hold it while the front buffer is swapped again
+        self.video.write(self.front.tobytes())
+
+        if self.audio_source is not None:
+            # whole samples per frame, counted from the start so fractional frame rates don't drift
+            samples = int(round((self.frames_sent + 1) * self.sample_rate / self.fps)) - self.samples_sent
+            block = self.audio_source(samples)
+            if self.audio is not None:
+                self.audio.write(np.ascontiguousarray(block, dtype=np.float32).tobytes())
+            self.samples_sent += samples
+        self.frames_sent += 1
+
+    def run(self):
+        # an offline render starts with the first frame rather than running through silence until it comes
+        while self.running and self.speed != 1.0 and not self.frame_ready:
+            time.sleep(0.01)
+        start = time.perf_counter()
+        self.start_time = time.time()
+        while self.running:
+            if self.duration and self.media_time() >= self.duration:
+                break
+            if self.speed > 0:
+                due = start + self.frames_sent / (self.fps * self.speed)
+                now = time.perf_counter()
+                if now < due:
+                    time.sleep(due - now)
+                    continue
+                if now - due > 1.0:
+                    # stalled, move the clock instead of bursting frames, the output stays continuous just later
+                    start += now - due
+                    self.stalls += 1
+                    logger.error(f"Headless: {now - due:.1f} seconds behind, moving the clock.")
+            self.send_frame()
+        self.running = False
+        logger.info(f"Headless: {self.metrics()}")
+
+    def metrics(self):
+        elapsed = time.time() - self.start_time if self.start_time else 0.0
+        speed = self.media_time() / elapsed if elapsed > 0 else 0.0
+        return f"headless sent {self.frames_sent} frames, {self.media_time():.1f}s of media at {speed:.2f}x realtime, {self.stalls} stalls"
+
+    def stop(self):
+        self.running = False
+        if self.is_alive():
+            self.join(timeout=5.0)
+        self.video.close()
+        if self.audio is not None:
+            self.audio.close()
+        if self.process is not None:
+            try:
+                self.process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
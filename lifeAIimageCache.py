@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+
+## Life AI prompt similarity image cache for Text to Image
+#
+# Chris Kennedy 2023 (C) GPL
+#
+# Free to use for any use as in truly free software
+# as Richard Stallman intended it to be.
+#
+
+import io
+import os
+import re
+import json
+import time
+import zlib
+import random
+import hashlib
+import logging
+import numpy as np
+
+logger = logging.getLogger('TTI')
+
+STOPWORDS = frozenset("""a an and are as at be but by for from has have he her his i in is it its me my of on or our
+she so that the their them they this to was we were what when where which who will with you your""".split())
+
+TOKEN_PATTERN = re.compile(r'[a-z0-9]+')
+
+# Mersenne prime for the minhash permutations, fits the products in uint64 with 32 bit hashes
+MINHASH_PRIME = (1 << 61) - 1
+
+def prompt_tokens(prompt):
+    """ Normalized token set of a prompt, lower case words without stopwords or single letters """
+    return frozenset(token for token in TOKEN_PATTERN.findall(prompt.lower()) if len(token) > 1 and token not in STOPWORDS)
+
+def jaccard(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+class MinHasher:
+    """ MinHash signatures of token sets, banded for locality sensitive lookup """
+    def __init__(self, num_perm=64, bands=16, seed=1):
+        rng = np.random.RandomState(seed)
+        self.a = rng.randint(1, 1 << 31, size=num_perm).astype(np.uint64)
+        self.b = rng.randint(0, 1 << 31, size=num_perm).astype(np.uint64)
+        self.bands = bands
+        self.rows = num_perm // bands
+
+    def signature(self, tokens):
+        hashes = np.array([zlib.crc32(token.encode()) for token in tokens] or [0], dtype=np.uint64)
+        return ((self.a[:, None] * hashes[None, :] + self.b[:, None]) % MINHASH_PRIME).min(axis=1)
+
+    def band_keys(self, signature):
+        return [f"{band}:{hashlib.md5(signature[band * self.rows:(band + 1) * self.rows].tobytes()).hexdigest()[:16]}"
+                for band in range(self.bands)]
+
+class ImageCache:
+    """ On disk cache of generated images indexed by prompt signature.
+
+    A prompt whose token set is at least threshold Jaccard similar to a cached
+    prompt generated within window seconds reuses that image. Storage is
+    bounded by max_bytes with least recently used eviction.
+    """
+    def __init__(self, directory, max_bytes=512 * 1024 * 1024, threshold=0.7, window=3600, vary=False):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.threshold = threshold
+        self.window = window
+        self.vary = vary
+        self.hasher = MinHasher()
+        self.entries = {}
+        self.buckets = {}
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+        self.index_path = os.path.join(directory, "index.json")
+        self.journal_path = os.path.join(directory, "index.journal")
+        self.journal = None
+        self.journal_lines = 0
+        self.load()
+
+    def load(self):
+        saved = {}
+        if os.path.exists(self.index_path):
+            try:
+                with open(self.index_path, 'r') as f:
+                    saved = json.load(f)
+            except Exception as e:
+                logger.error(f"Image cache index unreadable, starting empty: {e}")
+        # replay what was stored and evicted since the index was last written
+        replayed = 0
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, 'r') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # a line cut short by a crash
+                        continue
+                    if "add" in record:
+                        saved[record["add"]] = record["entry"]
+                    else:
+                        saved.pop(record.get("remove"), None)
+                    replayed += 1
+        for key, entry in saved.items():
+            if os.path.exists(os.path.join(self.directory, entry["file"])):
+                self.add_entry(key, entry)
+        if replayed:
+            self.save()
+        logger.info(f"Image cache loaded {len(self.entries)} images, {self.total_bytes / 1e6:.1f} MB.")
+
+    def save(self):
+        """ Write the whole index and start an empty journal """
+        saved = {key: saved_entry(entry) for key, entry in self.entries.items()}
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(saved, f)
+        os.replace(tmp_path, self.index_path)
+        if self.journal is not None:
+            self.journal.close()
+        self.journal = open(self.journal_path, 'w')
+        self.journal_lines = 0
+
+    def append(self, record):
+        """ One change to the index, appended to the journal so a store costs the same at any cache size.
+
+        The index is rewritten once the journal is longer than the cache,
+        so the rewrites cost a constant amount per store on average and the
+        journal never holds more than a cache worth of lines. Call it once
+        the change is in self.entries, a rewrite here saves self.entries and
+        empties the journal, a record not yet applied would be lost.
+        """
+        if self.journal is None:
+            self.journal = open(self.journal_path, 'a')
+        self.journal.write(json.dumps(record) + "\n")
+        self.journal.flush()
+        self.journal_lines += 1
+        if self.journal_lines > max(256, len(self.entries)):
+            self.save()
+
+    def add_entry(self, key, entry):
+        entry["token_set"] = frozenset(entry["tokens"])
+        self.entries[key] = entry
+        self.total_bytes += entry["size"]
+        for band_key in entry["bands"]:
+            self.buckets.setdefault(band_key, set()).add(key)
+
+    def remove_entry(self, key):
+        entry = self.entries.pop(key)
+        self.total_bytes -= entry["size"]
+        for band_key in entry["bands"]:
+            bucket = self.buckets.get(band_key)
+            if bucket:
+                bucket.discard(key)
+                if not bucket:
+                    del self.buckets[band_key]
+        try:
+            os.remove(os.path.join(self.directory, entry["file"]))
+        except OSError:
+            pass
+        self.append({"remove": key})
+
+    def lookup(self, prompt):
+        """ Cached image bytes for a near duplicate prompt, or None """
+        tokens = prompt_tokens(prompt)
+        band_keys = self.hasher.band_keys(self.hasher.signature(tokens))
+        candidates = set()
+        for band_key in band_keys:
+            candidates |= self.buckets.get(band_key, set())
+
+        now = time.time()
+        best_key, best_similarity = None, 0.0
+        for key in candidates:
+            entry = self.entries[key]
+            if now - entry["created"] > self.window:
+                continue
+            similarity = jaccard(tokens, entry["token_set"])
+            if similarity > best_similarity:
+                best_key, best_similarity = key, similarity
+
+        if best_key is None or best_similarity < self.threshold:
+            self.misses += 1
+            return None
+
+        entry = self.entries[best_key]
+        try:
+            with open(os.path.join(self.directory, entry["file"]), 'rb') as f:
+                image = f.read()
+        except OSError:
+            self.remove_entry(best_key)
+            self.misses += 1
+            return None
+
+        entry["last_used"] = now
+        self.hits += 1
+        logger.info(f"Image cache hit {best_similarity:.2f} similar to '{entry['prompt'][:60]}', {self.metrics()}")
+        if self.vary:
+            image = vary_image(image)
+        return image
+
+    def store(self, prompt, image):
+        tokens = prompt_tokens(prompt)
+        key = hashlib.md5(image).hexdigest()
+        if key in self.entries:
+            self.entries[key]["last_used"] = time.time()
+            return
+        file_name = f"{key}.png"
+        with open(os.path.join(self.directory, file_name), 'wb') as f:
+            f.write(image)
+        now = time.time()
+        entry = {"file": file_name, "prompt": prompt[:200], "tokens": sorted(tokens),
+                 "bands": self.hasher.band_keys(self.hasher.signature(tokens)),
+                 "size": len(image), "created": now, "last_used": now}
+        self.add_entry(key, entry)
+        self.append({"add": key, "entry": saved_entry(entry)})
+        self.evict()
+
+    def evict(self):
+        if self.total_bytes <= self.max_bytes:
+            return
+        for key in sorted(self.entries, key=lambda key: self.entries[key]["last_used"]):
+            if self.total_bytes <= self.max_bytes:
+                break
+            self.remove_entry(key)
+
+    def close(self):
+        """ Write the index with the latest use times, the journal only has them as of each store """
+        self.save()
+        self.journal.close()
+        self.journal = None
+
+    def metrics(self):
+        lookups = self.hits + self.misses
+        hit_rate = 100.0 * self.hits / lookups if lookups else 0.0
+        return f"hits {self.hits} misses {self.misses} ({hit_rate:.1f}% hit rate), {len(self.entries)} images {self.total_bytes / 1e6:.1f} MB"
+
+def saved_entry(entry):
+    # the token set is rebuilt from the token list on load
+    return {k: v for k, v in entry.items() if k != "token_set"}
+
+def vary_image(image):
+    """ Light variation of a cached image, a mirror and a small zoom so repeats don't look identical """
+    from PIL import Image, ImageOps
+    pil_image = Image.open(io.BytesIO(image)).convert('RGB')
+    if random.random() < 0.5:
+        pil_image = ImageOps.mirror(pil_image)
+    width, height = pil_image.size
+    zoom = random.uniform(0.9, 0.97)
+    crop_w, crop_h = int(width * zoom), int(height * zoom)
+    left = random.randint(0, width - crop_w)
+    top = random.randint(0, height - crop_h)
+    pil_image = pil_image.crop((left, top, left + crop_w, top + crop_h)).resize((width, height), Image.LANCZOS)
+    img_byte_arr = io.BytesIO()
+    pil_image.save(img_byte_arr, format='PNG')
+    return img_byte_arr.getvalue()
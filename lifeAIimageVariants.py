@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+
+## Life AI image variants, pre-scaled copies of each image made once and cached by image id
+#
+# Chris Kennedy 2023 (C) GPL
+#
+# Free to use for any use as in truly free software
+# as Richard Stallman intended it to be.
+#
+
+import hashlib
+import threading
+from collections import OrderedDict
+from PIL import Image
+
+def image_id(data):
+    """ Content id of the encoded image bytes as received off the wire """
+    return hashlib.md5(data).hexdigest()
+
+def pil_image_id(image):
+    """ Content id for an image we only have decoded, like a locally generated one """
+    return hashlib.md5(image.tobytes()).hexdigest()
+
+def fit_to_frame(image, width, height, resample=Image.BILINEAR):
+    """ Scale to fit inside width x height keeping the aspect ratio, letterboxed in black """
+    scale = min(width / image.width, height / image.height)
+    new_width, new_height = int(image.width * scale), int(image.height * scale)
+    scaled = image.convert('RGB').resize((new_width, new_height), resample)
+    if (new_width, new_height) == (width, height):
+        return scaled
+    frame = Image.new('RGB', (width, height))
+    frame.paste(scaled, ((width - new_width) // 2, (height - new_height) // 2))
+    return frame
+
+class LRUCache:
+    """ Small thread safe least recently used cache, values are built by make() on a miss.
+
+    With max_bytes and a size function it is also bounded by the memory its values hold.
+    """
+    def __init__(self, max_entries=32, max_bytes=0, size=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size = size
+        self.total_bytes = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, make):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            self.misses += 1
+        value = make()
+        with self.lock:
+            if key in self.entries:
+                self.total_bytes -= self.size(self.entries[key]) if self.size else 0
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            self.total_bytes += self.size(value) if self.size else 0
+            while len(self.entries) > self.max_entries or (self.max_bytes and self.total_bytes > self.max_bytes and len(self.entries) > 1):
+                _, evicted = self.entries.popitem(last=False)
+                self.total_bytes -= self.size(evicted) if self.size else 0
+        return value
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.entries
+
+class ImageVariants:
+    """ The sizes of one image the player composes with """
+    def __init__(self, image_id, source, center, thumb, frame):
+        self.image_id = image_id
+        self.source = source
+        self.center = center  # square, full frame height for the middle of the collage
+        self.thumb = thumb    # square, a third of the frame height for the side panels
+        self.frame = frame    # letterboxed to the full frame for when there is no collage
+
+class VariantCache:
+    """ Builds the center, thumbnail and full frame variants once per image id """
+    def __init__(self, width, height, max_entries=32):
+        self.width = width
+        self.height = height
+        self.center_size = height
+        self.thumb_size = height // 3
+        self.cache = LRUCache(max_entries)
+
+    def make(self, key, image):
+        image = image.convert('RGB')
+        center = image.resize((self.center_size, self.center_size), Image.LANCZOS)
+        # thumbnails come from the already scaled center, same quality and a fraction of the work
+        thumb = center.resize((self.thumb_size, self.thumb_size), Image.LANCZOS)
+        frame = fit_to_frame(image, self.width, self.height)
+        return ImageVariants(key, image, center, thumb, frame)
+
+    def get(self, image, key=None):
+        if key is None:
+            key = pil_image_id(image)
+        return self.cache.get(key, lambda: self.make(key, image))
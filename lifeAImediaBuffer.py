@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+
+## Life AI media buffer, segments queued within a memory budget with the overflow spilled to a mapped file
+#
+# Chris Kennedy 2023 (C) GPL
+#
+# Free to use for any use as in truly free software
+# as Richard Stallman intended it to be.
+#
+
+import mmap
+import queue
+import logging
+import tempfile
+import threading
+from collections import deque
+
+logger = logging.getLogger('lifeAIplayer')
+
+# first size of a spill file, it doubles as it needs to up to spill_bytes
+SPILL_CHUNK = 64 * 1024 * 1024
+
+class SpillFile:
+    """ Temporary file mapped into memory, written at the end and emptied all at once.
+
+    Buffers are first in first out, so space is never reused piecemeal,
+    the write position goes back to the start when nothing in the file is
+    still wanted, and the file is truncated so the disk is given back.
+    """
+    def __init__(self, name, directory=None, max_bytes=0):
+        self.name = name
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.file = None
+        self.map = None
+        self.size = 0
+        self.end = 0
+
+    def fits(self, length):
+        return self.end + length <= self.max_bytes
+
+    def write(self, data):
+        """ Store bytes, returns their offset """
+        length = len(data)
+        if self.end + length > self.size:
+            self.grow(self.end + length)
+        offset = self.end
+        self.map[offset:offset + length] = data
+        self.end += length
+        return offset
+
+    def read(self, offset, length):
+        return bytes(self.map[offset:offset + length])
+
+    def grow(self, needed):
+        if self.file is None:
+            self.file = tempfile.TemporaryFile(prefix=f"lifeai_{self.name}_", dir=self.directory)
+        size = max(self.size * 2, SPILL_CHUNK)
+        while size < needed:
+            size *= 2
+        size = min(size, max(self.max_bytes, needed))
+        if self.map is not None:
+            self.map.close()
+        self.file.truncate(size)
+        self.map = mmap.mmap(self.file.fileno(), size)
+        self.size = size
+
+    def reset(self):
+        self.end = 0
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+            self.file.truncate(0)
+            self.size = 0
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+class MediaBuffer:
+    """ Segments waiting for the scheduler, accounted in bytes rather than counted.
+
+    Payloads stay in memory up to budget_bytes. Past that a new segment
+    goes to the spill file, as the encoded bytes it arrived as if given
+    or the payload itself when that is bytes, and is read back and
+    decoded when it is taken. The segments about to play stay in memory,
+    the ones spilled are the furthest from playing. What happens when
+    both are full, or on every put, is the policy:
+
+    keep      never drop, kept in memory over the budget (speech)
+    coalesce  a segment with the key of one still in memory shares its
+              payload, and the oldest are dropped to make room (images)
+    latest    a put replaces everything queued (music tracks)
+
+    max_items, if set, also caps how many segments a droppable policy holds.
+    put() returns the headers of the segments it dropped.
+    """
+    def __init__(self, name, budget_bytes, policy="keep", max_items=0, spill_dir=None, spill_bytes=0, size=len, decode=None):
+        self.name = name
+        self.budget_bytes = budget_bytes
+        self.policy = policy
+        self.max_items = max_items
+        self.size = size
+        self.decode = decode
+        self.lock = threading.Lock()
+        self.entries = deque()  # [header, payload, key, memory bytes, spill offset, spill length]
+        self.shared = {}  # key: [payload, references, memory bytes], a shared payload is counted once
+        self.spill = SpillFile(name, spill_dir, spill_bytes)
+        self.spilled = 0
+
+        self.memory_bytes = 0
+        self.spilled_bytes = 0
+        self.spills = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.over_budget = 0
+
+    def qsize(self):
+        return len(self.entries)
+
+    def empty(self):
+        return not self.entries
+
+    def peek(self):
+        """ Header of the next segment, or None """
+        with self.lock:
+            return self.entries[0][0] if self.entries else None
+
+    def payload(self, key):
+        """ Payload of a queued segment with this key still in memory, so a repeat need not be decoded again """
+        with self.lock:
+            shared = self.shared.get(key)
+            return shared[0] if shared else None
+
+    def put(self, header, payload, encoded=None, key=None, policy=None):
+        policy = policy or self.policy
+        dropped = []
+        with self.lock:
+            if policy == "latest":
+                while self.entries:
+                    dropped.append(self.drop_oldest())
+            if policy != "keep" and self.max_items:
+                while len(self.entries) >= self.max_items:
+                    dropped.append(self.drop_oldest())
+
+            if key is not None and key in self.shared:
+                shared = self.shared[key]
+                shared[1] += 1
+                self.entries.append([header, shared[0], key, 0, 0, 0])
+                self.coalesced += 1
+                return dropped
+
+            nbytes = self.size(payload)
+            if self.memory_bytes + nbytes > self.budget_bytes:
+                data = encoded if encoded is not None else payload
+                if isinstance(data, (bytes, bytearray)) and self.spill.fits(len(data)):
+                    offset = self.spill.write(data)
+                    self.entries.append([header, None, None, 0, offset, len(data)])
+                    self.spilled += 1
+                    self.spills += 1
+                    self.spilled_bytes += len(data)
+                    return dropped
+                if policy != "keep":
+                    while self.entries and self.memory_bytes + nbytes > self.budget_bytes:
+                        dropped.append(self.drop_oldest())
+                if self.memory_bytes + nbytes > self.budget_bytes:
+                    self.over_budget += 1
+                    logger.warning(f"{self.name} buffer over its {self.budget_bytes / 1e6:.0f} MB budget with nowhere to spill, "
+                                   f"keeping segment #{header.get('segment_number')} in memory.")
+
+            self.memory_bytes += nbytes
+            if key is not None:
+                self.shared[key] = [payload, 1, nbytes]
+                nbytes = 0
+            self.entries.append([header, payload, key, nbytes, 0, 0])
+        return dropped
+
+    def get(self):
+        """ The oldest segment as (header, payload), raises queue.Empty if there is none """
+        with self.lock:
+            if not self.entries:
+                raise queue.Empty
+            entry = self.entries.popleft()
+            data = self.release(entry)
+        header, payload = entry[0], entry[1]
+        if data is not None:
+            payload = self.decode(data) if self.decode is not None else data
+        return header, payload
+
+    def release(self, entry):
+        # free what the entry held, its bytes back if it was spilled
+        header, payload, key, nbytes, offset, length = entry
+        if payload is None:
+            data = self.spill.read(offset, length)
+            self.spilled -= 1
+            self.spilled_bytes -= length
+            if self.spilled == 0:
+                self.spill.reset()
+            return data
+        if key is not None:
+            shared = self.shared[key]
+            shared[1] -= 1
+            if shared[1] == 0:
+                del self.shared[key]
+                nbytes = shared[2]
+        self.memory_bytes -= nbytes
+        return None
+
+    def drop_oldest(self):
+        entry = self.entries.popleft()
+        if entry[1] is None:
+            # dropped unread, nothing to read back
+            self.spilled -= 1
+            self.spilled_bytes -= entry[5]
+            if self.spilled == 0:
+                self.spill.reset()
+        else:
+            self.release(entry)
+        self.dropped += 1
+        return entry[0]
+
+    def metrics(self):
+        return (f"{self.name} buffer {len(self.entries)} segments, {self.memory_bytes / 1e6:.1f} MB in memory, "
+                f"{self.spilled} spilled {self.spilled_bytes / 1e6:.1f} MB ({self.spills} in all), {self.coalesced} coalesced, "
+                f"{self.dropped} dropped, {self.over_budget} over budget")
+
+    def close(self):
+        self.spill.close()
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+
+## Life AI mimic3-server pool for Text to Speech
+#
+# Chris Kennedy 2023 (C) GPL
+#
+# Free to use for any use as in truly free software
+# as Richard Stallman intended it to be.
+#
+
+import time
+import threading
+import logging
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger('tts')
+
+class Mimic3Server:
+    """ One mimic3-server instance with a persistent keep-alive session """
+    def __init__(self, url, pool_size=4):
+        self.url = url.rstrip('/')
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.in_flight = 0
+        self.requests = 0
+        self.failures = 0
+        self.healthy = True
+        self.next_probe = 0
+
+    def __repr__(self):
+        return f"{self.url} healthy={self.healthy} in_flight={self.in_flight} requests={self.requests} failures={self.failures}"
+
+class Mimic3Pool:
+    """ Dispatch TTS requests to the mimic3-server with the fewest in-flight requests.
+
+    Servers failing max_failures requests in a row are ejected, and re-probed
+    every probe_interval seconds by a background thread until they answer again.
+    """
+    def __init__(self, urls, timeout=30.0, probe_interval=10.0, max_failures=2):
+        self.servers = [Mimic3Server(url) for url in urls]
+        self.timeout = timeout
+        self.probe_interval = probe_interval
+        self.max_failures = max_failures
+        self.lock = threading.Lock()
+        self.running = True
+        self.prober = threading.Thread(target=self.probe_loop, daemon=True)
+        self.prober.start()
+
+    def __len__(self):
+        return len(self.servers)
+
+    def acquire(self, exclude=()):
+        with self.lock:
+            candidates = [server for server in self.servers if server not in exclude] or self.servers
+            healthy = [server for server in candidates if server.healthy]
+            if not healthy:
+                # everything is ejected, try the one due for a probe soonest rather than failing outright
+                healthy = [min(candidates, key=lambda server: server.next_probe)]
+            server = min(healthy, key=lambda server: (server.in_flight, server.requests))
+            server.in_flight += 1
+            server.requests += 1
+            return server
+
+    def release(self, server, ok):
+        """ Done with a server, ok is whether it answered, None when the outcome says nothing about its health """
+        with self.lock:
+            server.in_flight -= 1
+            if ok:
+                server.failures = 0
+                if not server.healthy:
+                    logger.info(f"TTS Pool: {server.url} is healthy again.")
+                server.healthy = True
+            elif ok is not None:
+                server.failures += 1
+                if server.healthy and server.failures >= self.max_failures:
+                    logger.error(f"TTS Pool: ejecting {server.url} after {server.failures} failures.")
+                    server.healthy = False
+                    server.next_probe = time.time() + self.probe_interval
+
+    def tts(self, params):
+        """ GET /api/tts on the least loaded server, falling over to the next one on errors.
+
+        Only connection errors, timeouts and 5xx answers count against a
+        server's health. A 4xx is the request's fault, like an unknown voice
+        or bad SSML, every server would refuse it so it is raised right away.
+        """
+        last_error = None
+        tried = []
+        for _ in range(len(self.servers)):
+            server = self.acquire(tried)
+            tried.append(server)
+            ok = None
+            try:
+                response = server.session.get(f"{server.url}/api/tts", params=params, timeout=self.timeout)
+                ok = response.status_code < 500
+                response.raise_for_status()
+                return response.content
+            except requests.HTTPError as e:
+                if ok:
+                    logger.error(f"TTS Pool: {server.url} refused the request: {e}")
+                    raise
+                last_error = e
+            except (requests.ConnectionError, requests.Timeout) as e:
+                ok = False
+                last_error = e
+            except requests.RequestException as e:
+                last_error = e
+            finally:
+                self.release(server, ok)
+            logger.error(f"TTS Pool: request to {server.url} failed: {last_error}")
+
+        raise last_error
+
+    def probe(self, server):
+        try:
+            response = server.session.get(f"{server.url}/api/voices", timeout=min(self.timeout, 5.0))
+            response.raise_for_status()
+            return True
+        except requests.RequestException:
+            return False
+
+    def probe_loop(self):
+        while self.running:
+            now = time.time()
+            with self.lock:
+                due = [server for server in self.servers if not server.healthy and server.next_probe <= now]
+            for server in due:
+                ok = self.probe(server)
+                with self.lock:
+                    if ok:
+                        logger.info(f"TTS Pool: probe of {server.url} succeeded, returning to service.")
+                        server.healthy = True
+                        server.failures = 0
+                    else:
+                        server.next_probe = time.time() + self.probe_interval
+            time.sleep(min(1.0, self.probe_interval))
+
+    def status(self):
+        with self.lock:
+            return [repr(server) for server in self.servers]
+
+    def stop(self):
+        self.running = False
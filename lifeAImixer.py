@@ -0,0 +1,368 @@
+#!/usr/bin/env python
+
+## Life AI audio mixer, speech over music mixed into one output stream on a sample clock
+#
+# Chris Kennedy 2023 (C) GPL
+#
+# Free to use for any use as in truly free software
+# as Richard Stallman intended it to be.
+#
+
+import time
+import wave
+import queue
+import logging
+import threading
+import subprocess
+import numpy as np
+from lifeAItimeline import resample, fit_channels
+
+logger = logging.getLogger('lifeAIplayer')
+
+class Voice:
+    """ A clip placed at a sample on a clock, optionally looped and faded.
+
+    samples are float32 (frames, channels) at the mixer's rate. A fade is
+    (start sample, length, fading in) on the same clock, equal power so a
+    crossfade between two voices keeps the level steady.
+    """
+    def __init__(self, samples, start, loop=False, on_start=None, on_ending=None, on_done=None):
+        self.samples = samples
+        self.start = start
+        self.loop = loop
+        self.on_start = on_start
+        self.on_ending = on_ending
+        self.on_done = on_done
+        self.position = 0
+        self.started = False
+        self.ending = False
+        self.fade = None
+
+    def end(self):
+        return self.start + len(self.samples)
+
+    def fading_out(self):
+        return self.fade is not None and not self.fade[2]
+
+    def faded_out(self, clock):
+        return self.fading_out() and clock >= self.fade[0] + self.fade[1]
+
+    def gain(self, block_start, frames):
+        if self.fade is None:
+            return None
+        start, length, fade_in = self.fade
+        x = np.clip((np.arange(block_start, block_start + frames, dtype=np.float32) - start) / max(1, length), 0.0, 1.0)
+        return (np.sin if fade_in else np.cos)(x * (np.pi / 2))[:, None]
+
+    def mix_into(self, out, block_start):
+        """ Add this voice's part of the block starting at block_start into out, True once its last sample is in """
+        frames = len(out)
+        filled = max(0, self.start - block_start)
+        if filled >= frames:
+            return False
+        gain = self.gain(block_start, frames)
+        while filled < frames:
+            take = min(frames - filled, len(self.samples) - self.position)
+            chunk = self.samples[self.position:self.position + take]
+            if gain is None:
+                out[filled:filled + take] += chunk
+            else:
+                out[filled:filled + take] += chunk * gain[filled:filled + take]
+            self.position += take
+            filled += take
+            if self.position >= len(self.samples):
+                if not self.loop or len(self.samples) == 0:
+                    return True
+                self.position = 0
+        return False
+
+class Mixer(threading.Thread):
+    """ Software mixer for the player, speech over music into a single stream.
+
+    Speech voices are placed on the audio clock, samples mixed since start,
+    so a segment can start at an exact sample, right after the one before
+    for no gap. Music runs on its own clock which stops while the music is
+    paused. Music is ducked under speech by a sidechain on the speech level
+    with attack and release, and track changes crossfade. Pauses and
+    resumes ramp over a few ms instead of clicking.
+
+    The output device pulls blocks with mix(), a sound card callback or the
+    NDI sender, or with neither the thread paces itself on the wall clock.
+    Every mixed block also goes to the taps, a WAV file or an ffmpeg pipe.
+    """
+    def __init__(self, sample_rate=48000, channels=2, block_size=1024, speech_volume=0.75, music_volume=0.5,
+                 duck_db=-12.0, duck_threshold_db=-50.0, attack=0.05, release=0.5, crossfade=2.0, fade=0.01):
+        super().__init__(daemon=True)
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.block_size = block_size
+        self.speech_volume = speech_volume
+        self.music_volume = music_volume
+        self.duck_target = 10.0 ** (duck_db / 20.0)
+        self.duck_threshold = 10.0 ** (duck_threshold_db / 20.0)
+        self.attack = attack
+        self.release = release
+        self.crossfade = int(crossfade * sample_rate)
+        self.fade = int(fade * sample_rate)
+        self.lock = threading.Lock()
+        self.running = True
+        self.taps = []
+
+        self.position = 0        # samples mixed, the audio clock
+        self.music_position = 0  # samples of music mixed, held while paused
+        self.speech = []         # voices on the audio clock
+        self.music = []          # voices on the music clock
+        self.stream_end = 0      # where the next streamed music chunk starts on the music clock
+        self.last_speech_end = None
+        self.last_gap = None
+        self.duck_gain = 1.0
+        self.pause_gain = 1.0
+        self.paused = False
+
+        self.speech_played = 0
+        self.tracks_played = 0
+        self.chunks_played = 0
+        self.stalls = 0
+
+    def prepare(self, samples, sample_rate):
+        """ int16 (frames, channels) audio as float32 at the mixer's rate and channels, ready to start """
+        pcm = fit_channels(resample(samples, sample_rate, self.sample_rate), self.channels)
+        return pcm.astype(np.float32) * (1.0 / 32768.0)
+
+    def clock(self):
+        """ Seconds of audio mixed, monotonic, what the video can follow """
+        return self.position / self.sample_rate
+
+    def add_tap(self, sink):
+        self.taps.append(sink)
+
+    def play_speech(self, samples, at=None, on_start=None, on_ending=None, on_done=None):
+        """ Start prepared speech at sample at on the audio clock, or with the next block, returns the start sample.
+
+        on_ending runs once the speech ends within the next block, in time to
+        start the next speech on the sample this one ends, on_done once its
+        last sample is mixed.
+        """
+        with self.lock:
+            start = self.position if at is None else max(at, self.position)
+            previous = max(voice.end() for voice in self.speech) if self.speech else self.last_speech_end
+            self.last_gap = None if previous is None else start - previous
+            self.speech.append(Voice(samples, start, on_start=on_start, on_ending=on_ending, on_done=on_done))
+        return start
+
+    def speech_end(self):
+        """ The sample the scheduled speech runs to, where speech starts back to back """
+        with self.lock:
+            return max([voice.end() for voice in self.speech] + [self.position])
+
+    def speech_gap(self):
+        """ Samples of silence before the last speech started, negative when it overlaps the one before """
+        with self.lock:
+            return self.last_gap
+
+    def speech_busy(self):
+        with self.lock:
+            return bool(self.speech)
+
+    def fade_out_music(self, length):
+        for voice in self.music:
+            if not voice.fading_out():
+                voice.fade = (self.music_position, length, False)
+
+    def play_music(self, samples, loop=True):
+        """ Change track, crossfading from whatever music is playing """
+        with self.lock:
+            length = self.crossfade if self.music else self.fade
+            self.fade_out_music(length)
+            voice = Voice(samples, self.music_position, loop=loop)
+            voice.fade = (self.music_position, length, True)
+            self.music.append(voice)
+            self.tracks_played += 1
+
+    def queue_music_chunk(self, samples):
+        """ Streamed music, each chunk starts on the sample the last one ends, a stream replaces a looping track """
+        with self.lock:
+            for voice in self.music:
+                if voice.loop and not voice.fading_out():
+                    voice.fade = (self.music_position, self.crossfade, False)
+            start = max(self.stream_end, self.music_position)
+            self.music.append(Voice(samples, start))
+            self.stream_end = start + len(samples)
+            self.chunks_played += 1
+
+    def pause_music(self):
+        with self.lock:
+            self.paused = True
+
+    def resume_music(self):
+        with self.lock:
+            self.paused = False
+
+    def music_busy(self):
+        with self.lock:
+            return bool(self.music) and not self.paused
+
+    def crossfading(self):
+        with self.lock:
+            return any(voice.fading_out() for voice in self.music)
+
+    def mix(self, frames):
+        """ The next frames of the output, float32 (frames, channels), advancing the clock """
+        callbacks = []
+        with self.lock:
+            block_start = self.position
+            speech = np.zeros((frames, self.channels), dtype=np.float32)
+            for voice in list(self.speech):
+                if not voice.started and voice.start < block_start + frames:
+                    voice.started = True
+                    callbacks.append(voice.on_start)
+                finished = voice.mix_into(speech, block_start)
+                if not voice.ending and voice.end() <= block_start + 2 * frames:
+                    voice.ending = True
+                    callbacks.append(voice.on_ending)
+                if finished:
+                    self.speech.remove(voice)
+                    self.last_speech_end = voice.end()
+                    self.speech_played += 1
+                    callbacks.append(voice.on_done)
+            out = speech * self.speech_volume
+
+            # sidechain, music follows the speech level down fast and comes back up slowly
+            level = float(np.sqrt(np.mean(np.square(speech)))) if frames else 0.0
+            target = self.duck_target if level > self.duck_threshold else 1.0
+            time_constant = self.attack if target < self.duck_gain else self.release
+            duck_gain = target + (self.duck_gain - target) * float(np.exp(-frames / (time_constant * self.sample_rate)))
+            step = frames / max(1, self.fade)
+            pause_gain = max(0.0, self.pause_gain - step) if self.paused else min(1.0, self.pause_gain + step)
+
+            # paused music holds its place once it has faded down
+            if self.music and (self.pause_gain > 0.0 or pause_gain > 0.0):
+                music = np.zeros_like(speech)
+                for voice in list(self.music):
+                    if voice.mix_into(music, self.music_position) or voice.faded_out(self.music_position + frames):
+                        self.music.remove(voice)
+                self.music_position += frames
+                ramp = np.linspace(self.duck_gain * self.pause_gain, duck_gain * pause_gain, frames, endpoint=False, dtype=np.float32)
+                out += music * (ramp[:, None] * self.music_volume)
+            self.duck_gain = duck_gain
+            self.pause_gain = pause_gain
+
+            np.clip(out, -1.0, 1.0, out=out)
+            self.position += frames
+
+        for callback in callbacks:
+            if callback is not None:
+                callback()
+        for tap in self.taps:
+            tap.write(out)
+        return out
+
+    def run(self):
+        # no device pulling blocks, pace them on the wall clock
+        start = time.perf_counter()
+        blocks = 0
+        while self.running:
+            due = start + blocks * self.block_size / self.sample_rate
+            now = time.perf_counter()
+            if now < due:
+                time.sleep(due - now)
+                continue
+            if now - due > 1.0:
+                # stalled, skip ahead with the clock instead of bursting blocks out
+                skipped = int((now - due) * self.sample_rate / self.block_size)
+                blocks += skipped
+                self.stalls += 1
+                logger.error(f"Mixer: {skipped * self.block_size / self.sample_rate:.1f} seconds behind, skipping {skipped} blocks.")
+            self.mix(self.block_size)
+            blocks += 1
+
+    def metrics(self):
+        return (f"Mixer at {self.clock():.1f}s, {self.speech_played} speech segments, {self.tracks_played} tracks, "
+                f"{self.chunks_played} music chunks, music gain {self.duck_gain * self.pause_gain:.2f}, {self.stalls} stalls")
+
+    def stop(self):
+        self.running = False
+        if self.is_alive():
+            self.join(timeout=2.0)
+        for tap in self.taps:
+            tap.close()
+
+def to_int16(block):
+    return np.clip(np.rint(block * 32767.0), -32768, 32767).astype(np.int16)
+
+class SoundcardOutput:
+    """ Sound card output, the card's callback pulls each block from the mixer """
+    def __init__(self, mixer, device=None):
+        # PortAudio is only needed with a sound card, headless and NDI only players run without it
+        import sounddevice as sd
+        self.mixer = mixer
+        self.underruns = 0
+        self.stream = sd.OutputStream(samplerate=mixer.sample_rate, channels=mixer.channels, dtype='float32',
+                                      blocksize=mixer.block_size, device=device or None, callback=self.callback)
+
+    def callback(self, outdata, frames, time_info, status):
+        if status.output_underflow:
+            self.underruns += 1
+        outdata[:] = self.mixer.mix(frames)
+
+    def start(self):
+        self.stream.start()
+
+    def stop(self):
+        self.stream.stop()
+        self.stream.close()
+
+class WavSink:
+    """ Mixer tap writing 16-bit WAV """
+    def __init__(self, path, sample_rate, channels):
+        self.wav_file = wave.open(path, 'wb')
+        self.wav_file.setnchannels(channels)
+        self.wav_file.setsampwidth(2)
+        self.wav_file.setframerate(sample_rate)
+
+    def write(self, block):
+        self.wav_file.writeframes(to_int16(block).tobytes())
+
+    def close(self):
+        self.wav_file.close()
+
+class PipeSink:
+    """ Mixer tap writing raw s16le into a command's stdin, like ffmpeg -f s16le -ar 48000 -ac 2 -i - ...
+
+    Blocks go through a queue to a writer thread so a slow reader never holds
+    up the mixer, when the queue is full blocks are dropped and counted.
+    """
+    def __init__(self, command, max_blocks=256):
+        self.process = subprocess.Popen(command, shell=True, stdin=subprocess.PIPE)
+        self.blocks = queue.Queue(maxsize=max_blocks)
+        self.dropped = 0
+        self.thread = threading.Thread(target=self.writer, daemon=True)
+        self.thread.start()
+
+    def write(self, block):
+        try:
+            self.blocks.put_nowait(to_int16(block).tobytes())
+        except queue.Full:
+            self.dropped += 1
+            if self.dropped % 100 == 1:
+                logger.error(f"Mixer: audio pipe is not keeping up, {self.dropped} blocks dropped.")
+
+    def writer(self):
+        while True:
+            data = self.blocks.get()
+            if data is None:
+                break
+            try:
+                self.process.stdin.write(data)
+            except (BrokenPipeError, OSError) as e:
+                logger.error(f"Mixer: audio pipe closed: {e}")
+                break
+
+    def close(self):
+        self.blocks.put(None)
+        self.thread.join(timeout=2.0)
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+        self.process.wait(timeout=5)
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+
+## Life AI music library, generated Text to Music tracks indexed on disk by genre and personality
+#
+# Chris Kennedy 2023 (C) GPL
+#
+# Free to use for any use as in truly free software
+# as Richard Stallman intended it to be.
+#
+
+import os
+import re
+import json
+import time
+import uuid
+import random
+import hashlib
+import logging
+
+logger = logging.getLogger('TTM')
+
+def library_key(genre, personality=""):
+    """ Normalized genre_music/personality key, case and spacing don't make a different track """
+    genre = re.sub(r'\s+', ' ', (genre or "").strip().lower().rstrip('. '))
+    personality = (personality or "").strip().lower()
+    return f"{personality}|{genre}"
+
+class MusicLibrary:
+    """ Generated tracks per key, served again while fresh instead of generating for every request.
+
+    A track is fresh for fresh_seconds after it was made and until it has
+    been played max_plays times. At most max_tracks are kept per key, the
+    oldest are removed first.
+    """
+    def __init__(self, directory, max_tracks=8, fresh_seconds=6 * 3600, max_plays=3):
+        self.directory = directory
+        self.max_tracks = max_tracks
+        self.fresh_seconds = fresh_seconds
+        self.max_plays = max_plays
+        self.tracks = {}
+        self.served = 0
+        self.generated = 0
+        os.makedirs(directory, exist_ok=True)
+        self.index_path = os.path.join(directory, "index.json")
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.index_path):
+            return
+        try:
+            with open(self.index_path, 'r') as f:
+                saved = json.load(f)
+        except Exception as e:
+            logger.error(f"Music library index unreadable, starting empty: {e}")
+            return
+        for key, tracks in saved.items():
+            tracks = [track for track in tracks if os.path.exists(os.path.join(self.directory, track["file"]))]
+            if tracks:
+                self.tracks[key] = tracks
+        logger.info(f"Music library loaded {sum(len(tracks) for tracks in self.tracks.values())} tracks for {len(self.tracks)} genres.")
+
+    def save(self):
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.tracks, f)
+        os.replace(tmp_path, self.index_path)
+
+    def is_fresh(self, track, now=None):
+        now = now or time.time()
+        return now - track["created"] <= self.fresh_seconds and track["plays"] < self.max_plays
+
+    def fresh_count(self, key):
+        now = time.time()
+        return sum(1 for track in self.tracks.get(key, []) if self.is_fresh(track, now))
+
+    def pick(self, key):
+        """ WAV bytes and entry of the least played fresh track for key, or None """
+        now = time.time()
+        while True:
+            fresh = [track for track in self.tracks.get(key, []) if self.is_fresh(track, now)]
+            if not fresh:
+                return None
+            least_plays = min(track["plays"] for track in fresh)
+            track = random.choice([track for track in fresh if track["plays"] == least_plays])
+            try:
+                with open(os.path.join(self.directory, track["file"]), 'rb') as f:
+                    audio = f.read()
+                break
+            except OSError as e:
+                logger.error(f"Music library track {track['file']} unreadable, dropping it: {e}")
+                self.tracks[key].remove(track)
+                self.save()
+        track["plays"] += 1
+        track["last_played"] = now
+        self.served += 1
+        self.save()
+        return audio, track
+
+    def add(self, key, audio, duration, prompt=""):
+        now = time.time()
+        file_name = f"{hashlib.md5(key.encode()).hexdigest()[:12]}-{uuid.uuid4().hex[:12]}.wav"
+        with open(os.path.join(self.directory, file_name), 'wb') as f:
+            f.write(audio)
+        tracks = self.tracks.setdefault(key, [])
+        tracks.append({"file": file_name, "prompt": prompt[:200], "duration": duration, "created": now, "plays": 0, "last_played": 0})
+        self.generated += 1
+        while len(tracks) > self.max_tracks:
+            oldest = min(tracks, key=lambda track: track["created"])
+            tracks.remove(oldest)
+            try:
+                os.remove(os.path.join(self.directory, oldest["file"]))
+            except OSError:
+                pass
+        self.save()
+        return tracks[-1]
+
+    def metrics(self):
+        total = sum(len(tracks) for tracks in self.tracks.values())
+        return f"served {self.served} generated {self.generated}, {total} tracks for {len(self.tracks)} genres"
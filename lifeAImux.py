@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+
+## Life AI A/V mux, pairs speech segments with images per mediaid timeline for Framesync
+#
+# Chris Kennedy 2023 (C) GPL
+#
+# Free to use for any use as in truly free software
+# as Richard Stallman intended it to be.
+#
+
+import time
+import logging
+import threading
+from collections import OrderedDict, deque
+
+logger = logging.getLogger('Framesync')
+
+class Timeline:
+    """ Images waiting to be paired and the last image sent for one mediaid """
+    def __init__(self, mediaid):
+        self.mediaid = mediaid
+        self.images = {}  # segment_number -> (header, asset), first image of a segment wins
+        self.last_image = None
+        self.last_segment = None
+        self.updated = time.time()
+
+    def add_image(self, header, asset):
+        segment_number = header["segment_number"]
+        if segment_number in self.images:
+            return False
+        self.images[segment_number] = (header, asset)
+        self.updated = time.time()
+        return True
+
+    def take(self, segment_number, max_segment_diff):
+        """ The image for segment_number and why, exact if it arrived, else the nearest earlier one within max_segment_diff """
+        if segment_number in self.images:
+            return self.images.pop(segment_number), "exact"
+        earlier = [n for n in self.images if segment_number - max_segment_diff <= n < segment_number]
+        if earlier:
+            nearest = max(earlier)
+            return self.images.pop(nearest), f"nearest #{nearest}"
+        return None, None
+
+    def drop_stale(self, segment_number, max_segment_diff):
+        """ Forget images too far behind the segment just sent to ever be paired """
+        stale = [n for n in self.images if n < segment_number - max_segment_diff]
+        for n in stale:
+            header, asset = self.images.pop(n)
+            # still the freshest picture we have for duplicates
+            if self.last_image is None or n > self.last_image[0]["segment_number"]:
+                self.last_image = (header, asset)
+        return stale
+
+class MuxEngine:
+    """ Event driven speech/image mux.
+
+    Speech segments go out in arrival order, each with exactly one image so
+    the player's FIFO pairing holds. A segment waits up to buffer_delay
+    seconds for its own image, then takes the nearest earlier image within
+    max_segment_diff, else repeats the last image of its mediaid, else goes
+    out alone. Speech older than max_delay is dropped. Music is passed
+    straight through. The worker sleeps on a condition until something
+    arrives or the head segment's jitter deadline passes.
+    """
+    def __init__(self, emit, buffer_delay=2.0, max_delay=60.0, max_segment_diff=2, max_timelines=16, report_interval=300):
+        self.emit = emit
+        self.buffer_delay = buffer_delay
+        self.max_delay = max_delay
+        self.max_segment_diff = max_segment_diff
+        self.max_timelines = max_timelines
+        self.report_interval = report_interval
+        self.timelines = OrderedDict()
+        self.speech = deque()  # (arrival, header, asset)
+        self.music = deque()
+        self.condition = threading.Condition()
+        self.running = True
+        self.counts = {}
+        self.last_report = time.time()
+
+    def count(self, reason):
+        self.counts[reason] = self.counts.get(reason, 0) + 1
+
+    def timeline(self, mediaid):
+        timeline = self.timelines.get(mediaid)
+        if timeline is None:
+            timeline = self.timelines[mediaid] = Timeline(mediaid)
+            while len(self.timelines) > self.max_timelines:
+                self.timelines.popitem(last=False)
+        self.timelines.move_to_end(mediaid)
+        return timeline
+
+    def add(self, header, asset):
+        stream = header.get("stream")
+        with self.condition:
+            if stream == "music":
+                # music plays under everything, nothing to line up, sent by the worker so one thread owns the socket
+                self.music.append((header, asset))
+            elif stream == "speek":
+                self.speech.append((time.time(), header, asset))
+            elif stream == "image":
+                if not self.timeline(header.get("mediaid", "none")).add_image(header, asset):
+                    logger.info(f"Framesync: dropping extra image for #{header['segment_number']} {header.get('mediaid')}, one image per segment.")
+                    self.count("extra image")
+            else:
+                logger.error(f"Framesync: unknown stream {stream}")
+                return
+            self.condition.notify()
+
+    def next_ready(self):
+        """ The head speech segment and its image decision if it can go now, else the seconds to wait """
+        arrival, header, asset = self.speech[0]
+        mediaid = header.get("mediaid", "none")
+        segment_number = header["segment_number"]
+        timeline = self.timeline(mediaid)
+
+        timestamp = header.get("timestamp", 0)
+        if timestamp and time.time() * 1000 - timestamp > self.max_delay * 1000:
+            return "stale", None, 0
+
+        if segment_number in timeline.images:
+            image, reason = timeline.take(segment_number, self.max_segment_diff)
+            return reason, image, 0
+
+        wait = arrival + self.buffer_delay - time.time()
+        if wait > 0:
+            return None, None, wait
+
+        image, reason = timeline.take(segment_number, self.max_segment_diff)
+        if image is not None:
+            return reason, image, 0
+        # images that came in too late to pair still make a fresher duplicate
+        self.drop_stale(timeline, segment_number)
+        if timeline.last_image is not None:
+            return "duplicate last", None, 0
+        return "audio only", None, 0
+
+    def send(self, reason, image):
+        _, header, asset = self.speech.popleft()
+        mediaid = header.get("mediaid", "none")
+        segment_number = header["segment_number"]
+        timeline = self.timeline(mediaid)
+        self.count(reason.split(" #")[0])
+
+        if reason == "stale":
+            logger.warning(f"Framesync: dropping speech #{segment_number} {mediaid}, older than {self.max_delay} seconds.")
+            return
+
+        if reason == "duplicate last":
+            image = timeline.last_image
+
+        if image is not None:
+            source_header, image_asset = image
+            # the player pairs by arrival order, label the image with the segment it is shown for
+            image_header = dict(source_header, segment_number=segment_number)
+            if reason == "duplicate last":
+                image_header["throttle"] = "true"
+            else:
+                timeline.last_image = image
+            logger.info(f"Framesync: speech #{segment_number} {mediaid} paired with image #{source_header['segment_number']}: {reason}.")
+            self.emit(image_header, image_asset)
+        else:
+            logger.info(f"Framesync: speech #{segment_number} {mediaid} sent without an image: {reason}.")
+        self.emit(header, asset)
+
+        timeline.last_segment = segment_number
+        self.drop_stale(timeline, segment_number)
+
+    def drop_stale(self, timeline, segment_number):
+        for stale in timeline.drop_stale(segment_number, self.max_segment_diff):
+            logger.info(f"Framesync: dropping image #{stale} {timeline.mediaid}, more than {self.max_segment_diff} segments behind.")
+            self.count("stale image")
+
+    def report(self):
+        counts = ", ".join(f"{reason} {count}" for reason, count in sorted(self.counts.items()))
+        logger.info(f"Framesync: {len(self.speech)} speech waiting, {sum(len(t.images) for t in self.timelines.values())} images waiting, pairing {counts}.")
+
+    def run(self):
+        while self.running:
+            with self.condition:
+                wait = None
+                while self.music:
+                    self.emit(*self.music.popleft())
+                while self.speech:
+                    reason, image, wait = self.next_ready()
+                    if reason is None:
+                        break
+                    self.send(reason, image)
+                    wait = None
+                if time.time() - self.last_report > self.report_interval:
+                    self.report()
+                    self.last_report = time.time()
+                # sleep until new media arrives or the head segment's jitter buffer runs out
+                self.condition.wait(wait)
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
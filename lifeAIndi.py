@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+
+## Life AI NDI output, a paced sender thread for the player's video and speech
+#
+# Chris Kennedy 2023 (C) GPL
+#
+# Free to use for any use as in truly free software
+# as Richard Stallman intended it to be.
+#
+
+import time
+import logging
+import threading
+from collections import deque
+import cv2
+import numpy as np
+from lifeAItimeline import resample, fit_channels
+
+logger = logging.getLogger('lifeAIplayer')
+
+# NDI timecodes count 100 ns ticks
+TIMECODE_RATE = 10000000
+
+# NDIlib is only imported once a sender is made, the player runs without it when --ndi is off
+FOURCCS = {
+    "uyvy": (cv2.COLOR_RGB2YUV_UYVY, "FOURCC_VIDEO_TYPE_UYVY"),
+    "i420": (cv2.COLOR_RGB2YUV_I420, "FOURCC_VIDEO_TYPE_I420"),
+}
+
+class NDISink(threading.Thread):
+    """ NDI sender that never blocks the player.
+
+    The current frame is sent at a fixed fps whether or not the player has
+    a new one. A new frame is copied into a spare RGB buffer and converted
+    to UYVY or I420 once, in a single cvtColor into a preallocated buffer.
+    Audio goes out as one block per video frame at 48 kHz, silence when no
+    clip is queued. Frames and blocks carry timecodes from the same clock,
+    audio counted in samples sent. A clip's on_done callback runs once its
+    last sample is sent. With an audio_source, a function giving the next
+    float32 (frames, channels) block like Mixer.mix, the blocks are pulled
+    from it instead of the queued clips.
+    """
+    def __init__(self, name, width, height, fps=30.0, fourcc="uyvy", sample_rate=48000, channels=2, video=True, audio=False,
+                 audio_source=None):
+        super().__init__(daemon=True)
+        import NDIlib as ndi
+        self.ndi = ndi
+        if not ndi.initialize():
+            raise RuntimeError("NDI failed to initialize")
+        settings = ndi.SendCreate()
+        settings.ndi_name = name
+        # this thread paces the output, NDI shouldn't block the sends as well
+        settings.clock_video = False
+        settings.clock_audio = False
+        self.send_instance = ndi.send_create(settings)
+
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.video = video
+        self.audio = audio
+        self.audio_source = audio_source
+        self.lock = threading.Lock()
+        self.running = True
+
+        # the player writes the back buffer, this thread converts the front one
+        self.front = np.zeros((height, width, 3), dtype=np.uint8)
+        self.back = np.zeros_like(self.front)
+        self.frame_ready = True
+
+        self.conversion, ndi_fourcc = FOURCCS[fourcc]
+        ndi_fourcc = getattr(ndi, ndi_fourcc)
+        if fourcc == "i420":
+            self.yuv = np.empty((height * 3 // 2, width), dtype=np.uint8)
+            line_stride = width
+        else:
+            self.yuv = np.empty((height, width, 2), dtype=np.uint8)
+            line_stride = width * 2
+        self.video_frame = ndi.VideoFrameV2()
+        self.video_frame.xres = width
+        self.video_frame.yres = height
+        self.video_frame.FourCC = ndi_fourcc
+        self.video_frame.frame_rate_N = int(round(fps * 1000))
+        self.video_frame.frame_rate_D = 1000
+        self.video_frame.picture_aspect_ratio = width / height
+        self.video_frame.line_stride_in_bytes = line_stride
+        self.video_frame.data = self.yuv
+
+        self.block_size = int(round(sample_rate / fps))
+        self.audio_block = np.zeros((channels, self.block_size), dtype=np.float32)
+        self.audio_frame = ndi.AudioFrameV2()
+        self.audio_frame.sample_rate = sample_rate
+        self.audio_frame.no_channels = channels
+        self.audio_frame.no_samples = self.block_size
+        self.audio_frame.channel_stride_in_bytes = self.block_size * 4
+        self.audio_frame.data = self.audio_block
+        self.clips = deque()  # [planar float32 samples, position, on_done]
+
+        self.frames_sent = 0
+        self.frames_converted = 0
+        self.clips_played = 0
+        self.stalls = 0
+
+    def set_frame(self, image):
+        """ Show an RGB frame from now on, a copy is taken so the caller can reuse its buffer """
+        image = np.asarray(image)
+        with self.lock:
+            if image.shape == self.back.shape:
+                np.copyto(self.back, image)
+            else:
+                cv2.resize(image[:, :, :3], (self.width, self.height), dst=self.back, interpolation=cv2.INTER_LINEAR)
+            self.frame_ready = True
+
+    def add_audio(self, samples, sample_rate, on_done=None):
+        """ Queue an int16 (frames, channels) clip after the ones already queued, returns its duration in seconds """
+        pcm = fit_channels(resample(samples, sample_rate, self.sample_rate), self.channels)
+        planar = np.ascontiguousarray(pcm.T, dtype=np.float32) * (1.0 / 32768.0)
+        with self.lock:
+            self.clips.append([planar, 0, on_done])
+        return planar.shape[1] / self.sample_rate
+
+    def queued_audio(self):
+        """ Seconds of audio waiting to be sent """
+        with self.lock:
+            return sum(clip[0].shape[1] - clip[1] for clip in self.clips) / self.sample_rate
+
+    def fill_audio_block(self):
+        if self.audio_source is not None:
+            self.audio_block[:] = self.audio_source(self.block_size).T
+            return
+        filled = self.advance_clips(self.block_size, self.audio_block)
+        self.audio_block[:, filled:] = 0.0
+
+    def skip_audio(self, samples):
+        """ Drop the audio the clock skipped over, so the next block is the audio due at its timecode """
+        if self.audio_source is None:
+            self.advance_clips(samples)
+            return
+        while samples > 0:
+            take = min(samples, self.block_size)
+            self.audio_source(take)
+            samples -= take
+
+    def advance_clips(self, samples, out=None):
+        """ Move up to samples through the queued clips, copied into out when given, returns how many there were """
+        done = []
+        moved = 0
+        with self.lock:
+            while moved < samples and self.clips:
+                clip = self.clips[0]
+                planar, position, on_done = clip
+                take = min(samples - moved, planar.shape[1] - position)
+                if out is not None:
+                    out[:, moved:moved + take] = planar[:, position:position + take]
+                moved += take
+                clip[1] += take
+                if clip[1] >= planar.shape[1]:
+                    self.clips.popleft()
+                    self.clips_played += 1
+                    done.append(on_done)
+        for on_done in done:
+            if on_done is not None:
+                on_done()
+        return moved
+
+    def convert_frame(self):
+        with self.lock:
+            if not self.frame_ready:
+                return
+            self.front, self.back = self.back, self.front
+            self.frame_ready = False
+        cv2.cvtColor(self.front, self.conversion, dst=self.yuv)
+        self.frames_converted += 1
+
+    def run(self):
+        start = time.perf_counter()
+        start_timecode = int(time.time() * TIMECODE_RATE)
+        frame_number = 0
+        audio_samples = 0
+        while self.running:
+            due = start + frame_number / self.fps
+            now = time.perf_counter()
+            if now < due:
+                time.sleep(due - now)
+                continue
+            if now - due > 1.0:
+                # stalled, skip ahead with the clock instead of bursting frames out
+                skipped = int((now - due) * self.fps)
+                frame_number += skipped
+                audio_samples += skipped * self.block_size
+                if self.audio:
+                    self.skip_audio(skipped * self.block_size)
+                self.stalls += 1
+                logger.error(f"NDI: {skipped / self.fps:.1f} seconds behind, skipping {skipped} frames.")
+
+            timecode = start_timecode + int(frame_number * TIMECODE_RATE / self.fps)
+            if self.video:
+                self.convert_frame()
+                self.video_frame.timecode = timecode
+                self.ndi.send_send_video_v2(self.send_instance, self.video_frame)
+            if self.audio:
+                self.fill_audio_block()
+                # audio time counts samples so a block size that isn't an exact frame doesn't drift the timecodes
+                self.audio_frame.timecode = start_timecode + int(audio_samples * TIMECODE_RATE / self.sample_rate)
+                self.ndi.send_send_audio_v2(self.send_instance, self.audio_frame)
+                audio_samples += self.block_size
+            self.frames_sent += 1
+            frame_number += 1
+
+    def metrics(self):
+        return (f"NDI sent {self.frames_sent} frames, converted {self.frames_converted}, "
+                f"{self.clips_played} clips played, {self.queued_audio():.1f}s audio queued, {self.stalls} stalls")
+
+    def stop(self):
+        self.running = False
+        if self.is_alive():
+            self.join(timeout=2.0)
+        self.ndi.send_destroy(self.send_instance)
+        self.ndi.destroy()
@@ -11,33 +11,32 @@
 import io
 import zmq
 import argparse
-import soundfile as sf
-from PIL import Image
 import re
 import os
 import cv2
 import numpy as np
 import logging
 import time
-import soundfile as sf
-import pygame
 import queue
 import threading
-from queue import PriorityQueue
 from PIL import Image, ImageDraw, ImageFont
-import cv2
 import textwrap
 import json
 from collections import deque
 from pydub import AudioSegment
 import magic
 from dotenv import load_dotenv
-import NDIlib as ndi
 import webuiapi
-from diffusers import StableDiffusionPipeline
-import torch
-from transformers import logging as trlogging
-import random
+from lifeAIimageVariants import VariantCache, image_id as asset_image_id
+from lifeAIcompositor import Compositor
+from lifeAIndi import NDISink, FOURCCS
+from lifeAIaudio import wav_to_pcm
+from lifeAImixer import Mixer, SoundcardOutput, WavSink, PipeSink
+from lifeAIheadless import HeadlessSink, FFMPEG_OPTIONS
+from lifeAItelemetry import Telemetry
+from lifeAIassetWriter import AssetWriter
+from lifeAIslideshow import SlideshowPool
+from lifeAImediaBuffer import MediaBuffer
 
 load_dotenv()
 
@@ -62,251 +61,46 @@ def generate_sd_webui(prompt):
         return None
 
 # Queue to store the last images
-past_images_queue = deque(maxlen=6)  # Assuming 6 images for each side
+past_images_queue = deque(maxlen=6)  # Assuming 6 images for each side, held as their pre-scaled variants
+# Pre-scaled variants of each image, made once per image id, set up in main once we know the frame size
+image_variants = None
+# Layered frame assembly with a cached background, set up in main once we know the frame size
+compositor = None
+# Paced NDI sender thread when sending to NDI
+ndi_sink = None
+# Speech and music mixed into one stream, and the sound card pulling it when it goes to one
+mixer = None
+soundcard = None
+# ffmpeg or raw frame output when running headless
+headless_sink = None
+# Background writer for --save
+asset_writer = None
+# Idle images made ahead of time for when the buffers run dry
+slideshow = None
 #past_images_all_time_queue = deque(maxlen=1000)  # Assuming 100 images for each side
 
-def create_16_9_image(center_image, side_images, target_width, target_height):
-    # Scale the main image to fit the height of the 16:9 image
-    main_image_scaled = center_image.resize((target_height, target_height), Image.LANCZOS)
-
-    # Create a new image with the target 16:9 dimensions
-    final_image = Image.new('RGB', (target_width, target_height))
-
-    # Calculate the width of the area on each side of the main image
-    side_area_width = (target_width - target_height) // 2
-
-    # Calculate the size for the side images to fill the space as much as possible
-    # Given we want to fit 3 images per side, we divide the height by 3
-    side_image_size = target_height // 3
-
-    # Split the side images for left and right
-    left_side_images = side_images[:3]
-    right_side_images = side_images[3:6]
-
-    # Resize side images to fill the space
-    left_resized_side_images = [img.resize((side_image_size, side_image_size), Image.LANCZOS) for img in left_side_images]
-    right_resized_side_images = [img.resize((side_image_size, side_image_size), Image.LANCZOS) for img in right_side_images]
-
-    # Paste the side images to fill the left and right areas
-    for i in range(3):
-        # Left side images
-        final_image.paste(left_resized_side_images[i], (0, i * side_image_size))
-
-        # Right side images
-        final_image.paste(right_resized_side_images[i], (target_width - side_image_size, i * side_image_size))
-
-    # Paste the scaled main image in the center
-    final_image.paste(main_image_scaled, (side_area_width, 0))
-
-    return final_image
-
-def create_filmstrip_images(center_image, side_images):
-    # Assuming side_images is a list of 6 images, 3 for left and 3 for right
-    left_images = side_images[:3]
-    right_images = side_images[3:]
-
-    # Combine the left images, the center image, and the right images horizontally
-    images_to_combine = left_images + [center_image] + right_images
-    combined_width = sum(img.size[0] for img in images_to_combine)
-    combined_height = max(img.size[1] for img in images_to_combine)
-
-    # Create a new image with the combined dimensions
-    wide_image = Image.new('RGB', (combined_width, combined_height))
-
-    print(f"Combined Width {combined_width} x Combined Height {combined_height}")
-
-    # Paste the images into the wide_image
-    x_offset = 0
-    for img in images_to_combine:
-        wide_image.paste(img, (x_offset, 0))
-        x_offset += img.size[0]
-
-    return wide_image
-
 # Main function to process the new image
-def process_new_image(new_image, text, args, unique_image=False, banner=""):
-    target_width = args.width  # This should be set to the desired width for 16:9 aspect ratio
-    target_height = args.height  # This should be set to the height corresponding to the 16:9 aspect ratio
+def process_new_image(new_image, text, args, unique_image=False, banner="", image_id=None):
+    # Scaled copies of this image, only built the first time we see it
+    variants = image_variants.get(new_image, image_id)
 
-    # Check if we have enough images to fill the sides
+    # The collage with the 6 most recent images on the sides once we have them, else the image fit to the frame,
+    # only rebuilt when a new image changes it
     if len(past_images_queue) >= 6:
-        # Use the 6 most recent images for each side
-        side_images = list(past_images_queue)
-        final_image = create_16_9_image(new_image, side_images, target_width, target_height)
-        final_image = add_text_to_image(final_image, text, banner)
+        compositor.set_background(variants, past_images_queue)
     else:
-        # Not enough images, just add text to the new_image
-        final_image = add_text_to_image(new_image, text, banner)
+        compositor.set_background(variants)
+
+    logger.info(f"Adding text to image: {text[:80]}")
+    final_image = compositor.compose(text, banner)
 
     # Add the new image to the queue for future use
     if unique_image:
-        past_images_queue.appendleft(new_image)
+        past_images_queue.appendleft(variants)
         #past_images_all_time_queue.appendleft(new_image)
 
     return final_image
 
-## Japanese writing on images
-def draw_japanese_text_on_image(image_np, text, position, font_path, font_size):
-    # Convert to a PIL Image
-    image_pil = Image.fromarray(cv2.cvtColor(image_np, cv2.COLOR_BGR2RGB))
-
-    # Prepare drawing context
-    draw = ImageDraw.Draw(image_pil)
-    font = ImageFont.truetype(font_path, font_size)
-
-    # Define the border width for the text
-    border_width = 5
-
-    # Get text size using getbbox
-    x, y = position
-    bbox = font.getbbox(text)
-    text_width, text_height = bbox[2], bbox[3]
-    y = y - text_height
-    x = x + text_width / 2
-
-    # Draw text border (outline)
-    for i in range(-border_width, border_width + 1):
-        for j in range(-border_width, border_width + 1):
-            draw.text((x + i, y + j), text, font=font, fill=(0, 0, 0))  # Black border
-
-    # Draw text on image
-    draw.text((x, y), text, font=font, fill=(255, 255, 255))  # White fill
-
-    # Convert back to NumPy array
-    image_np = cv2.cvtColor(np.array(image_pil), cv2.COLOR_RGB2BGR)
-
-    return image_np
-
-def add_text_to_image(image, text, banner=""):
-    if image is not None:
-        logger.info(f"Adding text to image: {text[:80]}")
-
-        # Maintain aspect ratio and add black bars
-        width, height = image.size
-        desired_ratio = width / height
-        current_ratio = width / height
-
-        # Convert the PIL Image to a NumPy array for OpenCV operations
-        image = np.array(image)
-        image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)  # Convert from RGB to BGR for OpenCV
-
-        if current_ratio > desired_ratio:
-            new_width = int(height * desired_ratio)
-            padding = max(0, (new_width - width) // 2)
-            image = cv2.copyMakeBorder(image, 0, 0, padding, padding, cv2.BORDER_CONSTANT, value=[0, 0, 0])
-        else:
-            new_height = int(width / desired_ratio)
-            padding = max(0, (new_height - height) // 2)
-            image = cv2.copyMakeBorder(image, padding, padding, 0, 0, cv2.BORDER_CONSTANT, value=[0, 0, 0])
-
-        # Resize to the desired resolution
-        # Calculate the scaling factors
-        x_scale = args.width / image.shape[1]
-        y_scale = args.height / image.shape[0]
-        scale_factor = min(x_scale, y_scale)
-
-        # Compute new width and height while maintaining the aspect ratio
-        new_width = int(image.shape[1] * scale_factor)
-        new_height = int(image.shape[0] * scale_factor)
-
-        # Resize the image
-        image = cv2.resize(image, (new_width, new_height), interpolation=cv2.INTER_LINEAR)
-
-        # If the resized image doesn't match the desired resolution, pad with black
-        if new_width != args.width or new_height != args.height:
-            top_padding = (args.height - new_height) // 2
-            bottom_padding = args.height - new_height - top_padding
-            left_padding = (args.width - new_width) // 2
-            right_padding = args.width - new_width - left_padding
-            image = cv2.copyMakeBorder(image, top_padding, bottom_padding, left_padding, right_padding, cv2.BORDER_CONSTANT, value=[0, 0, 0])
-
-        width, height = image.shape[1], image.shape[0]
-        current_ratio = width / height
-
-        def contains_japanese(text):
-            for char in text:
-                if any([start <= ord(char) <= end for start, end in [
-                    (0x3040, 0x309F),  # Hiragana
-                    (0x30A0, 0x30FF),  # Katakana
-                    (0x4E00, 0x9FFF),  # Kanji
-                    (0x3400, 0x4DBF)   # Kanji (extension A)
-                ]]):
-                    return True
-            return False
-
-        wrap_width = 30
-        if current_ratio > 1.0:
-            wrap_width = 50
-        wrapped_text = textwrap.wrap(text, width=wrap_width, fix_sentence_endings=False, break_long_words=False, break_on_hyphens=False)
-        y_pos = height  # Adjusted height from bottom
-
-        font_size = 2
-        font_thickness = 6
-        border_thickness = 15
-
-        # Configuration for the banner text
-        banner_font_size = 1  # Smaller font size for the banner
-        banner_font_thickness = 2  # Thickness of the banner font
-        banner_outline_color = (0, 0, 0)  # Black outline for better visibility
-        banner_border_thickness = 1  # Thickness of the text outline
-
-        # Draw banner if it's not empty on the top of the image from left to right
-        if banner != "":
-            ((text_width, text_height), baseline) = cv2.getTextSize(
-                banner[:width-10], cv2.FONT_HERSHEY_DUPLEX, banner_font_size, banner_font_thickness)
-            x_pos_t = 5  # Adjusted width from left
-            y_pos_t = text_height + 10  # Adjusted height from top, with some padding
-
-            # Draw a solid black rectangle for the banner background
-            overlay = image.copy()
-            cv2.rectangle(overlay, (0, 0), (width, y_pos_t + 10), (0, 0, 0), -1)
-
-            # Draw text shadow for the banner
-            shadow_offset = 2  # Smaller offset for the shadow
-            cv2.putText(image, banner[:width-10], (x_pos_t + shadow_offset, y_pos_t - shadow_offset),
-                        cv2.FONT_HERSHEY_DUPLEX, banner_font_size, (0, 0, 0), banner_font_thickness)
-            alpha = 0.5  # Transparency factor.
-            image = cv2.addWeighted(overlay, alpha, image, 1 - alpha, 0)
-
-            # Draw text outline for the banner
-            cv2.putText(image, banner[:width-10], (x_pos_t, y_pos_t), cv2.FONT_HERSHEY_DUPLEX, banner_font_size, banner_outline_color, banner_border_thickness)
-
-            # Draw the main banner text
-            cv2.putText(image, banner[:width-10], (x_pos_t, y_pos_t), cv2.FONT_HERSHEY_DUPLEX, banner_font_size, (255, 255, 0), banner_font_thickness)
-
-        for line in reversed(wrapped_text):
-            # Get the text size, baseline, and adjust the y_pos
-            ((text_width, text_height), baseline) = cv2.getTextSize(line[:width], cv2.FONT_HERSHEY_DUPLEX, font_size, font_thickness)
-            x_pos = (width - text_width) // 2  # Center the text
-            y_pos -= (baseline + text_height + 10)  # Adjust y_pos for each line, reduce padding
-
-            # Calculate the rectangle coordinates with less height
-            rect_x_left = x_pos - 10
-            rect_y_top = y_pos - text_height - 10  # Reduced padding for height
-            rect_x_right = x_pos + text_width + 10
-            rect_y_bottom = y_pos + 18  # Reduced padding for height
-
-            # Draw a semi-transparent rectangle
-            overlay = image.copy()
-            cv2.rectangle(overlay, (rect_x_left, rect_y_top), (rect_x_right, rect_y_bottom), (0, 0, 0), -1)
-            alpha = 0.0  # Transparency factor.
-            image = cv2.addWeighted(overlay, alpha, image, 1 - alpha, 0)
-
-            # Draw text shadow for a drop shadow effect
-            shadow_offset = 4  # Offset for the shadow, adjust as needed
-            cv2.putText(image, line[:width], (x_pos + shadow_offset, y_pos + shadow_offset), cv2.FONT_HERSHEY_DUPLEX, font_size, (0, 0, 0), font_thickness)
-
-            # Draw text outline
-            cv2.putText(image, line[:width], (x_pos, y_pos), cv2.FONT_HERSHEY_DUPLEX, font_size, (0, 0, 0), border_thickness)
-
-            # Draw the main text
-            cv2.putText(image, line[:width], (x_pos, y_pos), cv2.FONT_HERSHEY_DUPLEX, font_size, (255, 255, 255), font_thickness)
-
-        # Convert back from numpy array
-        image = Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
-
-    return image  # returning the modified image
-
 def image_to_ascii(image):
     image = image.resize((args.width, int((image.height/image.width) * args.width * 0.55)), Image.LANCZOS)
     image = image.convert('L')  # Convert to grayscale
@@ -336,74 +130,29 @@ def update_image(duration_ms):
         print(f"Render: Quitting.")
         cv2.destroyAllWindows()
 
-def convert_rgbx_to_yuv420(rgbx_img):
-    # Remove the alpha channel
-    rgb_img = rgbx_img[:, :, :3]
-
-    # Convert RGB to YUV
-    yuv_img = cv2.cvtColor(rgb_img, cv2.COLOR_RGB2YUV)
-
-    # Subsample the U and V channels
-    Y, U, V = cv2.split(yuv_img)
-    U = cv2.resize(U, (U.shape[1] // 2, U.shape[0] // 2), interpolation=cv2.INTER_AREA)
-    V = cv2.resize(V, (V.shape[1] // 2, V.shape[0] // 2), interpolation=cv2.INTER_AREA)
-
-    # Correctly layout YUV420
-    yuv420_img = np.concatenate([Y.flatten(), U.flatten(), V.flatten()])
-
-    return yuv420_img
-
-def render(image, duration):
-    image = np.copy(image)
+def render(image, cued=None):
+    # frames from the compositor are RGB arrays, the window, NDI and headless sinks make their own copies
+    image = np.asarray(image)
 
     if cv_display:
-        # Convert RGB to BGR (OpenCV uses BGR format)
-        image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
-        cv2.imshow(f"{args.title} (local)", image)
-        duration_ms = 1
-        update_image(duration_ms)
-
-    # NDI Video from Images
+        # the main thread owns the window, it only ever needs the newest frame
+        try:
+            display_queue.get_nowait()
+            telemetry.add("frames_dropped")
+        except queue.Empty:
+            pass
+        display_queue.put((image, cued or time.time()))
+
+    # NDI Video from Images, the sink thread keeps sending it at a steady frame rate
     if ndi_display:
-        video_frame.FourCC = ndi.FOURCC_VIDEO_TYPE_I420
-        yuv420_image = convert_rgbx_to_yuv420(image)
-        video_frame.data = yuv420_image
-
-        original_height, original_width = image.shape[:2]
-        video_frame.xres = original_width
-        video_frame.yres = original_height
-        video_frame.line_stride_in_bytes = original_width  # Stride for Y plane
-        video_frame.picture_aspect_ratio = float(original_width) / float(original_height)
-
-        ndi.send_send_video_v2(ndi_send, video_frame)
-
-def save_json(header, mediaid, type, segment_number):
-    assets_dir = f"assets/{mediaid}/{type}"
-    os.makedirs(assets_dir, exist_ok=True)
-    with open(f"{assets_dir}/{mediaid}_{type}_{segment_number}.json", 'w') as json_file:
-        json.dump(header, json_file)
-
-def save_asset(asset, mediaid, segment_number, type):
-    directory = f"assets/{mediaid}/{type}"
-    os.makedirs(directory, exist_ok=True)
-    file_path = f"{directory}/{mediaid}_{type}_{segment_number}"
-
-    if type == "speek":
-        file_path += ".wav"
-        with open(file_path, 'wb') as file:
-            file.write(asset)
-    elif type == "image":
-        file_path += ".png"
-        img_byte_arr = io.BytesIO()
-        asset.save(img_byte_arr, format="PNG")  # Save it as PNG or JPEG depending on your preference
-        asset = img_byte_arr.getvalue()
-
-        with open(file_path, 'wb') as f:
-            f.write(asset)
-    elif type == "music":
-        file_path += ".wav"
-        with open(file_path, 'wb') as file:
-            file.write(asset)
+        ndi_sink.set_frame(image)
+
+    if headless_sink is not None:
+        headless_sink.set_frame(image)
+
+    telemetry.add("frames_rendered")
+    if not cv_display:
+        telemetry.set("screen_latency_ms", int((time.time() - (cued or time.time())) * 1000))
 
 def get_audio_duration(audio_samples):
     audio_segment = AudioSegment.from_file(io.BytesIO(audio_samples), format="wav")
@@ -411,87 +160,16 @@ def get_audio_duration(audio_samples):
     duration_s = duration_ms / 1000.0  # Convert to seconds
     return duration_s
 
-class BackgroundMusic(threading.Thread):
-    def __init__(self):
-        super().__init__()
-        self.audio_buffer = None
-        self.running = True
-        self.lock = threading.Lock()  # Lock to synchronize access to audio_buffer
-        self.channel = audio_channel_music  # Assign a specific channel
-        self.complete = True
-        self.switching = False
-
-    def run(self):
-        while self.running:
-            if self.audio_buffer:
-                self.play_audio()
-            else:
-                time.sleep(0.1)
-
-    def play_audio(self):
-        audiobuf = None
-        with self.lock:
-            if self.audio_buffer != None:
-                audiobuf = io.BytesIO(self.audio_buffer)
-
-        if audiobuf:
-            # Load the audio data into a Sound object
-            sound = pygame.mixer.Sound(audiobuf)
-            self.switching = False
-            self.channel.play(sound, loops=0, maxtime=0, fade_ms=10)  # Play the Sound object on this channel
-            while self.channel.get_busy():  # Wait for playback to finish
-                time.sleep(0.1)
-        else:
-            print(f"Music Thread: *** No audio buffer to play for play_audio().")
-            time.sleep(1)
-
-    def change_track(self, audio_buffer):
-        with self.lock:
-            # Update the audio buffer with the new track
-            self.audio_buffer = audio_buffer
-            self.switching = True
-            self.channel.fadeout(10)  # Fade out the audio
-
-    def pause(self):
-        with self.lock:
-            self.channel.pause()
-
-    def unpause(self):
-        with self.lock:
-            self.channel.unpause()
-
-    def stop(self):
-        self.running = False
-
-def prepare_audio_frame(audio_segment, sample_rate=48000, no_channels=2):
-    # Convert audio_segment to samples
-    samples = np.array(audio_segment.get_array_of_samples(), dtype=np.float32)
-    audio_frame = ndi.AudioFrameV2()
-
-    # Set the audio frame properties
-    audio_frame.sample_rate = sample_rate
-    audio_frame.no_channels = no_channels
-    audio_frame.no_samples = len(samples) // no_channels
-    audio_frame.timecode = ndi.send_timecode_synthesize
-    # NDI SDK expects interleaved float32 audio data
-    audio_frame.p_data = samples
-
-    return audio_frame
-
-def play_audio(audio_data, target_sample_rate=22050, no_channels=2, duration=1):
+def decode_pcm(audio_data):
+    ## int16 (frames, channels) samples and their rate from WAV, or AAC through pydub
+    try:
+        return wav_to_pcm(audio_data)
+    except Exception:
+        pass
+
     # Detect the mime type of the audio data
     mime_type = magic.from_buffer(audio_data, mime=True)
 
-    # NDI Audio
-    if args.ndi_audio:
-        target_sample_rate = 48000;
-        audio_segment = AudioSegment.from_file(io.BytesIO(audio_data), format="wav")
-        audio_frame = prepare_audio_frame(audio_segment, sample_rate=target_sample_rate, no_channels=no_channels)
-
-        ndi.send_send_audio_v2(ndi_send, audio_frame)
-        time.sleep(duration)
-        return
-
     # Load the audio data into an AudioSegment
     if mime_type in ['audio/x-wav', 'audio/wav']:
         audio_segment = AudioSegment.from_file(io.BytesIO(audio_data), format='wav')
@@ -502,46 +180,250 @@ def play_audio(audio_data, target_sample_rate=22050, no_channels=2, duration=1):
     else:
         raise ValueError(f"Unsupported audio format: {mime_type}")
 
-    # Resample the audio to the target sample rate if necessary
-    if audio_segment.frame_rate != target_sample_rate:
-        audio_segment = audio_segment.set_frame_rate(target_sample_rate)
+    audio_segment = audio_segment.set_sample_width(2)
+    samples = np.array(audio_segment.get_array_of_samples(), dtype=np.int16).reshape(-1, audio_segment.channels)
+    return samples, audio_segment.frame_rate
+
+def decode_audio(audio_data):
+    ## Speech ready to start, float samples at the mixer's rate
+    return mixer.prepare(*decode_pcm(audio_data))
+
+def speech_ended():
+    # runs in the mixer a block before the speech ends, so the next one can be started right on its last sample
+    print(f"X", end="", flush=True)
+    handoff.clear()
+    speech_done.set()
+    wake.set()
+    if headless_sink is not None and headless_sink.speed != 1.0:
+        # off realtime the clock waits here, up to a second, for the next speech as live playback would have had the time for it
+        handoff.wait(timeout=1.0)
+
+def start_audio(samples):
+    ## Start decoded speech, nothing left to do here but hand it to the mixer
+    mixer.play_speech(samples, at=mixer.speech_end(), on_ending=speech_ended)
+    handoff.set()
+
+    # the gap is the silence on the audio clock from the end of the last speech to this one starting
+    gap = mixer.speech_gap()
+    if gap is not None:
+        gap_ms = int(gap * 1000 / mixer.sample_rate)
+        telemetry.observe("segment_gap_ms", gap_ms)
+        average = telemetry.get("segment_gap_ms_sum") / telemetry.get("segment_gap_ms_count")
+        logger.info(f"Speech starts {gap_ms} ms after the last one ended, {average:.0f} ms average.")
+
+def playback(image, text, banner, unique_image, image_id, audio, duration, start=True):
+    # hand the cue to the renderer and audio threads, which compose the frame and decode the speech as soon as
+    # they get it and hold them until start_playback(), right away unless start is False
+    frame = image is not None and not args.norender
+    if frame:
+        render_queue.put(("prepare", (image, text, banner, unique_image, image_id)))
+    if audio:
+        audio_queue.put(("prepare", audio))
+    if start:
+        start_playback(frame, bool(audio))
+    return frame, bool(audio)
+
+def start_playback(frame=True, audio=True):
+    # put out the prepared frame and speech, the frame first so it is up when the speech starts
+    cued = time.time()
+    if frame:
+        render_queue.put(("show", cued))
+    if audio:
+        audio_queue.put(("play", cued))
+        print(f"Audio playback initiated.")
 
-    # Export the resampled audio to a bytes buffer
-    wav_io = io.BytesIO()
-    audio_segment.export(wav_io, format='wav')
-    wav_io.seek(0)
-    audio_data = wav_io.read()
+def count_buffered(name, message, sign):
+    # depth and seconds of each buffer kept as segments go in and out, nothing walks the queues to report them
+    stream = name.lower()
+    if telemetry.add(f"{stream}_buffer_size", sign, kind="gauge") == 0:
+        # empty is exactly nothing, don't carry float rounding along
+        telemetry.set(f"{stream}_buffer_duration", 0.0)
+    else:
+        telemetry.add(f"{stream}_buffer_duration", sign * float(message.get("duration", 0.0)), kind="gauge")
+
+def count_memory(buffer, name):
+    # what the buffer holds in memory and has spilled to disk
+    stream = name.lower()
+    telemetry.set(f"{stream}_buffer_bytes", buffer.memory_bytes)
+    telemetry.set(f"{stream}_buffer_spilled_bytes", buffer.spilled_bytes)
+
+def put_buffered(buffer, item, name, encoded=None, key=None, policy=None):
+    # never blocks ingest, the buffer spills or drops by its policy once over its memory budget
+    for dropped_message in buffer.put(item[0], item[1], encoded, key, policy):
+        count_buffered(name, dropped_message, -1)
+        telemetry.add(f"{name.lower()}_dropped")
+        logger.warning(f"{name} buffer full, dropping segment #{dropped_message.get('segment_number')} {dropped_message.get('mediaid')}.")
+    count_buffered(name, item[0], 1)
+    count_memory(buffer, name)
+
+def take(buffer, name):
+    # the scheduler's side of put_buffered, spilled segments are read back and decoded here
+    item = buffer.get()
+    count_buffered(name, item[0], -1)
+    count_memory(buffer, name)
+    return item
+
+def decode_image(data):
+    image = Image.open(io.BytesIO(data))
+    image.load()
+    return image
+
+def image_bytes(image):
+    return image.width * image.height * len(image.getbands())
+
+def ingest():
+    ## Block on the socket and queue what arrives, images are decoded here so nothing downstream waits on it
+    while True:
+        # Receive the header message and its asset
+        header_message = socket.recv_json()
+        asset = socket.recv()
+        header_message["received"] = time.time()
 
-    # Load the WAV data into Pygame
-    sound = pygame.mixer.Sound(io.BytesIO(audio_data))
+        segment_number = header_message["segment_number"]
+        timestamp = header_message["timestamp"]
+        mediaid = header_message["mediaid"]
 
-    # Play the audio on the selected channel
-    print(f"*** Playing audio on channel {audio_channel_speech.get_busy()}")
-    audio_channel_speech.play(sound)
+        message = header_message["message"]
+        text = header_message["text"]
 
-def playback(image, audio, duration):
-    # play both audio and display image with audio blocking till finished
-    if image and not args.norender:
-        render(image, duration)
+        optimized_prompt = text
+        if 'optimized_text' in header_message:
+            optimized_prompt = header_message["optimized_text"]
 
-    if audio:
-        play_audio(audio, 22050, 2, duration)
-        print(f"Audio playback initiated.")
+        type = header_message["stream"]
+        if type == "music":
+            # Print the header
+            logger.info(f"Received {type} segment #{segment_number} {timestamp}: {mediaid} {len(text)} characters: {text[:20]}")
 
-def get_audio_duration(audio_samples):
-    audio_segment = AudioSegment.from_file(io.BytesIO(audio_samples), format="wav")
-    duration_ms = len(audio_segment)  # Duration in milliseconds
-    duration_s = duration_ms / 1000.0  # Convert to seconds
-    return duration_s
+            if asset_writer is not None:
+                asset_writer.save(header_message, asset)
 
-def main():
-    ## Main routine
-    bg_music = BackgroundMusic()
-    bg_music.start()
+            # queue in music_buffer header and music, unless music is off
+            if args.music:
+                # streamed chunks all play, a whole track replaces any still waiting
+                put_buffered(music_buffer, (header_message, asset), "Music", policy="keep" if header_message.get("music_stream") else "latest")
+
+            print(f"M", end="", flush=True)
+
+        elif type == "speek":
+            # Print the header
+            logger.info(f"Received {type} segment #{segment_number} {timestamp}: {mediaid} {len(text)} characters: {text[:20]}")
+
+            # queue the header and audio together
+            put_buffered(audio_buffer, (header_message, asset), "Audio")
+
+            if asset_writer is not None:
+                asset_writer.save(header_message, asset)
+
+            print(f"S", end="", flush=True)
+
+        ## Image
+        elif type == "image":
+            # Print the header
+            logger.info(f"Received image segment {type} #{segment_number} {timestamp}: {mediaid} {len(text)} characters: {text[:20]}")
+
+            # the producers are generating, the slideshow leaves the image generator to them
+            slideshow.activity()
+
+            image = None
+            try:
+                # Id of the encoded bytes, keys the pre-scaled variants so each image is scaled only once
+                image_id = header_message["image_id"] = asset_image_id(asset)
+                # Convert the bytes back to a PIL Image object, decoded now rather than when it goes on screen,
+                # a throttled resend of an image still queued shares the one already decoded
+                image = image_buffer.payload(image_id)
+                if image is not None:
+                    telemetry.add("image_coalesced")
+                else:
+                    image = decode_image(asset)
+                if args.show_ascii_art:
+                    payload_hex = image_to_ascii(image)
+                    print(f"\n{payload_hex}\n", flush=True)
+
+                logger.info(f"Image Prompt: {optimized_prompt[:20]}\Original Text: {text[:10]}...\nOriginal Question:{message[:10]}...")
+
+                # queue the header and image together
+                put_buffered(image_buffer, (header_message, image), "Image", encoded=asset, key=image_id)
+            except Exception as e:
+                logger.error(f"Error converting image: {e}")
+
+            # the bytes as received, saving the decoded image would mean encoding it again
+            if asset_writer is not None and image is not None:
+                asset_writer.save(header_message, asset)
 
+            print(f"I", end="", flush=True)
+        else:
+            logger.error(f"Unknown stream {type} for segment #{segment_number} {mediaid}.")
+            continue
+
+        wake.set()
+
+def renderer():
+    ## Compose each cued frame ahead of time and put it up on the local window and NDI when it is due
+    ready = None
+    while True:
+        kind, job = render_queue.get()
+        try:
+            if kind == "prepare":
+                image, text, banner, unique_image, image_id = job
+                start = time.perf_counter()
+                ready = process_new_image(image, text, args, unique_image, banner, image_id)
+                telemetry.observe("compose_ms", round((time.perf_counter() - start) * 1000, 2))
+            elif ready is not None:
+                render(ready, job)
+                ready = None
+        except Exception as e:
+            logger.error(f"Error rendering image: {e}")
+            ready = None
+
+def audio_player():
+    ## Decode each cued speech segment ahead of time and start it when it is due, music tracks and chunks decoded on the way
+    ready = None
+    while True:
+        kind, job = audio_queue.get()
+        try:
+            if kind == "prepare":
+                ready = None
+                ready = decode_audio(job)
+            elif kind == "music":
+                mixer.play_music(decode_audio(job))
+            elif kind == "music_chunk":
+                mixer.queue_music_chunk(decode_audio(job))
+            elif ready is None:
+                raise RuntimeError("no decoded speech to play")
+            else:
+                start_audio(ready)
+                ready = None
+        except Exception as e:
+            logger.error(f"Error playing back audio: {e}")
+            if kind == "play":
+                # nothing will play so no end event is coming, don't leave the scheduler waiting on it
+                speech_done.set()
+                wake.set()
+                handoff.set()
+
+def display():
+    ## The main thread services the window, everything else runs in the other threads
+    while headless_sink is None or headless_sink.is_alive():
+        try:
+            # with no window there is nothing to do here but wait
+            image, cued = display_queue.get(block=not cv_display, timeout=1.0)
+            # Convert RGB to BGR (OpenCV uses BGR format)
+            cv2.imshow(f"{args.title} (local)", cv2.cvtColor(image, cv2.COLOR_RGB2BGR))
+            telemetry.set("screen_latency_ms", int((time.time() - cued) * 1000))
+        except queue.Empty:
+            pass
+
+        if cv_display:
+            # waitKey services the window and paces this loop
+            update_image(10)
+
+def schedule():
+    ## Pair speech with images, keep the status going out and hand the cues to the renderer and audio threads
     last_music_change = 0
 
     last_image_asset = None
+    last_image_id = None
     last_text_asset = "Ask me a Question - Groovy Life AI: tibetan mountains"
 
     image_segment_number = 0
@@ -553,236 +435,95 @@ def main():
     audio_latency_delta = 0
     image_latency_delta = 0
 
-    stats_last_sent_ts = 0
-    stats_last_sent_duration = 0.0
-
     end_of_stream = True
     last_sent_break = 0
 
     last_generated_image_time = 0
+    hold_until = 0
+    # the next segment, paired and being composed and decoded while the current one plays
+    prepared = None
 
-    while True:
-        # check if we will block, if so then don't and check events instead of pygame
-        header_message = None
-        segment_number = 0
-        timestamp = 0
-        mediaid = 0
-        message = ""
-        text = ""
-        optimized_prompt = ""
-        type = ""
-        music = None
-        audio = None
-        image = None
-
-        if socket.poll(timeout=0):
-            # Receive the header message
-            header_message = socket.recv_json()
-
-            segment_number = header_message["segment_number"]
-            timestamp = header_message["timestamp"]
-            mediaid = header_message["mediaid"]
-
-            message = header_message["message"]
-            text = header_message["text"]
-
-            optimized_prompt = text
-            if 'optimized_text' in header_message:
-                optimized_prompt = header_message["optimized_text"]
-
-            type = header_message["stream"]
-            if type == "music":
-                # Now, receive the binary audio data
-                music = socket.recv()
-
-                # Print the header
-                logger.info(f"Received {type} segment #{segment_number} {timestamp}: {mediaid} {len(text)} characters: {text[:20]}")
-
-                try:
-                    if args.save == True:
-                        # Save audio asset
-                        save_json(header_message, mediaid, type, segment_number)
-                        save_asset(music, mediaid, segment_number, type)
-                except Exception as e:
-                    logger.error(f"Error saving music asset: {e}")
-
-                # queue in music_buffer header and music
-                music_buffer.put((header_message, music))
-
-                print(f"M", end="", flush=True)
-
-            if type == "speek":
-                # Now, receive the binary audio data
-                audio = socket.recv()
-
-                # Print the header
-                logger.info(f"Received {type} segment #{segment_number} {timestamp}: {mediaid} {len(text)} characters: {text[:20]}")
-
-                # queue the header and audio together
-                audio_buffer.put((header_message, audio))
-
-                try:
-                    if args.save == True:
-                        save_json(header_message, mediaid, type, segment_number)
-                        save_asset(audio, mediaid, segment_number, type)
-                except Exception as e:
-                    logger.error(f"Error saving audio asset: {e}")
-
-                print(f"S", end="", flush=True)
-
-            ## Image
-            if type == "image":
-                # Now, receive the binary audio data
-                image = socket.recv()
-
-                # Print the header
-                logger.info(f"Received image segment {type} #{segment_number} {timestamp}: {mediaid} {len(text)} characters: {text[:20]}")
-
-                try:
-                    # Convert the bytes back to a PIL Image object
-                    image = Image.open(io.BytesIO(image))
-                    if args.show_ascii_art:
-                        payload_hex = image_to_ascii(image)
-                        print(f"\n{payload_hex}\n", flush=True)
-
-                    logger.info(f"Image Prompt: {optimized_prompt[:20]}\Original Text: {text[:10]}...\nOriginal Question:{message[:10]}...")
-
-                    # queue the header and image together
-                    image_buffer.put((header_message, image))
-                except Exception as e:
-                    logger.error(f"Error converting image: {e}")
-
-                try:
-                    if args.save == True:
-                        save_json(header_message, mediaid, type, segment_number)
-                        save_asset(image, mediaid, segment_number, type)
-                except Exception as e:
-                    logger.error(f"Error saving image asset: {e}")
-
-                print(f"I", end="", flush=True)
-        else:
-            ## No ZMQ message available, check for events
-            print(f".", end="", flush=True)
-
-        worked = False
-        ## Update the image if we are rendering during speaking
-        if not audio_playback_complete_speech:
-            update_image(1)
-            worked = True
-
-        # No message available, check for events
-        if pygame.event.peek(AUDIO_END_EVENT_SPEECH):
-            for event in pygame.event.get(AUDIO_END_EVENT_SPEECH):
-                if event.type == AUDIO_END_EVENT_SPEECH:
-                    print(f"X", end="", flush=True)
-                    audio_playback_complete_speech = True
-                else:
-                    logger.error(f"Unknown event on get event: {event}")
-            worked = True
-
-        # Send status of last playback time for the audio and image assets
+    def scheduler_status():
+        # the scheduler's own state and the mixer's, read only when a status goes out
         status = {}
-        status["timestamp"] = time.time()
         status["audio_segment_number"] = audio_segment_number
         status["image_segment_number"] = image_segment_number
         status["audio_playback_complete_speech"] = audio_playback_complete_speech
         status["last_sent_segments"] = last_sent_segments
         status["last_music_change"] = last_music_change
-        status["audio_buffer_size"] = audio_buffer.qsize()
-        status["image_buffer_size"] = image_buffer.qsize()
-        status["music_buffer_size"] = music_buffer.qsize()
-        status["audio_playback_complete_speech"] = audio_playback_complete_speech
-        status["audio_channel_speech_busy"] = audio_channel_speech.get_busy()
-        status["audio_channel_music_busy"] = audio_channel_music.get_busy()
-        status["audio_channel_music_volume"] = audio_channel_music.get_volume()
-        status["audio_channel_speech_volume"] = audio_channel_speech.get_volume()
-        status["audio_channel_music_switching"] = bg_music.switching
-        status["audio_channel_music_complete"] = bg_music.complete
-        status["audio_channel_music_running"] = bg_music.running
+        # the channel fields keep their names, they come from the mixer now
+        status["audio_channel_speech_busy"] = mixer.speech_busy()
+        status["audio_channel_music_busy"] = mixer.music_busy()
+        status["audio_channel_music_volume"] = mixer.music_volume
+        status["audio_channel_speech_volume"] = mixer.speech_volume
+        status["audio_channel_music_switching"] = mixer.crossfading()
+        status["audio_channel_music_complete"] = not mixer.music_busy()
+        status["audio_channel_music_running"] = mixer.running
+        status["audio_clock"] = round(mixer.clock(), 3)
         status["audio_latency_delta"] = audio_latency_delta
         status["image_latency_delta"] = image_latency_delta
+        status["next_segment_prepared"] = prepared is not None
         status["eos"] = end_of_stream
+        # TTM generates music only when the next track change is due and nothing is queued for it
+        status["music_enabled"] = args.music
+        status["music_change_due"] = args.music and telemetry.get("music_buffer_size") == 0 and (last_music_change == 0 or time.time() - last_music_change > args.music_interval)
 
-        # calculate the duration field total for all the queued audio packets
-        # don't remove them from the queue, just get the duration field and add it to the total
-        total_duration = 0.0
-        for audio_message, audio_asset in audio_buffer.queue:
-            total_duration += audio_message["duration"]
-        status["audio_buffer_duration"] = total_duration
-
-        # send status to zmq output
         sent_delta = time.time() - last_sent_segments
-        status["sent_delta"] = sent_delta
-        if sent_delta < args.startup_delay:
-            # check if we have 0 seconds of buffer, if so then fake it as 60 seconds and send it
-            if status["audio_buffer_duration"] == 0.0:
-                status["audio_buffer_duration"] = 60.0
-
-        if time.time() - stats_last_sent_ts > args.stats_interval or stats_last_sent_duration != status["audio_buffer_duration"]:
-            logger.info(f"Sending status: {status}")
-            sender.send_json(status)
-            stats_last_sent_ts = time.time()
-            stats_last_sent_duration = status["audio_buffer_duration"]
-
-        # check audio_buffer_duration, if 0 and image_buffer is empty, then resend the image with the last text
-        if status["audio_buffer_duration"] == 0.0 and image_buffer.empty() and audio_buffer.empty():
-            if time.time() - last_generated_image_time > args.slideshow_interval:
-                # get the last text and image
-                if last_text_asset:
-                    ## get an image randomly from past_images_all_time_queue and use it as the base image
-                    #past_image = random.choice(past_images_all_time_queue)
-
-                    # randomly pick a list member of the text_history list
-                    random_message = random.choice(text_history)
-                    random_message2 = random.choice(text_history)
-                    random_message3 = random.choice(text_history)
-                    # Generate a new image from previous text
-                    new_image = generate_sd_webui(random_message + " " + random_message2 + " " + random_message3)
-
-                    if new_image != None:
-                        last_image_asset = new_image
-                    else:
-                        #print(f"Error generating image from text: {random_message} {random_message2} {random_message3}")
-                        #past_image = random.choice(past_images_all_time_queue)
-                        new_image = last_image_asset
-
-                    image_np = process_new_image(new_image, last_text_asset, args, True, "Groovy Life AI")
-                    # send image directly to NDI
-                    render(image_np, 1)
-                    last_generated_image_time = time.time()
+        status["sent_delta"] = round(sent_delta, 1)
+        status["audio_buffer_duration"] = round(telemetry.get("audio_buffer_duration", 0.0), 3)
+        if sent_delta < args.startup_delay and status["audio_buffer_duration"] == 0.0:
+            # nothing sent yet, look full so the producers don't all rush in at once
+            status["audio_buffer_duration"] = 60.0
+        return status
+
+    while True:
+        # sleep until ingest or the end of speech wakes us, or a second passes for the timed checks
+        wake.wait(timeout=1.0)
+        wake.clear()
+
+        worked = False
+        if speech_done.is_set():
+            speech_done.clear()
+            audio_playback_complete_speech = True
+
+        # Send what changed in the status, the fields are kept up to date where they change
+        telemetry.publish(sender, scheduler_status)
+
+        # check audio_buffer_duration, if 0 and image_buffer is empty, then show a new image with the last text
+        if time.time() - last_sent_segments >= args.startup_delay and telemetry.get("audio_buffer_duration") == 0.0 and image_buffer.empty() and audio_buffer.empty() and prepared is None:
+            if time.time() - last_generated_image_time > args.slideshow_interval and last_text_asset:
+                # pregenerated from previous text, the last image again if the pool is empty
+                last_generated_image_time = time.time()
+                new_image = slideshow.take()
+                new_image_id = None
+                if new_image != None:
+                    last_image_asset = new_image
+                    last_image_id = None
+                else:
+                    new_image = last_image_asset
+                    new_image_id = last_image_id
+
+                if new_image is not None:
+                    playback(new_image, last_text_asset, "Groovy Life AI", True, new_image_id, None, 0)
+                    worked = True
 
         ## get an audio sample and header, get the text field from it, then get an image and header and burn in the text from the audio header to the image and render it while playing the audio
-        if args.nobuffer and args.norender and not audio_buffer.empty() and audio_playback_complete_speech:
-            audio_message, audio_asset = audio_buffer.get()
+        if time.time() < hold_until:
+            pass
+        elif args.nobuffer and args.norender and not audio_buffer.empty() and audio_playback_complete_speech:
+            audio_message, audio_asset = take(audio_buffer, "Audio")
             text = audio_message["text"]
             duration = audio_message["duration"]
-            optimized_prompt = text
-            if 'optimized_text' in audio_message:
-                optimized_prompt = audio_message["optimized_text"]
-            else:
-                optimized_prompt = text
             audio_playback_complete_speech = False
-            playback(None, audio_asset, duration)
+            playback(None, text, "", False, None, audio_asset, duration)
             last_sent_segments = time.time()
             audio_segment_number = audio_message["segment_number"]
             logger.info(f"Sent audio segment #{audio_message['segment_number']} at timestamp {audio_message['timestamp']}")
             worked = True
-        elif not audio_buffer.empty() and not image_buffer.empty() and audio_playback_complete_speech:
-            audio_message, audio_asset = audio_buffer.get()
-            image_message, image_asset = image_buffer.get()
-
-            image_segment_number = image_message["segment_number"]
-            audio_segment_number = audio_message["segment_number"]
-            last_sent_segments = time.time()
-
-            duration = audio_message["duration"]
-
-            if "eos" in audio_message and audio_message["eos"] == True:
-                end_of_stream = True
-                bg_music.unpause()
-            else:
-                end_of_stream = False
-                bg_music.pause()
+        elif not audio_buffer.empty() and not image_buffer.empty() and prepared is None and (args.lookahead or audio_playback_complete_speech):
+            # pair the next segment while the current one still plays, its frame and speech get ready in the background
+            audio_message, audio_asset = take(audio_buffer, "Audio")
+            image_message, image_asset = take(image_buffer, "Image")
 
             text = audio_message["text"]
             optimized_prompt = text
@@ -799,25 +540,41 @@ def main():
             if "throttle" in image_message:
                 if image_message["throttle"] == "true":
                     unique_image = False
-            last_image_asset = image_asset.copy()
-            last_text_asset = text
-            # store text in our history
-            text_history.append(text)
             banner_msg = f"{audio_message['username']} asked {audio_message['message'][:300]}"
             if 'eos' in audio_message and audio_message['eos'] == True:
                 banner_msg = f"{audio_message['message']}"
-            if args.burn_prompt:
-                image_np = process_new_image(
-                    image_asset, optimized_prompt, args, unique_image, banner_msg)
-            else:
-                image_np = process_new_image(image_asset, text, args, unique_image, banner_msg)
 
-            # Play audio and display image
-            try:
-                audio_playback_complete_speech = False
-                playback(image_np, audio_asset, duration)
-            except Exception as e:
-                logger.error(f"Error playing back audio and displaying image: {e}")
+            cue = playback(image_asset, optimized_prompt if args.burn_prompt else text, banner_msg, unique_image, image_message.get("image_id"),
+                           audio_asset, audio_message["duration"], start=False)
+            prepared = (audio_message, image_message, image_asset, cue)
+            worked = True
+
+        if prepared is not None and audio_playback_complete_speech and time.time() >= hold_until:
+            # the current speech is over, the next frame and speech are already prepared so starting them is all that's left
+            audio_message, image_message, image_asset, cue = prepared
+            prepared = None
+            audio_playback_complete_speech = False
+            start_playback(*cue)
+
+            image_segment_number = image_message["segment_number"]
+            audio_segment_number = audio_message["segment_number"]
+            last_sent_segments = time.time()
+
+            if "eos" in audio_message and audio_message["eos"] == True:
+                end_of_stream = True
+                mixer.resume_music()
+            else:
+                end_of_stream = False
+                # music keeps playing under speech, ducked by the mixer's sidechain, unless asked for silence
+                if args.pause_music:
+                    mixer.pause_music()
+
+            # images are not modified after ingest, holding the reference is enough
+            last_image_asset = image_asset
+            last_image_id = image_message.get("image_id")
+            last_text_asset = audio_message["text"]
+            # store text in our history
+            slideshow.add_text(last_text_asset)
 
             worked = True
             audio_timestamp = audio_message["timestamp"]
@@ -832,9 +589,9 @@ def main():
             logger.info(f"Sent image segment #{image_message['segment_number']} at timestamp {image_message['timestamp']} with latency delta {image_latency_delta} ms.")
 
             if end_of_stream and image_message['ainame'] == "passthrough":
-                # sleep so image displays for a bit
-                time.sleep(5)
-        else:
+                # hold so the image displays for a bit, without stopping the status and music
+                hold_until = time.time() + 5
+        elif prepared is None and time.time() >= hold_until:
             # check last sent segments and if it's been more than 5 seconds, send a blank image and audio
             if time.time() - last_sent_segments > 15 and last_image_asset is not None:
                 # confirm image_segment_number and audio_segment_number are both matching, else we need see if audio has buffered
@@ -844,7 +601,7 @@ def main():
                     if image_buffer.empty():
                         if not audio_buffer.empty():
                             logger.info(f"Warning: A/V Alignment offset, audio buffer is not empty, using last image and audio.")
-                            audio_message, audio_asset = audio_buffer.get()
+                            audio_message, audio_asset = take(audio_buffer, "Audio")
                             text = audio_message["text"]
                             optimized_prompt = text
                             duration = audio_message["duration"]
@@ -856,10 +613,8 @@ def main():
                             banner_msg = f"{audio_message['username']} asked {audio_message['message'][:300]}"
                             if 'eos' in audio_message and audio_message['eos'] == True:
                                 banner_msg = f"{audio_message['message']}"
-                            image_np = process_new_image(
-                                last_image_asset, optimized_prompt, args, new_image, banner_msg)
                             audio_playback_complete_speech = False
-                            playback(image_np, audio_asset, duration)
+                            playback(last_image_asset, optimized_prompt, banner_msg, new_image, last_image_id, audio_asset, duration)
                             last_sent_segments = time.time()
                             audio_segment_number = audio_message["segment_number"]
                             logger.info(f"Sent audio segment #{audio_message['segment_number']} at timestamp {audio_message['timestamp']}")
@@ -876,47 +631,76 @@ def main():
                         # check if any images are in the queue still
                         if not image_buffer.empty():
                             # get one image from the image buffer
-                            image_message, image_asset = image_buffer.get()
+                            image_message, image_asset = take(image_buffer, "Image")
                             image_segment_number = image_message["segment_number"]
-                            last_image_asset = image_asset.copy()
+                            last_image_asset = image_asset
+                            last_image_id = image_message.get("image_id")
 
                         logger.info(f"End of stream, sending last image with special text.")
                         # burn in special text
-                        image_np = process_new_image(last_image_asset, "GroovyLife.AI", args, False, "Type !personalities or !message <personality> <question>")
-                        playback(image_np, None, 0.0)
+                        playback(last_image_asset, "GroovyLife.AI", "Type !personalities or !message <personality> <question>", False, last_image_id, None, 0.0)
                         last_sent_break = time.time()
                         worked = True
-                        logger.info(f"Sent last image segment #{image_segment_number} at timestamp {timestamp}")
-
-        if not music_buffer.empty():
-            if not args.music:
-                music_message, music = music_buffer.get()
-                while not music_buffer.empty():
-                    music_message, music = music_buffer.get()
-                    worked = True
-                continue
-
-            if not music_buffer.empty() and (last_music_change == 0 or time.time() - last_music_change > args.music_interval):
-                music_message, music = music_buffer.get()
+                        logger.info(f"Sent last image segment #{image_segment_number}")
+
+        music_message = music_buffer.peek()
+        if music_message is not None:
+            if music_message.get("music_stream"):
+                # streamed chunks play back to back as they arrive, the interval is for whole tracks
+                music_message, music = take(music_buffer, "Music")
+                audio_queue.put(("music_chunk", music))
+                last_music_change = time.time()
+                worked = True
+            elif last_music_change == 0 or time.time() - last_music_change > args.music_interval:
+                music_message, music = take(music_buffer, "Music")
                 logger.info(f"Loading Music: {music_message['mediaid']} {music_message['timestamp']} {music_message['segment_number']} {music_message['message'][:20]}")
                 if last_music_change > 0:
                     logger.info(f"Last Music change was {time.time() - last_music_change} seconds since the last music change.")
-                    bg_music.change_track(music)
-                else:
-                    # Load the initial music track
-                    bg_music.change_track(music)
+                # crossfades from the current track, or fades in the first one
+                audio_queue.put(("music", music))
 
                 last_music_change = time.time()
                 worked = True
             else:
-                logger.info(f"Skipping music because it's too soon since the last music change {time.time() - last_music_change}.")
+                logger.debug(f"Skipping music because it's too soon since the last music change {time.time() - last_music_change}.")
 
-        ## avoid busy loop
-        if not worked:
-            time.sleep(0.1)
+        ## go around again right away while there is work, the queues may hold more
+        if worked:
+            wake.set()
 
-    ndi.send_destroy(ndi_send)
-    ndi.destroy()
+def main():
+    ## Main routine, each stage in its own thread connected by bounded queues, the main thread keeps the display
+    # the sound card, NDI or headless sender pulls the mixer's blocks, with none of them it paces itself
+    if soundcard is not None:
+        soundcard.start()
+    elif headless_sink is not None:
+        headless_sink.start()
+    elif not args.ndi_audio:
+        mixer.start()
+
+    if asset_writer is not None:
+        asset_writer.start()
+    slideshow.start()
+
+    for stage in (ingest, schedule, renderer, audio_player):
+        threading.Thread(target=stage, name=stage.__name__, daemon=True).start()
+
+    try:
+        display()
+    finally:
+        if soundcard is not None:
+            soundcard.stop()
+        if headless_sink is not None:
+            headless_sink.stop()
+        mixer.stop()
+        slideshow.stop()
+        for buffer in (audio_buffer, image_buffer, music_buffer):
+            logger.info(buffer.metrics())
+            buffer.close()
+        if asset_writer is not None:
+            asset_writer.stop()
+        if ndi_sink is not None:
+            ndi_sink.stop()
 
 
 if __name__ == "__main__":
@@ -926,7 +710,8 @@ if __name__ == "__main__":
     parser.add_argument("--output_port", type=int, required=False, default=6004, help="Port for sending status of last image and audio segments")
     parser.add_argument("--output_host", type=str, required=False, default="127.0.0.1", help="Host for sending status of last image and audio segments")
     parser.add_argument("-ll", "--loglevel", type=str, default="info", help="Logging level: debug, info...")
-    parser.add_argument("-f", "--freq", type=int, default=22050, help="Sampling frequency for audio playback")
+    parser.add_argument("--sample_rate", type=int, default=48000, help="Sample rate the speech and music are mixed and played at")
+    parser.add_argument("-f", "--freq", type=int, default=None, help="Deprecated, use --sample_rate")
     parser.add_argument("--burn_prompt", action="store_true", default=False, help="Burn in the prompt that created the image")
     parser.add_argument("--width", type=int, default=1920, help="Width of the output image")
     parser.add_argument("--height", type=int, default=1080, help="Height of the output image")
@@ -935,22 +720,60 @@ if __name__ == "__main__":
     parser.add_argument("--music_interval", type=float, default=60, help="Interval between music changes")
     parser.add_argument("--music", action="store_true", default=False, help="Enable music")
     parser.add_argument("--save", action="store_true", default=False, help="Save assets to disk")
+    parser.add_argument("--save_dir", type=str, default="assets", help="Directory --save writes the assets and their index.db to")
+    parser.add_argument("--save_queue", type=int, default=256, help="Segments waiting to be saved before new ones are not saved")
     parser.add_argument("--norender", action="store_true", default=False, help="Disable rendering of images")
     parser.add_argument("--nobuffer", action="store_true", default=False, help="Disable buffering of images")
     parser.add_argument("--title", type=str, default="Groovy Life AI", help="Title for the window")
-    parser.add_argument("--buffer_size", type=int, default=32768, help="Size of the buffer for images and audio")
+    parser.add_argument("--mix_block", type=int, default=1024, help="Samples mixed per block for the sound card, smaller is less latency")
+    parser.add_argument("--buffer_size", type=int, default=None, help="Deprecated and ignored, was the pygame mixer buffer, see --mix_block")
+    parser.add_argument("--sdl_audiodriver", type=str, default=None, help="Deprecated and ignored, was the pygame audio device, see --audio_device")
     parser.add_argument("--show_ascii_art", action="store_true", default=False, help="Show images as ascii art")
     parser.add_argument("--startup_delay", type=float, default=30.0, help="Delay before sending status messages")
-    parser.add_argument("--stats_interval", type=float, default=10.0, help="Interval between sending status messages")
-    parser.add_argument("--sdl_audiodriver", type=str, default="GroovyLifeAI", help="SDL Audio Driver, default is GroovyLifeAI")
+    parser.add_argument("--stats_interval", type=float, default=10.0, help="Interval between sending the full status, changes go out as they happen")
+    parser.add_argument("--status_interval", type=float, default=0.5, help="Least time between status messages with the changes")
+    parser.add_argument("--prometheus_file", type=str, default="", help="Write the player metrics here in the Prometheus text format, for a textfile collector")
+    parser.add_argument("--audio_device", type=str, default="", help="Sound card to play to, name or index, default is the system default")
+    parser.add_argument("--nosoundcard", action="store_true", default=False, help="Don't play to a sound card, only to NDI, --audio_pipe or --audio_wav")
+    parser.add_argument("--audio_pipe", type=str, default="", help="Command to pipe the mixed audio to as s16le, like ffmpeg -f s16le -ar 48000 -ac 2 -i - ...")
+    parser.add_argument("--audio_wav", type=str, default="", help="WAV file to record the mixed audio to")
+    parser.add_argument("--duck_db", type=float, default=-12.0, help="Music level under speech in dB")
+    parser.add_argument("--crossfade", type=float, default=2.0, help="Seconds of crossfade between music tracks")
+    parser.add_argument("--pause_music", action="store_true", default=False, help="Pause the music under speech until the end of stream, instead of ducking it by --duck_db")
     parser.add_argument("--ndi_display", action="store_true", default=False, help="Send to NDI output")
     parser.add_argument("--ndi_audio", action="store_true", default=False, help="Send audio to NDI output")
+    parser.add_argument("--ndi_fps", type=float, default=30.0, help="NDI output frame rate, the current image repeats until the next one")
+    parser.add_argument("--ndi_fourcc", type=str, default="uyvy", choices=list(FOURCCS), help="NDI video format, uyvy or i420")
     parser.add_argument("--sdwebui_image_model", type=str, default="sd_xl_turbo", help="Local SD WebUI API Image model to use, default sd_xl_turbo")
     parser.add_argument("--negative_prompt", type=str, default="Disfigured, cartoon, blurry, nsfw, naked, porn, violence, gore, racism, black face", help="Negative prompt for the model")
     parser.add_argument("--slideshow_interval", type=float, default=120.0, help="Interval between images in the slideshow");
+    parser.add_argument("--slideshow_pool", type=int, default=3, help="Slideshow images generated ahead of time for when the buffers run dry")
+    parser.add_argument("--slideshow_idle", type=float, default=10.0, help="Seconds with no image segments before generating slideshow images, so the producers have SD to themselves")
+    parser.add_argument("--text_history", type=int, default=100, help="Lines of recent text slideshow prompts are drawn from")
+    parser.add_argument("--font", type=str, default="", help="TrueType font for subtitles the Hershey font has no glyphs for, like Japanese or Chinese")
+    parser.add_argument("--text_cache_mb", type=int, default=16, help="Memory for pre-rendered subtitle and banner lines")
+    parser.add_argument("--headless", action="store_true", default=False, help="No window or sound card, frames and mixed audio go to ffmpeg at --output or raw frames to --raw_output")
+    parser.add_argument("--output", type=str, default="lifeAIplayer.mp4", help="Headless ffmpeg output, a file, rtmp:// URL or .m3u8 for HLS")
+    parser.add_argument("--raw_output", type=str, default="", help="Headless raw RGB frames to this file or named pipe, - for stdout, instead of ffmpeg, audio through --audio_pipe or --audio_wav")
+    parser.add_argument("--ffmpeg", type=str, default="ffmpeg", help="ffmpeg binary for headless output")
+    parser.add_argument("--ffmpeg_options", type=str, default=FFMPEG_OPTIONS, help="ffmpeg encoding options for headless output")
+    parser.add_argument("--fps", type=float, default=30.0, help="Headless output frame rate")
+    parser.add_argument("--speed", type=float, default=1.0, help="Headless speed relative to realtime for offline renders and benchmarks, 0 is as fast as it goes")
+    parser.add_argument("--duration", type=float, default=0.0, help="Headless seconds of output before exiting, 0 runs until stopped")
+    parser.add_argument("--nolookahead", dest="lookahead", action="store_false", default=True, help="Pair and prepare the next segment only once the current one ends, instead of while it plays")
+    parser.add_argument("--queue_size", type=int, default=64, help="Segments the image and music buffers hold before dropping the oldest, speech is never dropped")
+    parser.add_argument("--audio_buffer_mb", type=int, default=256, help="Memory for queued speech before it spills to disk")
+    parser.add_argument("--image_buffer_mb", type=int, default=512, help="Memory for queued decoded images before they spill to disk")
+    parser.add_argument("--music_buffer_mb", type=int, default=128, help="Memory for queued music before it spills to disk")
+    parser.add_argument("--spill_dir", type=str, default="", help="Directory for the buffer spill files, default is the system temp directory")
+    parser.add_argument("--spill_mb", type=int, default=4096, help="Disk each buffer may spill to before dropping, or for speech keeping it in memory")
 
     args = parser.parse_args()
 
+    image_variants = VariantCache(args.width, args.height)
+    # two output buffers, the display can still be reading one while the next frame is composed
+    compositor = Compositor(args.width, args.height, args.font, args.text_cache_mb, buffers=2)
+
     LOGLEVEL = logging.INFO
 
     if args.loglevel == "info":
@@ -964,11 +787,9 @@ if __name__ == "__main__":
 
     cv_display = True
     ndi_display = args.ndi_display
-    if ndi_display:
+    if ndi_display or args.headless:
         cv_display = False
 
-    #os.environ['SDL_AUDIODRIVER'] = args.sdl_audiodriver
-
     log_id = time.strftime("%Y%m%d-%H%M%S")
     logging.basicConfig(filename=f"logs/lifeAIplayer-{log_id}.log", level=LOGLEVEL)
     logger = logging.getLogger('lifeAIplayer')
@@ -979,6 +800,15 @@ if __name__ == "__main__":
     ch.setFormatter(formatter)
     logger.addHandler(ch)
 
+    # pygame era audio flags, old launch scripts still pass them
+    if args.freq is not None:
+        logger.warning(f"--freq is deprecated, use --sample_rate. Mixing at {args.freq} Hz.")
+        args.sample_rate = args.freq
+    if args.buffer_size is not None:
+        logger.warning(f"--buffer_size is deprecated and ignored, the sound card block is --mix_block {args.mix_block} samples.")
+    if args.sdl_audiodriver is not None:
+        logger.warning("--sdl_audiodriver is deprecated and ignored, pick the sound card with --audio_device.")
+
     context = zmq.Context()
     socket = context.socket(zmq.SUB)
     logger.info("connected to ZMQ in: %s:%d" % (args.input_host, args.input_port))
@@ -989,51 +819,60 @@ if __name__ == "__main__":
     logger.info("connected to ZMQ out: %s:%d" % (args.output_host, args.output_port))
     sender.bind(f"tcp://{args.output_host}:{args.output_port}")
 
-    pygame.init()
-    pygame.mixer.init(frequency=args.freq, size=-16, channels=2, buffer=args.buffer_size, devicename=args.sdl_audiodriver)
-    AUDIO_END_EVENT_MUSIC = pygame.USEREVENT + 1
-    AUDIO_END_EVENT_SPEECH = pygame.USEREVENT + 2
-
-    audio_channel_speech = pygame.mixer.Channel(1)
-    audio_channel_speech.set_endevent(AUDIO_END_EVENT_SPEECH)
-    audio_channel_speech.set_volume(args.speech_volume)
-
-    audio_channel_music = pygame.mixer.Channel(2)
-    audio_channel_music.set_volume(args.music_volume)
-
-    audio_buffer = queue.Queue()
-    music_buffer = queue.Queue()
-    image_buffer = queue.Queue()
+    mixer = Mixer(args.sample_rate, 2, args.mix_block, args.speech_volume, args.music_volume, duck_db=args.duck_db, crossfade=args.crossfade)
+    if args.audio_wav:
+        mixer.add_tap(WavSink(args.audio_wav, args.sample_rate, 2))
+    if args.audio_pipe:
+        mixer.add_tap(PipeSink(args.audio_pipe))
+    if args.headless:
+        # the headless clock drives the mixer, NDI can still take the video
+        args.ndi_audio = False
+        headless_sink = HeadlessSink(args.raw_output or args.output, args.width, args.height, args.fps, args.sample_rate, 2, mixer.mix,
+                                     args.speed, args.duration, bool(args.raw_output), args.ffmpeg, args.ffmpeg_options)
+    elif not args.ndi_audio and not args.nosoundcard:
+        soundcard = SoundcardOutput(mixer, args.audio_device)
+
+    # ingest to scheduler, bounded by memory, past it speech spills to disk, images spill or drop the oldest, music keeps the latest track
+    audio_buffer = MediaBuffer("audio", args.audio_buffer_mb * 1024 * 1024, "keep",
+                               spill_dir=args.spill_dir or None, spill_bytes=args.spill_mb * 1024 * 1024)
+    music_buffer = MediaBuffer("music", args.music_buffer_mb * 1024 * 1024, "latest", args.queue_size,
+                               spill_dir=args.spill_dir or None, spill_bytes=args.spill_mb * 1024 * 1024)
+    image_buffer = MediaBuffer("image", args.image_buffer_mb * 1024 * 1024, "coalesce", args.queue_size,
+                               spill_dir=args.spill_dir or None, spill_bytes=args.spill_mb * 1024 * 1024, size=image_bytes, decode=decode_image)
+    # scheduler to the renderer and audio threads, renderer to the display
+    render_queue = queue.Queue(maxsize=4)
+    audio_queue = queue.Queue(maxsize=4)
+    display_queue = queue.Queue(maxsize=1)
+    # set by whoever has something for the scheduler, speech_done once the current speech segment ends
+    wake = threading.Event()
+    speech_done = threading.Event()
+    # set when the next speech starts, a headless clock off realtime waits on it at the end of speech
+    handoff = threading.Event()
+    # the status consumers read audio_buffer_duration and the music demand from the latest message, every one has them
+    telemetry = Telemetry(always=("audio_buffer_duration", "music_enabled", "music_change_due"), min_interval=args.status_interval,
+                          full_interval=args.stats_interval, prometheus_file=args.prometheus_file)
+
+    if args.save:
+        asset_writer = AssetWriter(args.save_dir, args.save_queue)
 
     sdui_api = webuiapi.WebUIApi(
         host='127.0.0.1',
         port=7860,
         use_https=False)
 
-    sdui_api.util_set_model(args.sdwebui_image_model)
+    try:
+        sdui_api.util_set_model(args.sdwebui_image_model)
+    except Exception as e:
+        # the slideshow needs it, playback doesn't, render servers and CI have no SD WebUI
+        logger.error(f"SD WebUI not available, no slideshow images: {e}")
 
 	## NDI
-    if ndi_display:
-        send_settings = ndi.SendCreate()
-        send_settings.ndi_name = args.title
-
-        ndi_send = ndi.send_create(send_settings)
-
-        video_frame = ndi.VideoFrameV2()
-
-        video_frame.data = np.zeros((args.width, args.height, 4), dtype=np.uint8)
-        video_frame.data[:, :, 1] = 255
-        video_frame.data = np.array(video_frame.data)
-        video_frame.FourCC = ndi.FOURCC_VIDEO_TYPE_BGRX
-        video_frame.xres = video_frame.data.shape[0]
-        video_frame.yres = video_frame.data.shape[1]
-
-        aspect_ratio = float(video_frame.xres) / float(video_frame.yres)
-        video_frame.picture_aspect_ratio = aspect_ratio
-
-        video_frame.line_stride_in_bytes = video_frame.xres * video_frame.data.shape[2];
-        ndi.send_send_video_v2(ndi_send, video_frame)
+    if ndi_display or args.ndi_audio:
+        # NDI audio is the mixer's output, the sender pulls it a block per frame
+        ndi_sink = NDISink(args.title, args.width, args.height, args.ndi_fps, args.ndi_fourcc, args.sample_rate, video=ndi_display, audio=args.ndi_audio,
+                           audio_source=mixer.mix if args.ndi_audio else None)
+        ndi_sink.start()
 
-    text_history = ["Groovy Life AI is ready to serve you!"]
+    slideshow = SlideshowPool(generate_sd_webui, args.slideshow_pool, args.text_history, args.slideshow_idle)
 
     main()
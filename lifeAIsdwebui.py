@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+
+## Life AI Stable Diffusion WebUI API helpers, single and batched txt2img
+#
+# Chris Kennedy 2023 (C) GPL
+#
+# Free to use for any use as in truly free software
+# as Richard Stallman intended it to be.
+#
+
+import logging
+
+logger = logging.getLogger('TTI')
+
+# sdwebui builtin script that renders one image per line of prompts in a single call
+BATCH_SCRIPT = "prompts from file or textbox"
+
+def txt2img(sdui_api, prompt, negative_prompt, width=512, height=512):
+    result = sdui_api.txt2img(prompt=prompt,
+                        negative_prompt=negative_prompt,
+                        save_images=False,
+                        width=width,
+                        height=height,
+            )
+
+    sdui_api.util_wait_for_ready()
+
+    if result.image is None:
+        logger.error(f"Error generating image: {result.info}")
+        return None
+
+    return result.image
+
+def batch_script_layout(sdui_api):
+    """ Arg labels of the prompts from file script on this sdwebui, or None if it isn't available """
+    try:
+        response = sdui_api.session.get(url=f"{sdui_api.baseurl}/script-info")
+        for script in response.json():
+            if script.get("name") == BATCH_SCRIPT and not script.get("is_img2img"):
+                return [arg.get("label") or "" for arg in script.get("args", [])]
+    except Exception as e:
+        logger.error(f"sdwebui script-info failed, batching disabled: {e}")
+    return None
+
+def batch_script_args(layout, prompts):
+    """ Fill the script args by label, the prompt position radio was only added in newer sdwebui """
+    script_args = []
+    for label in layout:
+        if "prompt inputs" in label.lower():
+            script_args.append("\n".join(prompt.replace("\n", " ") for prompt in prompts))
+        elif "insert prompts" in label.lower():
+            script_args.append("start")
+        else:
+            script_args.append(False)
+    return script_args
+
+def txt2img_batch(sdui_api, prompts, negative_prompt, layout=None, width=512, height=512):
+    """ Render several prompts in one sdwebui call, returns images in prompt order """
+    if len(prompts) == 1 or layout is None:
+        return [txt2img(sdui_api, prompt, negative_prompt, width, height) for prompt in prompts]
+
+    result = sdui_api.txt2img(prompt="",
+                        negative_prompt=negative_prompt,
+                        save_images=False,
+                        do_not_save_grid=True,
+                        width=width,
+                        height=height,
+                        script_name=BATCH_SCRIPT,
+                        script_args=batch_script_args(layout, prompts),
+            )
+
+    sdui_api.util_wait_for_ready()
+
+    images = list(result.images)
+    # sdwebui puts a grid of the whole batch first when it returns grids
+    if len(images) == len(prompts) + 1:
+        images = images[1:]
+
+    if len(images) != len(prompts):
+        logger.error(f"sdwebui batch returned {len(images)} images for {len(prompts)} prompts.")
+        images = (images + [None] * len(prompts))[:len(prompts)]
+
+    return images
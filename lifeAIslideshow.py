@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+
+## Life AI slideshow pool, idle images generated ahead of time from recent text
+#
+# Chris Kennedy 2023 (C) GPL
+#
+# Free to use for any use as in truly free software
+# as Richard Stallman intended it to be.
+#
+
+import time
+import random
+import logging
+import threading
+from collections import deque
+
+logger = logging.getLogger('lifeAIplayer')
+
+class SlideshowPool(threading.Thread):
+    """ A few slideshow images made before the player runs dry.
+
+    generate(prompt) returns a PIL image or None, it is only called while
+    the pool is short and no image segment has arrived for idle_after
+    seconds, so the producers have the image generator to themselves
+    while they are sending. Prompts are three random lines of the recent
+    text, which is kept to the last history_size lines. take() is instant,
+    the oldest image in the pool or None when it is empty.
+    """
+    def __init__(self, generate, pool_size=3, history_size=100, idle_after=10.0, retry_interval=60.0,
+                 first_text="Groovy Life AI is ready to serve you!"):
+        super().__init__(name="slideshow", daemon=True)
+        self.generate = generate
+        self.pool_size = pool_size
+        self.idle_after = idle_after
+        self.retry_interval = retry_interval
+        self.history = deque([first_text], maxlen=history_size)
+        self.pool = deque()
+        self.lock = threading.Lock()
+        self.changed = threading.Event()
+        self.last_activity = time.time()
+        self.retry_at = 0.0
+        self.running = True
+
+        self.generated = 0
+        self.failed = 0
+        self.taken = 0
+        self.empty = 0
+
+    def add_text(self, text):
+        """ Text that was played, future slideshow prompts are drawn from it """
+        with self.lock:
+            self.history.append(text)
+
+    def activity(self):
+        """ An image segment arrived, the generator is busy for the producers """
+        self.last_activity = time.time()
+
+    def take(self):
+        with self.lock:
+            if self.pool:
+                self.taken += 1
+                image = self.pool.popleft()
+            else:
+                self.empty += 1
+                image = None
+        self.changed.set()
+        return image
+
+    def prompt(self):
+        with self.lock:
+            history = list(self.history)
+        return " ".join(random.choice(history) for _ in range(3))
+
+    def wanted(self):
+        now = time.time()
+        return len(self.pool) < self.pool_size and now - self.last_activity >= self.idle_after and now >= self.retry_at
+
+    def run(self):
+        while self.running:
+            if not self.wanted():
+                self.changed.wait(timeout=1.0)
+                self.changed.clear()
+                continue
+            prompt = self.prompt()
+            image = self.generate(prompt)
+            if image is None:
+                # the generator is down or refusing, don't hammer it
+                self.failed += 1
+                self.retry_at = time.time() + self.retry_interval
+                continue
+            with self.lock:
+                self.pool.append(image)
+            self.generated += 1
+            logger.info(f"Slideshow: pregenerated an image for '{prompt[:60]}', {len(self.pool)} in the pool.")
+
+    def metrics(self):
+        return (f"slideshow pool {len(self.pool)}/{self.pool_size}, {self.generated} generated, {self.failed} failed, "
+                f"{self.taken} taken, {self.empty} found empty, {len(self.history)} lines of history")
+
+    def stop(self):
+        self.running = False
+        self.changed.set()
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+
+## Life AI Speaker index for Text to Speech voice assignment
+#
+# Chris Kennedy 2023 (C) GPL
+#
+# Free to use for any use as in truly free software
+# as Richard Stallman intended it to be.
+#
+
+import re
+import json
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger('tts')
+
+# find speaker names that may have a space in them at the start of lines like . new speaker: lines or after other punctuation endings or newlines
+# compiled once with MULTILINE so a single search over the segment finds the first speaker line
+SPEAKER_PATTERN = re.compile(r'(?:(?:\[/INST\])?<<([A-Za-z0-9_\)\(\-]+)>>|^(?:\[\w+\])?([A-Za-z0-9_\)\(\-)]+):)', re.MULTILINE)
+
+class VoiceTable:
+    """ Male and female voice lists for one TTS service, with set based membership """
+    def __init__(self, male, female, default):
+        self.male = list(male)
+        self.female = list(female)
+        self.default = default
+        self.male_set = frozenset(self.male)
+        self.female_set = frozenset(self.female)
+        self.all_set = self.male_set | self.female_set
+
+    def __contains__(self, voice):
+        return voice in self.all_set
+
+class VoiceAllocation:
+    """ Speaker to voice map and voice rotation for a single mediaid """
+    def __init__(self, voices, narrator=None):
+        self.voices = voices
+        self.speakers = {}
+        self.male_index = 0
+        self.female_index = 0
+        self.speaker_count = 0
+        if narrator:
+            self.speakers["narrator"] = narrator
+
+    def next_voice(self, gender):
+        if gender == "male":
+            if not self.voices.male:
+                return self.voices.default
+            voice = self.voices.male[self.male_index % len(self.voices.male)]
+            self.male_index += 1
+        else:  # Female and nonbinary use female voices
+            if not self.voices.female:
+                return self.voices.default
+            voice = self.voices.female[self.female_index % len(self.voices.female)]
+            self.female_index += 1
+        return voice
+
+    def add(self, name, gender):
+        """ A speaker found in the text, given the next voice for their gender """
+        entry = {'voice': self.next_voice(gender), 'gender': gender}
+        self.speakers[name] = entry
+        self.speaker_count += 1
+        return entry
+
+    def set(self, name, gender, voice):
+        """ A speaker with a voice chosen for them, kept as given even if None, a lookup reassigns one not in the voice list """
+        entry = {'voice': voice, 'gender': gender}
+        self.speakers[name] = entry
+        return entry
+
+class VoiceAllocator:
+    """ Per mediaid voice allocation tables, oldest mediaids are forgotten first """
+    def __init__(self, voices, max_tables=32):
+        self.voices = voices
+        self.max_tables = max_tables
+        self.tables = OrderedDict()
+
+    def table(self, mediaid, narrator=None):
+        allocation = self.tables.get(mediaid)
+        if allocation is None:
+            allocation = VoiceAllocation(self.voices, narrator)
+            self.tables[mediaid] = allocation
+            while len(self.tables) > self.max_tables:
+                self.tables.popitem(last=False)
+        else:
+            self.tables.move_to_end(mediaid)
+        return allocation
+
+class SpeakerIndex:
+    """ Speaker detection and name to gender lookup, loaded once at startup """
+    def __init__(self, genders=None, narrator_aliases=None, voices=None, detector=None):
+        self.genders = {name.lower(): gender for name, gender in (genders or {}).items()}
+        self.narrator_aliases = frozenset(narrator_aliases or [])
+        self.voice_tables = {}
+        for service, table in (voices or {}).items():
+            self.voice_tables[service] = VoiceTable(table.get("male", []), table.get("female", []), table.get("default"))
+        self.detector = detector
+        self.guess_cache = {}
+
+    @classmethod
+    def from_file(cls, path, detector=None):
+        with open(path, 'r') as f:
+            data = json.load(f)
+        return cls(data.get("genders"), data.get("narrator_aliases"), data.get("voices"), detector)
+
+    def voices(self, service):
+        return self.voice_tables.get(service)
+
+    def find_speaker(self, text):
+        """ Return (speaker, line) for the first speaker line in the text, or (None, None) """
+        speaker_match = SPEAKER_PATTERN.search(text)
+        if not speaker_match:
+            return None, None
+
+        # Extracting speaker name from either of the capturing groups
+        new_speaker = speaker_match.group(1) or speaker_match.group(2)
+        new_speaker = new_speaker.strip().lower()
+
+        line_start = text.rfind('\n', 0, speaker_match.start()) + 1
+        line_end = text.find('\n', speaker_match.end())
+        if line_end == -1:
+            line_end = len(text)
+
+        return new_speaker, text[line_start:line_end]
+
+    def guess_gender(self, name):
+        """ gender_guesser lookup on the first word of the name, memoized """
+        first_name = name.split('_')[0]
+        if first_name in self.guess_cache:
+            return self.guess_cache[first_name]
+
+        gender = None
+        if self.detector:
+            guessed_gender = self.detector.get_gender(first_name)
+            if guessed_gender in ['male', 'mostly_male']:
+                gender = "male"
+            elif guessed_gender in ['female', 'mostly_female']:
+                gender = "female"
+
+        self.guess_cache[first_name] = gender
+        return gender
+
+    def gender_of(self, name, line=""):
+        """ Gender from the [m]/[f]/[n] line marker, the name table, then gender_guesser """
+        if '[m]' in line:
+            return "male"
+        elif '[f]' in line:
+            return "female"
+        elif '[n]' in line:
+            return "nonbinary"
+
+        gender = self.genders.get(name)
+        if gender:
+            return gender
+
+        return self.guess_gender(name)
@@ -19,6 +19,8 @@ import numpy as np
 import textwrap
 import logging
 import time
+from lifeAIimageVariants import fit_to_frame
+from lifeAItextSprites import TextRenderer, TextStyle
 
 warnings.simplefilter(action='ignore', category=Warning)
 warnings.filterwarnings("ignore", category=urllib3.exceptions.NotOpenSSLWarning)
@@ -26,129 +28,40 @@ from urllib3.exceptions import NotOpenSSLWarning
 warnings.simplefilter(action='ignore', category=NotOpenSSLWarning)
 
 
-## Japanese writing on images
-def draw_japanese_text_on_image(image_np, text, position, font_path, font_size):
-    # Convert to a PIL Image
-    image_pil = Image.fromarray(cv2.cvtColor(image_np, cv2.COLOR_BGR2RGB))
-
-    # Prepare drawing context
-    draw = ImageDraw.Draw(image_pil)
-    font = ImageFont.truetype(font_path, font_size)
-
-    # Define the border width for the text
-    border_width = 5
-
-    # Get text size using getbbox
-    x, y = position
-    bbox = font.getbbox(text)
-    text_width, text_height = bbox[2], bbox[3]
-    y = y - text_height
-    x = x + text_width / 2
-
-    # Draw text border (outline)
-    for i in range(-border_width, border_width + 1):
-        for j in range(-border_width, border_width + 1):
-            draw.text((x + i, y + j), text, font=font, fill=(0, 0, 0))  # Black border
-
-    # Draw text on image
-    draw.text((x, y), text, font=font, fill=(255, 255, 255))  # White fill
-
-    # Convert back to NumPy array
-    image_np = cv2.cvtColor(np.array(image_pil), cv2.COLOR_RGB2BGR)
-
-    return image_np
-
+# Caption styles by frame size, lines are rasterized once and reused from the sprite cache
+WIDE_STYLE = TextStyle(scale=2, thickness=4, border=15, shadow=None)
+SMALL_STYLE = TextStyle(scale=1, thickness=3, border=10, shadow=None)
+DEFAULT_STYLE = TextStyle(scale=1, thickness=2, border=8, shadow=None)
 
 def add_text_to_image(image, text):
     if image is not None:
         logger.info(f"Adding text to image: {text}")
 
-        # Maintain aspect ratio and add black bars
-        width, height = image.size
-        desired_ratio = width / height
-        current_ratio = width / height
+        # Frames are fit to the output size once per image, only something else needs fitting here
+        if image.size != (args.width, args.height):
+            image = fit_to_frame(image, args.width, args.height)
 
-        # Convert the PIL Image to a NumPy array for OpenCV operations
+        # A copy in RGB to draw the captions on, the frame is shared by every caption of the image
         image = np.array(image)
-        image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)  # Convert from RGB to BGR for OpenCV
-
-        if current_ratio > desired_ratio:
-            new_width = int(height * desired_ratio)
-            padding = max(0, (new_width - width) // 2)
-            image = cv2.copyMakeBorder(image, 0, 0, padding, padding, cv2.BORDER_CONSTANT, value=[0, 0, 0])
-        else:
-            new_height = int(width / desired_ratio)
-            padding = max(0, (new_height - height) // 2)
-            image = cv2.copyMakeBorder(image, padding, padding, 0, 0, cv2.BORDER_CONSTANT, value=[0, 0, 0])
-
-        # Resize to the desired resolution
-        # Calculate the scaling factors
-        x_scale = args.width / image.shape[1]
-        y_scale = args.height / image.shape[0]
-        scale_factor = min(x_scale, y_scale)
-
-        # Compute new width and height while maintaining the aspect ratio
-        new_width = int(image.shape[1] * scale_factor)
-        new_height = int(image.shape[0] * scale_factor)
-
-        # Resize the image
-        image = cv2.resize(image, (new_width, new_height), interpolation=cv2.INTER_LINEAR)
-
-        # If the resized image doesn't match the desired resolution, pad with black
-        if new_width != args.width or new_height != args.height:
-            top_padding = (args.height - new_height) // 2
-            bottom_padding = args.height - new_height - top_padding
-            left_padding = (args.width - new_width) // 2
-            right_padding = args.width - new_width - left_padding
-            image = cv2.copyMakeBorder(image, top_padding, bottom_padding, left_padding, right_padding, cv2.BORDER_CONSTANT, value=[0, 0, 0])
-
-        width, height = image.shape[1], image.shape[0]
-        current_ratio = width / height
-
-        def contains_japanese(text):
-            for char in text:
-                if any([start <= ord(char) <= end for start, end in [
-                    (0x3040, 0x309F),  # Hiragana
-                    (0x30A0, 0x30FF),  # Katakana
-                    (0x4E00, 0x9FFF),  # Kanji
-                    (0x3400, 0x4DBF)   # Kanji (extension A)
-                ]]):
-                    return True
-            return False
+        height, width = image.shape[:2]
 
         wrap_width = 30
-        is_wide = False
-        if current_ratio > 512/512:
+        style = DEFAULT_STYLE
+        if width > height:
             wrap_width = 45
-            is_wide = True
+            style = WIDE_STYLE
+        elif width < 600:  # Assuming smaller images have widths less than 600, adjust if necessary
+            style = SMALL_STYLE
         wrapped_text = textwrap.wrap(text, width=wrap_width, fix_sentence_endings=False, break_long_words=False, break_on_hyphens=False)  # Adjusted width
         y_pos = height - 40  # Adjusted height from bottom
 
-        font_size = 1
-        font_thickness = 2  # Adjusted for bolder font
-        border_thickness = 8  # Adjusted for bolder border
-
-        if is_wide:
-            font_size = 2
-            font_thickness = 4
-            border_thickness = 15
-        elif width < 600:  # Assuming smaller images have widths less than 600, adjust if necessary
-            font_size = 1
-            font_thickness = 3
-            border_thickness = 10
-
         for line in reversed(wrapped_text):
-            text_width, _ = cv2.getTextSize(line, cv2.FONT_HERSHEY_DUPLEX, font_size, font_thickness)[0]
+            (text_width, _), _ = text_renderer.text_size(line, style)
             x_pos = (width - text_width) // 2  # Center the text
-            if contains_japanese(line):
-                image = draw_japanese_text_on_image(image, line, (x_pos, y_pos), args.japanesefont,60)
-            else:
-                cv2.putText(image, line, (x_pos, y_pos), cv2.FONT_HERSHEY_DUPLEX, font_size, (0, 0, 0), border_thickness)
-                cv2.putText(image, line, (x_pos, y_pos), cv2.FONT_HERSHEY_DUPLEX, font_size, (255, 255, 255), font_thickness)
+            text_renderer.draw(image, line, style, (x_pos, y_pos))
             y_pos -= 60
 
-        ## Convert back from numpy array
-        image = Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+        image = Image.fromarray(image)
 
     return image  # returning the modified image
 
@@ -180,6 +93,8 @@ def main():
         
         ## Convert the bytes back to a PIL Image object
         image = Image.open(io.BytesIO(image))
+        # Fit to the output frame once, every caption line draws onto a copy of it
+        frame = fit_to_frame(image, args.width, args.height)
 
         ## check the length of the text, split into lines at breaks that keep them 80 characters or less
         ## like captions on TV, put them in an array, then count out 3 at a time and send them out
@@ -193,15 +108,14 @@ def main():
 
         for line in lines:
             line_string = "\n".join(line)
-            image_copy = image.copy()
             header_message["index"] = images_sent
             images_sent += 1
             logger.debug(f"Subtitle Burn-In #{images_sent}: line: {line_string}")
 
             if args.use_prompt and optimized_prompt.strip():            
-                image_copy = add_text_to_image(image_copy, optimized_prompt)
+                image_copy = add_text_to_image(frame, optimized_prompt)
             else:
-                image_copy = add_text_to_image(image_copy, line_string)
+                image_copy = add_text_to_image(frame, line_string)
             
             # Convert PIL Image
             img_byte_arr = io.BytesIO()
@@ -259,6 +173,8 @@ if __name__ == "__main__":
     parser.add_argument("-ll", "--loglevel", type=str, default="info", help="Logging level: debug, info...")
     parser.add_argument("--framesync", action="store_true", default=False, help="Sync frames output to duration of spoken text")
     parser.add_argument("--clear", action="store_true", default=False, help="Clear the screen after each subtitle")
+    parser.add_argument("--font", type=str, default="", help="TrueType font for captions the Hershey font has no glyphs for, like Japanese or Chinese")
+    parser.add_argument("--text_cache_mb", type=int, default=16, help="Memory for pre-rendered caption lines")
     args = parser.parse_args()
 
     LOGLEVEL = logging.INFO
@@ -276,6 +192,8 @@ if __name__ == "__main__":
     logging.basicConfig(filename=f"logs/subtitleBurnIn-{log_id}.log", level=LOGLEVEL)
     logger = logging.getLogger('subTileBurnIn')
 
+    text_renderer = TextRenderer(args.font, args.text_cache_mb * 1024 * 1024)
+
     ch = logging.StreamHandler()
     ch.setLevel(LOGLEVEL)
     formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
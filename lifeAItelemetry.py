@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+
+## Life AI telemetry, player counters kept where things happen and published as rate limited deltas
+#
+# Chris Kennedy 2023 (C) GPL
+#
+# Free to use for any use as in truly free software
+# as Richard Stallman intended it to be.
+#
+
+import os
+import time
+import logging
+import threading
+
+logger = logging.getLogger('lifeAIplayer')
+
+class Telemetry:
+    """ Gauges, counters and timings updated by the threads as things happen.
+
+    Nothing is recomputed to report it. publish() sends the fields changed
+    since the last send, at most every min_interval, always with the fields
+    in always that consumers read from whatever message is latest, and all
+    of them every full_interval. With a prometheus_file the numbers are also
+    written there in the Prometheus text format for a node exporter
+    textfile collector or any scraper that reads files.
+    """
+    def __init__(self, prefix="lifeai_player", always=(), min_interval=0.5, full_interval=10.0,
+                 prometheus_file="", prometheus_interval=5.0):
+        self.prefix = prefix
+        self.always = tuple(always)
+        self.min_interval = min_interval
+        self.full_interval = full_interval
+        self.prometheus_file = prometheus_file
+        self.prometheus_interval = prometheus_interval
+        self.lock = threading.Lock()
+        self.values = {}
+        self.kinds = {}
+        self.published = {}
+        self.last_publish = 0.0
+        self.last_full = 0.0
+        self.last_prometheus = 0.0
+        self.messages = 0
+
+    def set(self, name, value):
+        """ Gauge """
+        with self.lock:
+            self.values[name] = value
+            self.kinds.setdefault(name, "gauge")
+
+    def add(self, name, amount=1, kind="counter"):
+        """ Counter, or with kind gauge a level moved up and down """
+        with self.lock:
+            value = self.values[name] = self.values.get(name, 0) + amount
+            self.kinds.setdefault(name, kind)
+        return value
+
+    def observe(self, name, value):
+        """ Timing, the last value with a running count, sum and max """
+        with self.lock:
+            self.values[name] = value
+            self.values[f"{name}_count"] = self.values.get(f"{name}_count", 0) + 1
+            self.values[f"{name}_sum"] = round(self.values.get(f"{name}_sum", 0) + value, 3)
+            self.values[f"{name}_max"] = max(self.values.get(f"{name}_max", value), value)
+            self.kinds[name] = "summary"
+
+    def get(self, name, default=0):
+        with self.lock:
+            return self.values.get(name, default)
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.values)
+
+    def publish(self, socket, sample=None):
+        """ Send what changed on the status socket if it is time to, sample() adds fields read only when sending """
+        now = time.time()
+        if now - self.last_publish < self.min_interval:
+            return None
+        values = self.snapshot()
+        if sample is not None:
+            values.update(sample())
+
+        full = now - self.last_full >= self.full_interval
+        if full:
+            message = dict(values)
+            self.last_full = now
+        else:
+            message = {name: value for name, value in values.items() if name not in self.published or self.published[name] != value}
+            for name in self.always:
+                if name in values:
+                    message[name] = values[name]
+        self.last_publish = now
+
+        if self.prometheus_file and now - self.last_prometheus >= self.prometheus_interval:
+            self.last_prometheus = now
+            self.write_prometheus(values)
+
+        # only the always fields means nothing moved, no need to send the same again
+        if not full and len(message) == len([name for name in self.always if name in values]):
+            return None
+        message["timestamp"] = now
+        socket.send_json(message)
+        self.messages += 1
+        self.published.update(values)
+        logger.debug(f"Status: {message}")
+        return message
+
+    def prometheus_text(self, values):
+        with self.lock:
+            kinds = dict(self.kinds)
+        lines = []
+        for name in sorted(values):
+            value = values[name]
+            if isinstance(value, bool):
+                value = int(value)
+            if not isinstance(value, (int, float)):
+                continue
+            metric = f"{self.prefix}_{name}"
+            kind = kinds.get(name)
+            if kind == "summary":
+                # the last value as a gauge, its _count and _sum make the summary
+                lines.append(f"# TYPE {metric} gauge")
+            elif kind is not None:
+                lines.append(f"# TYPE {metric} {kind}")
+            lines.append(f"{metric} {value}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, values):
+        # written aside and renamed so a scrape never reads half a file
+        temp_file = f"{self.prometheus_file}.tmp"
+        try:
+            with open(temp_file, "w") as f:
+                f.write(self.prometheus_text(values))
+            os.replace(temp_file, self.prometheus_file)
+        except OSError as e:
+            logger.error(f"Telemetry: can't write {self.prometheus_file}: {e}")
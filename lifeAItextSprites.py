@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+
+## Life AI text sprites, subtitle and banner lines rasterized once and alpha blended into frames
+#
+# Chris Kennedy 2023 (C) GPL
+#
+# Free to use for any use as in truly free software
+# as Richard Stallman intended it to be.
+#
+
+import logging
+import cv2
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+from lifeAIimageVariants import LRUCache
+
+logger = logging.getLogger('lifeAIplayer')
+
+# Hershey DUPLEX at scale 1 is about 30 pixels from ascender to descender, TrueType sizes follow the same scale
+TRUETYPE_PIXELS_PER_SCALE = 30
+
+class TextStyle:
+    """ How a line is drawn: shadow, then outline, then fill, colors in the frame's channel order """
+    def __init__(self, scale=2, thickness=6, border=15, shadow=(4, 4), color=(255, 255, 255), border_color=(0, 0, 0),
+                 shadow_color=(0, 0, 0), font=cv2.FONT_HERSHEY_DUPLEX):
+        self.scale = scale
+        self.thickness = thickness
+        self.border = border
+        self.shadow = shadow
+        self.color = color
+        self.border_color = border_color
+        self.shadow_color = shadow_color
+        self.font = font
+        self.key = (scale, thickness, border, shadow, color, border_color, shadow_color, font)
+
+class TextSprite:
+    """ A rasterized line, premultiplied over black, and where the text origin sits inside it """
+    def __init__(self, color, inverse, origin, text_size):
+        self.color = color          # (h, w, 3) uint8, the layers composited over black
+        self.inverse = inverse      # (h, w, 3) uint8, 255 - coverage, how much of the frame shows through
+        self.origin = origin        # (x, y) of the left end of the baseline, as cv2.putText takes it
+        self.text_size = text_size  # ((width, height), baseline) of the fill, as cv2.getTextSize reports it
+        self.nbytes = color.nbytes + inverse.nbytes
+
+def make_sprite(color, coverage, origin, text_size):
+    """ Sprite from a layer canvas and its coverage, trimmed to the covered pixels so the cache only holds those """
+    rows = np.flatnonzero(coverage.any(axis=1))
+    cols = np.flatnonzero(coverage.any(axis=0))
+    if len(rows) == 0:
+        rows = cols = np.array([0])
+    top, bottom, left, right = rows[0], rows[-1] + 1, cols[0], cols[-1] + 1
+    inverse = cv2.cvtColor(255 - coverage[top:bottom, left:right], cv2.COLOR_GRAY2RGB)
+    return TextSprite(np.ascontiguousarray(color[top:bottom, left:right]), inverse,
+                      (int(origin[0] - left), int(origin[1] - top)), text_size)
+
+def blit(frame, sprite, origin):
+    """ Blend the sprite into frame in place with its text origin at origin, clipped to the frame """
+    height, width = frame.shape[:2]
+    sprite_height, sprite_width = sprite.color.shape[:2]
+    x0, y0 = origin[0] - sprite.origin[0], origin[1] - sprite.origin[1]
+    left, top = max(x0, 0), max(y0, 0)
+    right, bottom = min(x0 + sprite_width, width), min(y0 + sprite_height, height)
+    if left >= right or top >= bottom:
+        return
+
+    roi = frame[top:bottom, left:right]
+    sprite_rows = slice(top - y0, bottom - y0)
+    sprite_cols = slice(left - x0, right - x0)
+    # premultiplied over: frame * (1 - coverage) + color
+    cv2.multiply(roi, sprite.inverse[sprite_rows, sprite_cols], dst=roi, scale=1 / 255.0)
+    cv2.add(roi, sprite.color[sprite_rows, sprite_cols], dst=roi)
+
+class TextRenderer:
+    """ Text lines drawn from a memory bounded LRU cache of sprites.
+
+    Each (text, style) is rasterized once, by cv2 Hershey fonts, or by a
+    TrueType font when one is given and the line is not plain ASCII since
+    Hershey fonts have no CJK glyphs. Drawing is one blend into the line's
+    ROI of the frame.
+    """
+    def __init__(self, font_path="", max_bytes=16 * 1024 * 1024):
+        self.font_path = font_path
+        self.fonts = {}
+        self.sprites = LRUCache(max_entries=4096, max_bytes=max_bytes, size=lambda sprite: sprite.nbytes)
+
+    def truetype(self, text):
+        return bool(self.font_path) and not text.isascii()
+
+    def render_hershey(self, text, style):
+        (text_width, text_height), baseline = cv2.getTextSize(text, style.font, style.scale, style.thickness)
+        dx, dy = style.shadow or (0, 0)
+        pad = max(style.border, style.thickness) // 2 + 4
+        width = text_width + 2 * pad + abs(dx)
+        height = text_height + baseline + 2 * pad + abs(dy)
+        origin = (pad + max(0, -dx), pad + text_height + max(0, -dy))
+
+        # each layer is drawn over the last on black and on a coverage mask, the same result as drawing them on the frame
+        color = np.zeros((height, width, 3), dtype=np.uint8)
+        coverage = np.zeros((height, width), dtype=np.uint8)
+        layers = []
+        if style.shadow:
+            layers.append(((origin[0] + dx, origin[1] + dy), style.shadow_color, style.thickness))
+        if style.border:
+            layers.append((origin, style.border_color, style.border))
+        layers.append((origin, style.color, style.thickness))
+        for position, layer_color, thickness in layers:
+            cv2.putText(color, text, position, style.font, style.scale, layer_color, thickness)
+            cv2.putText(coverage, text, position, style.font, style.scale, 255, thickness)
+
+        return make_sprite(color, coverage, origin, ((text_width, text_height), baseline))
+
+    def render_truetype(self, text, style):
+        size = max(8, int(style.scale * TRUETYPE_PIXELS_PER_SCALE))
+        font = self.fonts.get(size)
+        if font is None:
+            font = self.fonts[size] = ImageFont.truetype(self.font_path, size)
+        stroke = style.border // 2
+        dx, dy = style.shadow or (0, 0)
+
+        # boxes are relative to the left end of the baseline, like the Hershey origin
+        left, top, right, bottom = font.getbbox(text, anchor="ls", stroke_width=stroke)
+        fill_left, fill_top, fill_right, fill_bottom = font.getbbox(text, anchor="ls")
+        pad = 2
+        width = right - left + abs(dx) + 2 * pad
+        height = bottom - top + abs(dy) + 2 * pad
+        origin = (pad - left + max(0, -dx), pad - top + max(0, -dy))
+
+        image = Image.new("RGB", (width, height))
+        mask = Image.new("L", (width, height))
+        for canvas, shadow_fill, fill, stroke_fill in ((image, tuple(style.shadow_color), tuple(style.color), tuple(style.border_color)),
+                                                       (mask, 255, 255, 255)):
+            draw = ImageDraw.Draw(canvas)
+            if style.shadow:
+                draw.text((origin[0] + dx, origin[1] + dy), text, font=font, fill=shadow_fill, anchor="ls")
+            draw.text(origin, text, font=font, fill=fill, anchor="ls", stroke_width=stroke, stroke_fill=stroke_fill)
+
+        return make_sprite(np.asarray(image), np.asarray(mask), origin, ((fill_right - fill_left, -fill_top), max(0, fill_bottom)))
+
+    def sprite(self, text, style):
+        truetype = self.truetype(text)
+        if not truetype and not text.isascii():
+            logger.debug(f"No TrueType font set, non ASCII text drawn with Hershey: {text[:40]}")
+        render = self.render_truetype if truetype else self.render_hershey
+        return self.sprites.get((text, style.key, truetype), lambda: render(text, style))
+
+    def text_size(self, text, style):
+        """ ((width, height), baseline) of the line, what cv2.getTextSize gives for Hershey text """
+        return self.sprite(text, style).text_size
+
+    def draw(self, frame, text, style, origin):
+        """ Draw the line with its baseline starting at origin, like cv2.putText """
+        blit(frame, self.sprite(text, style), origin)
+
+    def metrics(self):
+        lookups = self.sprites.hits + self.sprites.misses
+        hit_rate = 100.0 * self.sprites.hits / lookups if lookups else 0.0
+        return (f"text sprites hits {self.sprites.hits} misses {self.sprites.misses} ({hit_rate:.1f}% hit rate), "
+                f"{len(self.sprites.entries)} sprites {self.sprites.total_bytes / 1e6:.1f} MB")
@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+
+## Life AI presentation timeline, muxed segments as constant frame rate frames and fixed size PCM blocks with PTS
+#
+# Chris Kennedy 2023 (C) GPL
+#
+# Free to use for any use as in truly free software
+# as Richard Stallman intended it to be.
+#
+
+import time
+import logging
+import threading
+import numpy as np
+from collections import deque
+from lifeAIaudio import wav_to_pcm
+from lifeAIimageVariants import image_id
+
+logger = logging.getLogger('Framesync')
+
+def resample(samples, source_rate, target_rate):
+    """ Linear resample of an int16 (frames, channels) array, vectorized per channel """
+    if source_rate == target_rate or len(samples) == 0:
+        return samples
+    frames = int(round(len(samples) * target_rate / source_rate))
+    positions = np.arange(frames) * (source_rate / target_rate)
+    source = np.arange(len(samples))
+    return np.stack([np.interp(positions, source, samples[:, ch]) for ch in range(samples.shape[1])], axis=1).astype(np.int16)
+
+def fit_channels(samples, channels):
+    if samples.shape[1] == channels:
+        return samples
+    if samples.shape[1] == 1:
+        return np.repeat(samples, channels, axis=1)
+    return samples[:, :channels]
+
+class PresentationTimeline:
+    """ Constant frame rate presentation of the muxed speech and image pairs.
+
+    Each image is shown for the length of its speech segment. Video goes out
+    as frame references at fps, each image's bytes once before its first
+    frame, audio as blocks of block_size samples and a segment message with
+    the text when a segment starts, all with PTS in seconds from the start
+    of the timeline. Between segments the last image is held over silence,
+    so sinks get a steady clock and only play what arrives in order.
+    """
+    def __init__(self, emit, fps=30.0, sample_rate=48000, channels=2, block_size=0, lead=0.5):
+        self.emit = emit
+        self.fps = fps
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.block_size = block_size or int(sample_rate // fps)
+        self.lead = lead
+        self.lock = threading.Lock()
+        self.segments = deque()  # (header, image_id, pcm)
+        self.pending_image = None
+        self.images_sent = set()
+        self.current = None  # header and image id on screen
+        self.last_queued = None  # image id of the last segment queued, a segment without its own image keeps it
+        self.switches = deque()  # (start sample, header, image id)
+        self.audio = np.zeros((0, channels), dtype=np.int16)
+        self.audio_pos = 0
+        self.frame_number = 0
+        self.start_time = None
+        self.running = True
+        self.images = {}
+
+    def add(self, header, asset):
+        """ Muxed media in, the mux sends an image then the speech it goes with """
+        stream = header.get("stream")
+        if stream == "image":
+            with self.lock:
+                key = image_id(asset)
+                self.images[key] = asset
+                self.pending_image = (header, key)
+            return
+        if stream != "speek":
+            return
+
+        try:
+            samples, rate = wav_to_pcm(asset)
+            pcm = fit_channels(resample(samples, rate, self.sample_rate), self.channels)
+        except Exception as e:
+            logger.error(f"Timeline: speech #{header.get('segment_number')} not decodable, holding silence for its duration: {e}")
+            pcm = np.zeros((int(float(header.get("duration", 0)) * self.sample_rate), self.channels), dtype=np.int16)
+
+        with self.lock:
+            key = self.pending_image[1] if self.pending_image else self.last_queued
+            self.pending_image = None
+            self.last_queued = key
+            self.segments.append((header, key, pcm))
+
+    def next_block(self):
+        """ block_size samples continuing the audio, starting queued segments where the last one ends """
+        needed = self.block_size
+        parts = []
+        while needed > 0:
+            if len(self.audio) == 0:
+                with self.lock:
+                    segment = self.segments.popleft() if self.segments else None
+                if segment is None:
+                    parts.append(np.zeros((needed, self.channels), dtype=np.int16))
+                    break
+                header, key, pcm = segment
+                self.switches.append((self.audio_pos + self.block_size - needed, header, key))
+                self.audio = pcm
+            take = self.audio[:needed]
+            self.audio = self.audio[needed:]
+            parts.append(take)
+            needed -= len(take)
+        block = np.concatenate(parts) if len(parts) > 1 else parts[0]
+        pts = self.audio_pos / self.sample_rate
+        self.audio_pos += self.block_size
+        return block, pts
+
+    def send_frame(self):
+        pts = self.frame_number / self.fps
+        video_sample = self.frame_number * self.sample_rate / self.fps
+
+        # audio runs one frame ahead of video so a segment's start is known before its first frame
+        while self.audio_pos <= video_sample + self.sample_rate / self.fps:
+            block, audio_pts = self.next_block()
+            self.emit({"stream": "pcm", "pts": audio_pts, "sample_rate": self.sample_rate, "channels": self.channels,
+                       "samples": len(block)}, block.tobytes())
+
+        while self.switches and self.switches[0][0] <= video_sample:
+            _, header, key = self.switches.popleft()
+            with self.lock:
+                self.current = (header, key)
+            self.emit({"stream": "segment", "pts": pts, "mediaid": header.get("mediaid"), "segment_number": header.get("segment_number"),
+                       "duration": header.get("duration", 0), "text": header.get("text", ""), "image_id": key}, b"")
+            logger.info(f"Timeline: segment #{header.get('segment_number')} {header.get('mediaid')} starts at {pts:.3f}s.")
+
+        if self.current is None or self.current[1] is None:
+            return
+        header, key = self.current
+        if key not in self.images_sent:
+            self.emit({"stream": "image", "pts": pts, "image_id": key, "mediaid": header.get("mediaid"),
+                       "segment_number": header.get("segment_number")}, self.images[key])
+            self.images_sent.add(key)
+        self.emit({"stream": "frame", "pts": pts, "frame_number": self.frame_number, "image_id": key,
+                   "mediaid": header.get("mediaid"), "segment_number": header.get("segment_number")}, b"")
+
+    def forget_images(self):
+        """ Keep only the image on screen and the ones queued segments still need """
+        with self.lock:
+            keep = {key for _, key, _ in self.segments} | {key for _, _, key in self.switches}
+            if self.pending_image:
+                keep.add(self.pending_image[1])
+            if self.current:
+                keep.add(self.current[1])
+            keep.add(self.last_queued)
+            for key in list(self.images):
+                if key not in keep:
+                    del self.images[key]
+                    self.images_sent.discard(key)
+
+    def run(self):
+        # the clock starts with the first segment
+        while self.running and self.start_time is None:
+            with self.lock:
+                ready = bool(self.segments)
+            if ready:
+                self.start_time = time.time()
+            else:
+                time.sleep(0.1)
+
+        while self.running:
+            due = self.start_time + self.frame_number / self.fps - self.lead
+            now = time.time()
+            if now < due:
+                time.sleep(due - now)
+                continue
+            if now - due > 1.0:
+                # stalled, move the clock instead of bursting frames to catch up
+                behind = now - due
+                self.start_time += behind
+                logger.error(f"Timeline: {behind:.1f} seconds behind real time, skipping the clock ahead.")
+            self.send_frame()
+            self.frame_number += 1
+            if self.frame_number % int(self.fps * 10) == 0:
+                self.forget_images()
+
+    def stop(self):
+        self.running = False
@@ -12,8 +12,7 @@ import zmq
 import argparse
 import io
 
-from diffusers import StableDiffusionPipeline
-import torch
+from lifeAIdiffusers import DiffusersBackend, pick_device, set_threads
 from transformers import logging as trlogging
 import re
 import logging
@@ -24,6 +23,12 @@ from dotenv import load_dotenv
 import os
 import requests
 import webuiapi
+import lifeAIsdwebui
+from lifeAIimageCache import ImageCache
+from lifeAIttiQueue import ImageSlot, CoalescingQueue
+import threading
+import queue
+from PIL import Image
 
 load_dotenv()
 
@@ -72,40 +77,14 @@ def generate_getimgai(mediaid, image_model, prompt):
 
 def generate_sd_webui(mediaid, prompt, save_file=False):
     try:
-        result = sdui_api.txt2img(prompt=prompt,
-                            negative_prompt=args.negative_prompt,
-                            save_images=False,
-                            width=512,
-                            height=512,
-                            #steps=25,
-                            #cfg_scale=7.5,
-        #                    seed=1003,
-        #                    styles=["anime"],
-        #                    cfg_scale=7,
-        #                      sampler_index='DDIM',
-        #                      steps=30,
-        #                      enable_hr=True,
-        #                      hr_scale=2,
-        #                      hr_upscaler=webuiapi.HiResUpscaler.Latent,
-        #                      hr_second_pass_steps=20,
-        #                      hr_resize_x=1536,
-        #                      hr_resize_y=1024,
-        #                      denoising_strength=0.4,
-
-                )
-
-        sdui_api.util_wait_for_ready()
-
-        if result.image is not None:
-            if save_file:
-                result.image.save(f"images/{mediaid}.png")
-                logger.info(f"Saved image to images/{mediaid}.png")
-                print(f"Saved image to images/{mediaid}.png")
-        else:
-            logger.error(f"Error generating image: {result.error}")
-            return None
+        image = lifeAIsdwebui.txt2img(sdui_api, prompt, args.negative_prompt, 512, 512)
+
+        if image is not None and save_file:
+            image.save(f"images/{mediaid}.png")
+            logger.info(f"Saved image to images/{mediaid}.png")
+            print(f"Saved image to images/{mediaid}.png")
 
-        return result.image
+        return image
     except Exception as e:
         logger.error(f"Error generating image: {e}")
         return None
@@ -165,166 +144,260 @@ def clean_text(text):
     text = ' '.join(text.split())
     return text
 
+class StalenessStats:
+    """ Age of the image shown for each segment, relative to the segment it was made for """
+    def __init__(self, report_interval=60):
+        self.count = 0
+        self.reused = 0
+        self.total_ms = 0
+        self.max_ms = 0
+        self.report_interval = report_interval
+        self.last_report = time.time()
+
+    def add(self, staleness_ms, reused):
+        self.count += 1
+        self.reused += int(reused)
+        self.total_ms += staleness_ms
+        self.max_ms = max(self.max_ms, staleness_ms)
+        if time.time() - self.last_report >= self.report_interval:
+            self.last_report = time.time()
+            logger.info(f"TTI: image staleness avg {self.total_ms / self.count:.0f} ms max {self.max_ms} ms, "
+                        f"{self.reused}/{self.count} segments reused the previous image, {work_queue.superseded} superseded.")
+            if image_cache is not None:
+                logger.info(f"TTI: image cache {image_cache.metrics()}")
+
+def build_prompt(header_message):
+    optimized_prompt = ""
+    if "optimized_text" in header_message and header_message["optimized_text"] != "":
+        optimized_prompt = header_message["optimized_text"]
+    else:
+        optimized_prompt = header_message["text"]
+        logger.warning(f"TTI: No optimized text, using original text.")
+
+    # genre
+    genre = args.genre
+    if "genre" in header_message and header_message["genre"] != "":
+        genre = header_message["genre"]
+
+    speaker_pattern = r'(?:(?:\[/INST\])?<<([A-Za-z0-9_\)\(\-]+)>>|^(?:\[\w+\])?([A-Za-z0-9_\)\(\-)]+):)'
+    speaker_line = False
+    speaker_name = ""
+    # Find speaker names in the text and derive gender from name, setup speaker map
+    for line in optimized_prompt.split('\n'):
+        speaker_match = re.search(speaker_pattern, line)
+        if speaker_match:
+            # Extracting speaker name from either of the capturing groups
+            new_speaker = speaker_match.group(1) or speaker_match.group(2)
+            new_speaker = new_speaker.strip()
+            new_speaker = new_speaker.lower()
+            speaker_line = True
+            speaker_name = new_speaker
+            break
+
+    # Clean text
+    optimized_prompt_clean = clean_text(optimized_prompt)
+
+    # create prompt
+    optimized_prompt_final = f"{speaker_name} {genre[:10]} {header_message['message'][:10]} {optimized_prompt_clean[:200]}"
+
+    return optimized_prompt_final, speaker_line
+
+def generate_image(mediaid, header_message, optimized_prompt_final):
+    image = None
+    if args.service == "openai":
+        image = generate_openai(mediaid, args.oai_image_model, optimized_prompt_final, header_message["username"], args.save_images)
+    elif args.service == "sdwebui":
+        start_time = time.time()
+        image = generate_sd_webui(mediaid, optimized_prompt_final, args.save_images)
+        end_time = time.time()
+        logger.info(f"Image generation took {end_time - start_time} seconds.")
+    elif args.service == "getimgai":
+        image = generate_getimgai(mediaid, args.sdwebui_image_model, optimized_prompt_final)
+    else:
+        start_time = time.time()
+        image = diffusers_backend.generate([optimized_prompt_final], args.negative_prompt, args.width, args.height, args.extend_prompt)[0]
+        logger.info(f"Image generation took {time.time() - start_time} seconds.")
+
+    return encode_image(image)
+
+def encode_image(image):
+    if image is None:
+        return None
+
+    if args.service != "openai": # and args.service != "sdwebui":
+        # Convert PIL Image to bytes
+        img_byte_arr = io.BytesIO()
+        image.save(img_byte_arr, format='PNG')  # Save it as PNG or JPEG depending on your preference
+        image = img_byte_arr.getvalue()
+
+    # check if image is more than 75k
+    if args.service != "openai" and args.service != "sdwebui" and len(image) < 75000:
+        logger.error(f"Image is too small, retrying...")
+        return None
+
+    return image
+
+def generate_batch(slots):
+    """ Render the prompts of several waiting segments in one backend call, images come back in slot order """
+    prompts = [slot.prompt for slot in slots]
+    start_time = time.time()
+    images = [None] * len(slots)
+    try:
+        if args.service == "sdwebui" and sdwebui_batch_layout is not None:
+            images = lifeAIsdwebui.txt2img_batch(sdui_api, prompts, args.negative_prompt, sdwebui_batch_layout, 512, 512)
+        elif args.service == "huggingface":
+            images = diffusers_backend.generate(prompts, args.negative_prompt, args.width, args.height, args.extend_prompt)
+        else:
+            return [generate_image(slot.header["mediaid"], slot.header, slot.prompt) for slot in slots]
+    except Exception as e:
+        logger.error(f"Error generating image batch: {e}")
+
+    logger.info(f"Image batch of {len(slots)} took {time.time() - start_time} seconds.")
+    return [encode_image(image) for image in images]
+
+def generation_worker():
+    """ Take the newest waiting segment per mediaid and render it, dropping ones older than max_latency.
+
+    With several answers waiting at once, up to --batch_size segments are rendered in one backend call,
+    one answer's own backlog is coalesced instead, see CoalescingQueue.get_batch.
+    """
+    while True:
+        slots = []
+        for slot in work_queue.get_batch(max(1, args.batch_size)):
+            header_message = slot.header
+            if args.max_latency > 0 and slot.priority != 100:
+                age = time.time() - header_message['timestamp'] / 1000
+                if age > args.max_latency:
+                    logger.error(f"TTI: Message #{header_message['segment_number']} is too old {age:.1f}s, reusing the previous image.")
+                    slot.resolve(None, "stale")
+                    continue
+            # near duplicate of a recent prompt, reuse the cached image instead of rendering
+            if image_cache is not None and slot.priority != 100:
+                image = image_cache.lookup(slot.prompt)
+                if image is not None:
+                    slot.resolve(image, "cached")
+                    continue
+            slots.append(slot)
+
+        if len(slots) > 1:
+            logger.info(f"Text to Image batch of {len(slots)} prompts #{', #'.join(str(slot.header['segment_number']) for slot in slots)}")
+            for slot, image in zip(slots, generate_batch(slots)):
+                if image is not None:
+                    cache_image(slot.prompt, image)
+                    slot.resolve(image, "generated")
+            # anything the batch failed on falls through to a single render with retries
+            slots = [slot for slot in slots if not slot.done.is_set()]
+
+        for slot in slots:
+            header_message = slot.header
+            mediaid = header_message["mediaid"]
+            segment_number = header_message["segment_number"]
+
+            logger.info(
+                f"Text to Image using text as prompt #{segment_number}:\n - {slot.prompt[:80]}...")
+
+            image = None
+            for attempt in range(args.retries + 1):
+                try:
+                    image = generate_image(mediaid, header_message, slot.prompt)
+                except Exception as e:
+                    logger.error(f"Error generating image: {e}")
+                    image = None
+                if image is not None:
+                    break
+                logger.error(f"Error generating image, retrying {attempt + 1}/{args.retries}...")
+
+            if image is None:
+                slot.resolve(None, "failed")
+            else:
+                cache_image(slot.prompt, image)
+                slot.resolve(image, "generated")
+
+def cache_image(prompt, image):
+    if image_cache is None:
+        return
+    try:
+        image_cache.store(prompt, image)
+    except Exception as e:
+        logger.error(f"Image cache store failed: {e}")
+
+def send_worker():
+    """ Send one image per received segment in arrival order, reuses resolve to the last image sent.
+
+    A reuse decided while an earlier segment is still rendering waits for it
+    on purpose. The player pairs images with speech by arrival order, so a
+    reuse sent ahead would land on the earlier segment's speech and the
+    rendered image on the later one's. Reuses with nothing rendering ahead
+    of them go out as soon as they are decided.
+    """
+    last_image = placeholder_image()
+    last_image_timestamp = 0
+    stats = StalenessStats()
+    while True:
+        slot = outbox.get()
+        # head of line, see above, the order is what keeps images on their speech
+        slot.done.wait()
+        header_message = slot.header
+        segment_number = header_message["segment_number"]
+        header_message["stream"] = "image"
+
+        reused = slot.image is None
+        if reused:
+            header_message["throttle"] = "true"
+        else:
+            header_message["throttle"] = "false"
+            last_image = slot.image
+            last_image_timestamp = header_message['timestamp']
+            state["last_image_time"] = time.time()
+            state["have_image"] = True
+
+        staleness = 0
+        if last_image_timestamp:
+            staleness = max(0, header_message['timestamp'] - last_image_timestamp)
+        header_message["image_staleness"] = staleness
+        stats.add(staleness, reused)
+
+        sender.send_json(header_message, zmq.SNDMORE)
+        sender.send(last_image)
+
+        logger.info(f"Text to Image sent image #{segment_number} {header_message['timestamp']} of {len(last_image)} bytes ({slot.reason}, {staleness} ms stale).")
+
+def placeholder_image():
+    """ Black frame used for reuses before the first image has been generated """
+    img_byte_arr = io.BytesIO()
+    Image.new('RGB', (args.width, args.height)).save(img_byte_arr, format='PNG')
+    return img_byte_arr.getvalue()
+
 def main():
-    last_image = None
-    last_image_time = 0
-    retry = False
-    latency = 0
-    max_latency = args.max_latency
-    throttle = False
-    header_message = None
     skipped_messages = 0
     while True:
-        if throttle and args.max_latency > 0:
-            start = time.time()
-            combine_time = 0
-            if max_latency > 0:
-                combine_time = max(0, (latency / 1000) - max_latency)
-
-            # read and combine the messages for 60 seconds into a single message
-            priority = 0
-            while max_latency > 0 and time.time() - start < combine_time:
-                header_message = receiver.recv_json()
-                header_message["stream"] = "image"
-                header_message["throttle"] = "true"
-                if 'priority' in header_message:
-                    priority = header_message["priority"]
-                    if priority == 100:
-                        retry = True # keep header and continue with this message on loop
-                        break
-
-                sender.send_json(header_message, zmq.SNDMORE)
-                sender.send(last_image)
-
-            logger.info(f"TTI: Throttling for {combine_time} seconds.")
-
-        # Receive a message
-        if retry:
-            logger.error(f"Retrying...")
-            retry = False
-        else:
-            header_message = receiver.recv_json()
+        header_message = receiver.recv_json()
 
         # get variables from header
-        mediaid = header_message["mediaid"]
         segment_number = header_message["segment_number"]
         header_message["throttle"] = "false"
-        optimized_prompt = ""
-        if "optimized_text" in header_message and header_message["optimized_text"] != "":
-            optimized_prompt = header_message["optimized_text"]
-        else:
-            optimized_prompt = header_message["text"]
-            logger.warning(f"TTI: No optimized text, using original text.")
-
-        # genre
-        genre = args.genre
-        if "genre" in header_message and header_message["genre"] != "":
-            genre = header_message["genre"]
-
-        image = None
-        speaker_pattern = r'(?:(?:\[/INST\])?<<([A-Za-z0-9_\)\(\-]+)>>|^(?:\[\w+\])?([A-Za-z0-9_\)\(\-)]+):)'
-        speaker_line = False
-        speaker_name = ""
-        # Find speaker names in the text and derive gender from name, setup speaker map
-        for line in optimized_prompt.split('\n'):
-            speaker_match = re.search(speaker_pattern, line)
-            if speaker_match:
-                # Extracting speaker name from either of the capturing groups
-                new_speaker = speaker_match.group(1) or speaker_match.group(2)
-                new_speaker = new_speaker.strip()
-                new_speaker = new_speaker.lower()
-                speaker_line = True
-                speaker_name = new_speaker
-                break
-
-        # Clean text
-        optimized_prompt_clean = clean_text(optimized_prompt)
-
-        # create prompt
-        optimized_prompt_final = f"{speaker_name} {genre[:10]} {header_message['message'][:10]} {optimized_prompt_clean[:200]}"
+
+        optimized_prompt_final, speaker_line = build_prompt(header_message)
 
         logger.debug(
             f"Text to Image recieved optimized prompt:\n{header_message}.")
-        logger.info(
-            f"Text to Image using text as prompt #{segment_number}:\n - {optimized_prompt_final[:80]}...")
 
         priority = 0
-        if priority in header_message:
+        if 'priority' in header_message:
             priority = header_message["priority"]
-        if (priority == 100 or skipped_messages >= args.skipped_messages or speaker_line or last_image == None) and (args.wait_time == 0 or last_image == None or time.time() - last_image_time >= args.wait_time):
-            skipped_messages = 0
-            if args.service == "openai":
-                image = generate_openai(mediaid, args.oai_image_model, optimized_prompt_final, header_message["username"], args.save_images)
-            elif args.service == "sdwebui":
-                start_time = time.time()
-                image = generate_sd_webui(mediaid, optimized_prompt_final, args.save_images)
-                end_time = time.time()
-                logger.info(f"Image generation took {end_time - start_time} seconds.")
-            elif args.service == "getimgai":
-                image = generate_getimgai(mediaid, args.sdwebui_image_model, optimized_prompt_final)
-            else:
-                if args.extend_prompt:
-                    max_length = pipe.tokenizer.model_max_length
-
-                    # 3. Forward
-                    input_ids = pipe.tokenizer(optimized_prompt_final, return_tensors="pt").input_ids
-                    input_ids = input_ids.to("mps")
-
-                    negative_ids = pipe.tokenizer("", truncation=False, padding="max_length", max_length=input_ids.shape[-1], return_tensors="pt").input_ids
-                    negative_ids = negative_ids.to("mps")
-
-                    concat_embeds = []
-                    neg_embeds = []
-                    for i in range(0, input_ids.shape[-1], max_length):
-                        concat_embeds.append(pipe.text_encoder(input_ids[:, i: i + max_length])[0])
-                        neg_embeds.append(pipe.text_encoder(negative_ids[:, i: i + max_length])[0])
-
-                    prompt_embeds = torch.cat(concat_embeds, dim=1)
-                    negative_prompt_embeds = torch.cat(neg_embeds, dim=1)
-
-                    # 2. Forward embeddings and negative embeddings through text encoder
-                    image = pipe(prompt_embeds=prompt_embeds, negative_prompt_embeds=negative_prompt_embeds).images[0]
-                else:
-                    image = pipe(optimized_prompt_final).images[0]
-
-            if image != None:
-                if args.service != "openai": # and args.service != "sdwebui":
-                    # Convert PIL Image to bytes
-                    img_byte_arr = io.BytesIO()
-                    image.save(img_byte_arr, format='PNG')  # Save it as PNG or JPEG depending on your preference
-                    image = img_byte_arr.getvalue()
-                #elif args.service == "sdwebui":
-                 #   image = image.copy()
-
-                # check if image is more than 75k
-                if args.service != "openai" and args.service != "sdwebui" and len(image) < 75000:
-                    logger.error(f"Image is too small, retrying...")
-                    retry = True
-                    continue
 
-                last_image = image
-                last_image_time = time.time()
-            else:
-                logger.error(f"Error generating image, retrying...")
-                retry = True
-                continue
+        slot = ImageSlot(header_message, optimized_prompt_final, priority)
+        outbox.put(slot)
+
+        have_image = state["have_image"]
+        if (priority == 100 or skipped_messages >= args.skipped_messages or speaker_line or not have_image) and (args.wait_time == 0 or not have_image or time.time() - state["last_image_time"] >= args.wait_time):
+            skipped_messages = 0
+            work_queue.put(slot)
         else:
-            header_message["throttle"] = "true"
+            # answered right away with the previous image
             skipped_messages += 1
-
-        header_message["stream"] = "image"
-
-        sender.send_json(header_message, zmq.SNDMORE)
-        sender.send(last_image)
-
-        logger.info(f"Text to Image sent image #{segment_number} {header_message['timestamp']} of {len(last_image)} bytes.")
-
-        # measure latency and see if we need to throttle output
-        if args.service != "openai":
-            latency = round(time.time() * 1000) - header_message['timestamp']
-            if latency > (max_latency * 1000) and max_latency > 0:
-                logger.error(f"TTI: Message is too old {latency/1000}, throttling for the next{latency/1000} seconds.")
-                throttle = True
+            slot.resolve(None, "skipped")
+            logger.info(f"Text to Image reusing previous image for #{segment_number}.")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -339,7 +412,25 @@ if __name__ == "__main__":
     parser.add_argument("--hg_model", type=str, default="runwayml/stable-diffusion-v1-5", help="Huggingface Model ID to use, default unwayml/stable-diffusion-v1-5")
     parser.add_argument("--wait_time", type=int, default=0, help="Time in seconds to wait between image generations")
     parser.add_argument("--extend_prompt", action="store_true", help="Extend prompt past 77 token limit.")
-    parser.add_argument("--max_latency", type=int, default=0, help="Max latency for messages before they are throttled / combined")
+    parser.add_argument("--hg_dtype", type=str, default="auto", help="Huggingface weights precision: auto, fp32, bf16, fp16. auto is fp32 on CPU and fp16 on a GPU")
+    parser.add_argument("--hg_scheduler", type=str, default="default", help="Huggingface scheduler: default, dpm, euler_a, unipc, lcm")
+    parser.add_argument("--hg_steps", type=int, default=0, help="Huggingface inference steps, 0 picks 4 for turbo/LCM models and 20 otherwise")
+    parser.add_argument("--hg_guidance", type=float, default=-1.0, help="Huggingface guidance scale, negative picks 0 for turbo models and 7.5 otherwise")
+    parser.add_argument("--hg_lcm_lora", type=str, default="", help="LCM LoRA to fuse for few step generation, e.g. latent-consistency/lcm-lora-sdv1-5")
+    parser.add_argument("--hg_compile", action="store_true", default=False, help="torch.compile the unet, slow first image then faster")
+    parser.add_argument("--noattention_slicing", action="store_true", default=False, help="Disable attention slicing, faster with plenty of memory")
+    parser.add_argument("--embedding_cache_mb", type=int, default=64, help="Memory in MB for cached --extend_prompt negative prompt embeddings")
+    parser.add_argument("--threads", type=int, default=0, help="Torch CPU threads, 0 leaves the torch default")
+    parser.add_argument("--nowarmup", action="store_true", default=False, help="Skip the warmup render at startup")
+    parser.add_argument("--max_latency", type=int, default=0, help="Max latency in seconds for messages before they are dropped and reuse the previous image")
+    parser.add_argument("--batch_size", type=int, default=4, help="Max prompts rendered in one call when segments are backlogged, 1 disables batching")
+    parser.add_argument("--noimage_cache", action="store_true", default=False, help="Disable reusing cached images for near duplicate prompts")
+    parser.add_argument("--image_cache_dir", type=str, default="cache/images", help="Directory for the prompt similarity image cache")
+    parser.add_argument("--image_cache_mb", type=int, default=512, help="Max disk space in MB for the image cache, least recently used images are evicted")
+    parser.add_argument("--image_cache_threshold", type=float, default=0.7, help="Token set similarity 0.0-1.0 for a prompt to reuse a cached image")
+    parser.add_argument("--image_cache_window", type=int, default=3600, help="Seconds a cached image stays eligible for reuse")
+    parser.add_argument("--image_cache_vary", action="store_true", default=False, help="Lightly vary reused images with a mirror and small zoom")
+    parser.add_argument("--retries", type=int, default=3, help="Retries for a failed image generation before reusing the previous image")
     parser.add_argument("--service", type=str, default="sdwebui", help="Service to use for image generation: huggingface, openai, sdwebui, getimgai")
     parser.add_argument("--save_images", action="store_true", help="Save images to disk")
     parser.add_argument("--oai_image_model", type=str, default="dall-e-2", help="OpenAI image model to use")
@@ -376,34 +467,30 @@ if __name__ == "__main__":
     ch.setFormatter(formatter)
     logger.addHandler(ch)
 
-    model_id = args.hg_model
-
-    ## Disable NSFW filters
-    pipe = None
+    diffusers_backend = None
     if args.service == "huggingface":
-        if args.nsfw:
-            pipe = StableDiffusionPipeline.from_pretrained(model_id,
-                                                            torch_dtype=torch.float16,
-                                                            safety_checker = None,
-                                                            requires_safety_checker = False)
-        else:
-            pipe = StableDiffusionPipeline.from_pretrained(model_id, torch_dtype=torch.float16)
-
-        ## Offload to GPU Metal
-        if args.metal:
-            pipe = pipe.to("mps")
-        elif args.cuda:
-            pipe = pipe.to("cuda")
-        else:
-            pipe = pipe.to("mps")
+        set_threads(args.threads)
+        diffusers_backend = DiffusersBackend(args.hg_model,
+                                             device=pick_device(args.metal, args.cuda),
+                                             dtype=args.hg_dtype,
+                                             nsfw=args.nsfw,
+                                             scheduler=args.hg_scheduler,
+                                             steps=args.hg_steps,
+                                             guidance_scale=args.hg_guidance,
+                                             lcm_lora=args.hg_lcm_lora,
+                                             attention_slicing=not args.noattention_slicing,
+                                             compile_unet=args.hg_compile,
+                                             embedding_cache_mb=args.embedding_cache_mb)
+        if not args.nowarmup:
+            diffusers_backend.warmup(args.width, args.height)
 
     sdui_api = None
     if args.service == "sdwebui":
         # create API client with custom host, port
         host, port = args.webui_url.split(":")
         sdui_api = webuiapi.WebUIApi(
-            host='127.0.0.1',
-            port=7860,
+            host=host,
+            port=int(port),
             use_https=False)
 
         if args.loglevel == "debug":
@@ -416,6 +503,11 @@ if __name__ == "__main__":
 
         sdui_api.util_set_model(args.sdwebui_image_model)
 
+    sdwebui_batch_layout = None
+    if args.service == "sdwebui" and args.batch_size > 1:
+        sdwebui_batch_layout = lifeAIsdwebui.batch_script_layout(sdui_api)
+        logger.info(f"sdwebui batch script args: {sdwebui_batch_layout}")
+
     openai_client = None
     if args.service == "openai":
         openai_client = OpenAI()
@@ -431,4 +523,20 @@ if __name__ == "__main__":
     sender = context.socket(zmq.PUSH)
     logger.info("binded to ZMQ out: %s:%d" % (args.output_host, args.output_port))
     sender.connect(f"tcp://{args.output_host}:{args.output_port}")
-    main()
+
+    image_cache = None
+    if not args.noimage_cache:
+        image_cache = ImageCache(args.image_cache_dir, args.image_cache_mb * 1024 * 1024,
+                                 args.image_cache_threshold, args.image_cache_window, args.image_cache_vary)
+
+    state = {"last_image_time": 0, "have_image": False}
+    work_queue = CoalescingQueue()
+    outbox = queue.Queue()
+    threading.Thread(target=generation_worker, daemon=True).start()
+    threading.Thread(target=send_worker, daemon=True).start()
+
+    try:
+        main()
+    finally:
+        if image_cache is not None:
+            image_cache.close()
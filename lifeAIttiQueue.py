@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+
+## Life AI Text to Image work queue, segments waiting for an image, latest wins per mediaid
+#
+# Chris Kennedy 2023 (C) GPL
+#
+# Free to use for any use as in truly free software
+# as Richard Stallman intended it to be.
+#
+
+import time
+import threading
+from collections import OrderedDict
+
+class ImageSlot:
+    """ One received text segment waiting for its image, resolved by the worker or as a reuse """
+    def __init__(self, header_message, prompt, priority=0):
+        self.header = header_message
+        self.prompt = prompt
+        self.priority = priority
+        self.received = time.time()
+        self.image = None
+        self.reason = ""
+        self.done = threading.Event()
+
+    def resolve(self, image=None, reason="generated"):
+        self.image = image
+        self.reason = reason
+        self.done.set()
+
+class CoalescingQueue:
+    """ Latest wins work queue keyed by mediaid.
+
+    A new segment for a mediaid supersedes any segment of the same answer still
+    waiting for the generator, which is resolved right away as a reuse of the
+    previous image. Priority 100 segments are never superseded.
+    """
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.pending = OrderedDict()
+        self.superseded = 0
+
+    def put(self, slot):
+        mediaid = slot.header["mediaid"]
+        with self.cond:
+            waiting = self.pending.setdefault(mediaid, [])
+            for old in [old for old in waiting if old.priority != 100]:
+                waiting.remove(old)
+                old.resolve(None, "superseded")
+                self.superseded += 1
+            waiting.append(slot)
+            self.cond.notify()
+
+    def get(self):
+        return self.get_batch(1)[0]
+
+    def get_batch(self, max_slots):
+        """ Wait for work then take up to max_slots segments, oldest mediaid first.
+
+        Latest wins leaves at most one ordinary segment waiting per mediaid,
+        so a batch only forms across answers being generated at once or from
+        priority 100 segments. A single backlogged answer renders one image at
+        a time, its superseded segments reuse the previous image instead of
+        being rendered in a batch that would delay the newest.
+        """
+        with self.cond:
+            while not self.pending:
+                self.cond.wait()
+            slots = []
+            while self.pending and len(slots) < max_slots:
+                mediaid, waiting = next(iter(self.pending.items()))
+                slots.append(waiting.pop(0))
+                if not waiting:
+                    del self.pending[mediaid]
+            return slots
+
+    def __len__(self):
+        with self.cond:
+            return sum(len(waiting) for waiting in self.pending.values())
@@ -18,120 +18,356 @@ import torch
 import logging
 import time
 import numpy as np
-
-from IPython.display import Audio
+from lifeAImusicLibrary import MusicLibrary, library_key
+from lifeAIaudio import OverlapAdd
 
 
 trlogging.set_verbosity_error()
 
 def generate_audio(prompt, negative_prompt, guidance_scale=3, audio_length_in_s=30, seed=0, audio=None, sampling_rate=32000):
-    inputs = None
+    # MusicGen in transformers has no negative prompt, guidance is against the unconditional prompt
     if audio is not None:
         inputs = processor(
             audio=audio,
+            text=[prompt],
             sampling_rate=sampling_rate,
-            padding=False,
+            padding=True,
             return_tensors="pt",
-            ).to("cpu")
-        else:
+            ).to(model.device)
+    else:
         inputs = processor(
-            text=[prompt, negative_prompt],
+            text=[prompt],
             padding=True,
             return_tensors="pt",
-            ).to("cpu")
+            ).to(model.device)
 
     set_seed(seed)
 
     max_new_tokens = int(frame_rate * audio_length_in_s)
-    audio_values = model.generate(**inputs, max_new_tokens)
+    audio_values = model.generate(**inputs, do_sample=True, guidance_scale=guidance_scale, max_new_tokens=max_new_tokens)
 
     return audio_values
 
+def float_to_wav(samples):
+    pcm = (np.clip(samples, -1.0, 1.0) * 32767).astype(np.int16)
+    audiobuf = io.BytesIO()
+    sf.write(audiobuf, pcm, sampling_rate, format='WAV')
+    return audiobuf.getvalue()
+
+def generate_track(prompt, last_audio=None):
+    """ One track as WAV bytes, its duration and the float samples for continuation """
+    start_time = time.time()
+    audio_values = generate_audio(prompt,
+                                  args.negative_prompt,
+                                  args.guidance_scale,
+                                  args.seconds,
+                                  # a new seed per track or the library fills with copies of one track
+                                  args.seed + library.generated,
+                                  last_audio,
+                                  sampling_rate)
+
+    # first batch entry, mono channel, without the audio prompt MusicGen puts in front of a continuation
+    samples = audio_values[0, 0].cpu().numpy()
+    if last_audio is not None:
+        samples = samples[len(last_audio):]
+
+    duration = len(samples) / sampling_rate
+    stats["generate_seconds"] += time.time() - start_time
+    return float_to_wav(samples), duration, samples
+
+def generate_chunk(prompt, context, chunk_index):
+    """ chunk_seconds plus the overlap of new audio, continuing from the context window when there is one """
+    start_time = time.time()
+    audio_values = generate_audio(prompt,
+                                  args.negative_prompt,
+                                  args.guidance_scale,
+                                  args.chunk_seconds + args.overlap_seconds,
+                                  args.seed + chunk_index,
+                                  context if len(context) else None,
+                                  sampling_rate)
+    samples = audio_values[0, 0].cpu().numpy()
+    # with an audio prompt MusicGen returns the prompt followed by the continuation
+    samples = samples[len(context):]
+    stats["generate_seconds"] += time.time() - start_time
+    return samples
+
+def send_track(header_message, audio, duration):
+    header_message["duration"] = duration
+    header_message["stream"] = "music"
+    sender.send_json(header_message, zmq.SNDMORE)
+    sender.send(audio)
+
+class PlayerDemand:
+    """ Whether the player wants a new track, from the status it publishes.
+
+    Until the first status arrives one track is sent so there is something to
+    start with. After a send no more are wanted until a newer status still
+    says a music change is due.
+    """
+    def __init__(self):
+        self.enabled = None
+        self.change_due = False
+        self.status_time = 0
+        self.last_sent = 0
+
+    def update(self, status):
+        self.enabled = status.get("music_enabled", True)
+        self.change_due = status.get("music_change_due", status.get("music_buffer_size", 0) == 0)
+        self.status_time = time.time()
+
+    def wanted(self):
+        if self.status_time == 0:
+            return self.last_sent == 0
+        if not self.enabled:
+            return False
+        # give the player a second to report the track we just sent as buffered
+        return self.change_due and self.status_time > self.last_sent + 1.0
+
+    def sent(self):
+        self.last_sent = time.time()
+
+def recv_latest(socket):
+    """ Drain a socket without blocking, returns the newest message or None and how many were read """
+    latest = None
+    count = 0
+    while True:
+        try:
+            latest = socket.recv_json(zmq.NOBLOCK)
+            count += 1
+        except zmq.Again:
+            return latest, count
+
+class MusicTrigger:
+    """ Collapses the incoming text segments into distinct (mediaid, genre) intents.
+
+    Repeats of the current intent are counted and dropped before they reach
+    the model. A genre change, a priority 100 !music command or a thin
+    library are the only reasons to generate.
+    """
+    def __init__(self):
+        self.intent = None
+        self.header = None
+        self.key = None
+        self.prompt = None
+        self.intent_changed = False
+        self.genre_changed = False
+        self.command = None
+        self.received = 0
+        self.redundant = 0
+        self.intents = 0
+        self.generations = {}
+
+    def update(self, header_message):
+        self.received += 1
+        genre = args.genre
+        if 'genre_music' in header_message and header_message['genre_music'] != "":
+            genre = header_message['genre_music']
+        key = library_key(genre, header_message.get("ainame", ""))
+
+        # !music from chat comes in as priority 100 with its prompt as the genre
+        command = header_message.get("priority") == 100 and header_message.get("genre_music", "") != ""
+        intent = (header_message.get("mediaid"), key)
+        if intent == self.intent and not command:
+            self.redundant += 1
+            return
+
+        self.intents += 1
+        self.intent_changed = True
+        if key != self.key:
+            self.genre_changed = True
+        if command:
+            # the command's own prompt and key, a later message in the same burst moves self.prompt and self.key on
+            self.command = (header_message, f"{genre}", key)
+        self.intent = intent
+        self.key = key
+        self.header = header_message
+        # send a general music style, optimized prompts for music are often not great
+        self.prompt = f"{genre}"
+
+    def served(self):
+        self.intent_changed = False
+        self.genre_changed = False
+
+    def generated(self, reason):
+        self.generations[reason] = self.generations.get(reason, 0) + 1
+
+    def report(self):
+        generations = sum(self.generations.values())
+        reasons = ", ".join(f"{reason} {count}" for reason, count in self.generations.items())
+        return (f"{self.received} requests received, {self.intents} distinct intents, {self.redundant} redundant dropped, "
+                f"{generations} generations run" + (f" ({reasons})" if reasons else ""))
+
+def recv_all(socket):
+    """ Drain a socket without blocking, every message in order """
+    messages = []
+    while True:
+        try:
+            messages.append(socket.recv_json(zmq.NOBLOCK))
+        except zmq.Again:
+            return messages
+
 def main():
-    latency = 0
-    max_latency = args.max_latency
-    throttle = False
     last_audio = None
+    demand = PlayerDemand()
+    trigger = MusicTrigger()
+    last_report = time.time()
+
+    poller = zmq.Poller()
+    poller.register(receiver, zmq.POLLIN)
+    if player_status is not None:
+        poller.register(player_status, zmq.POLLIN)
+
+    def generate(reason, prompt, key):
+        nonlocal last_audio
+        audio, duration, samples = generate_track(prompt, last_audio)
+        if args.continuation:
+            last_audio = samples[-int(args.context_seconds * sampling_rate):]
+        library.add(key, audio, duration, prompt)
+        trigger.generated(reason)
+        logger.info(f"Text to Music generated for {key} on {reason}, {library.fresh_count(key)} fresh tracks.")
+        return audio, duration
+
+    def send(header_message, audio, duration):
+        send_track(dict(header_message), audio, duration)
+        demand.sent()
+        trigger.served()
+        logger.info(f"{header_message['mediaid']} {header_message['segment_number']} {header_message['timestamp']} Text to Music of {duration} duration Sent.")
+
     while True:
-        messages_buffered = ""
-        header_message = None
-        if throttle:
-            start = time.time()
-            combine_time = max(0, (latency / 1000 - max_latency))
-
-            # read and combine the messages for 60 seconds into a single message
-            while time.time() - start < combine_time:
-                message = receiver.recv_json()
-                if 'priority' in message:
-                    priority = message['priority']
-                    if priority == 100:
-                        throttle = False
-                        header_message = message
-                        logger.info(f"TTM: Priority message received, no longer throttling.")
-                        break
-                if 'text' in message:
-                    messages_buffered += message["text"] + " "
-                elif 'optimized_text' in message:
-                    messages_buffered += message["optimized_text"] + " "
-            logger.info(f"TTM: Throttling for {combine_time} seconds.")
-
-        # read the message
-        if header_message is None:
-            header_message = receiver.recv_json()
+        events = dict(poller.poll(1000))
 
-        # fill in the variables form the header_message
-        optimized_prompt = ""
-        if "optimized_text" in header_message:
-            optimized_prompt = header_message["optimized_text"]
-        else:
-            optimized_prompt = header_message["text"]
-            logger.error(f"TTM: No optimized prompt, using original text.")
+        if receiver in events:
+            for message in recv_all(receiver):
+                logger.debug(f"Text to Music Recieved:\n{message}")
+                trigger.update(message)
 
-        optimized_prompt = f"{messages_buffered} {optimized_prompt}"
+        if player_status is not None and player_status in events:
+            status, _ = recv_latest(player_status)
+            if status is not None:
+                demand.update(status)
 
-        logger.debug(f"Text to Music Recieved:\n{header_message}")
-        logger.info(f"{header_message['mediaid']} {header_message['segment_number']} {header_message['timestamp']} Text to Music Recieved:\n{optimized_prompt}")
+        if time.time() - last_report > args.report_interval:
+            logger.info(f"TTM: {trigger.report()}, {library.metrics()}, {stats['generate_seconds']:.0f} seconds generating.")
+            last_report = time.time()
 
-        genre = args.genre
-        if 'genre_music' in header_message and header_message['genre_music'] != "":
-            genre = header_message['genre_music']
-        # send a general music style, with the original message plus a little of the optimized prompt
-        # this is to give the model a little more context yet optimized prompts for music are often not great
-        prompt = f"{genre}"
+        if trigger.header is None:
+            continue
 
-        audio_values = generate_audio(prompt,
-                                                     args.negative_prompt,
-                                                     args.guidance_scale,
-                                                     args.seconds,
-                                                     args.seed,
-                                                     last_audio)
+        music_on = args.nodemand or demand.enabled
 
-        if args.continuation:
-            last_audio = audio_values
-        audio_values = (audio_values.cpu().numpy() * 32767).astype(np.int16)
+        if trigger.command is not None:
+            # someone asked for music, always a new track for it
+            header_message, prompt, key = trigger.command
+            trigger.command = None
+            audio, duration = generate("music command", prompt, key)
+            send(header_message, audio, duration)
+            continue
+
+        if args.nodemand:
+            wanted = trigger.intent_changed
+        else:
+            wanted = demand.wanted()
+
+        if wanted:
+            picked = library.pick(trigger.key)
+            if picked is not None:
+                audio, track = picked
+                duration = track["duration"]
+                logger.info(f"{trigger.header['mediaid']} {trigger.header['segment_number']} Text to Music from the library, {trigger.key} play #{track['plays']}.")
+            else:
+                audio, duration = generate("library depleted", trigger.prompt, trigger.key)
+            send(trigger.header, audio, duration)
+        elif music_on and trigger.genre_changed:
+            # have a track of the new genre ready before the player asks for it
+            if library.fresh_count(trigger.key) == 0:
+                generate("genre change", trigger.prompt, trigger.key)
+            trigger.genre_changed = False
+        elif music_on and library.fresh_count(trigger.key) < args.library_min:
+            # fill the library while the player doesn't need anything so the next change is served right away
+            generate("library refill", trigger.prompt, trigger.key)
+
+def stream_main():
+    """ Continuous music in short chunks, each conditioned on a bounded window of what was already sent.
+
+    Chunks overlap by overlap_seconds, the model regenerates the held back
+    tail of the last chunk and the two are crossfaded. Generation stays at
+    most stream_lead seconds ahead of real time.
+    """
+    header_message = None
+    demand = PlayerDemand()
+    context_samples = int(args.context_seconds * sampling_rate)
+    stitcher = OverlapAdd(int(args.overlap_seconds * sampling_rate))
+    context = np.zeros(0, dtype=np.float32)
+    chunk_index = 0
+    sent_seconds = 0.0
+    stream_start = None
+    last_report = time.time()
+
+    poller = zmq.Poller()
+    poller.register(receiver, zmq.POLLIN)
+    if player_status is not None:
+        poller.register(player_status, zmq.POLLIN)
 
-        # This is assuming audio_values is meant to be mono; if it's stereo, it should be shaped to (frames, 2)
-        audio_values = audio_values.squeeze()  # This will convert (1, 1, 318080) to (318080,)
+    while True:
+        events = dict(poller.poll(100))
 
-        audiobuf = io.BytesIO()
-        sf.write(audiobuf, audio_values, sampling_rate, format='WAV')
-        audiobuf.seek(0)
+        if receiver in events:
+            message, count = recv_latest(receiver)
+            if message is not None:
+                header_message = message
+                stats["received"] += count
 
-        duration = len(audio_values) / sampling_rate
-        header_message["duration"] = duration
-        header_message["stream"] = "music"
-        sender.send_json(header_message, zmq.SNDMORE)
-        sender.send(audiobuf.getvalue())
+        if player_status is not None and player_status in events:
+            status, _ = recv_latest(player_status)
+            if status is not None:
+                demand.update(status)
 
-        # measure latency and see if we need to throttle output
-        latency = round(time.time() * 1000) - header_message['timestamp']
-        if latency > (max_latency * 1000):
-            logger.error(f"TTM: Message is too old {latency/1000}, throttling for the next {latency/1000} seconds.")
-            throttle = True
+        if time.time() - last_report > args.report_interval:
+            logger.info(f"TTM: {stats['received']} requests received, {chunk_index} chunks streamed {sent_seconds:.0f} seconds, "
+                        f"{stats['generate_seconds']:.0f} seconds generating.")
+            last_report = time.time()
 
-        logger.debug(f"Text to Music Sent:\n{header_message}")
-        logger.info(f"{header_message['mediaid']} {header_message['segment_number']} {header_message['timestamp']} Text to Music of {duration} duration Sent.")
+        if header_message is None:
+            continue
+
+        if demand.enabled is False:
+            # player has music off, start over fresh when it comes back
+            if stream_start is not None:
+                logger.info(f"TTM: Player music is disabled, stopping the stream.")
+                stitcher = OverlapAdd(int(args.overlap_seconds * sampling_rate))
+                context = np.zeros(0, dtype=np.float32)
+                stream_start = None
+            continue
+
+        if stream_start is not None:
+            ahead = sent_seconds - (time.time() - stream_start)
+            if ahead > args.stream_lead:
+                continue
+            if ahead < 0:
+                # generation fell behind, the player had a gap, count from now instead of bursting to catch up
+                logger.error(f"TTM: Stream fell {-ahead:.1f} seconds behind real time.")
+                stream_start = time.time() - sent_seconds
 
+        genre = args.genre
+        if 'genre_music' in header_message and header_message['genre_music'] != "":
+            genre = header_message['genre_music']
+
+        samples = generate_chunk(f"{genre}", context, chunk_index)
+        ready = stitcher.push(samples)
+        if len(ready) == 0:
+            continue
+        context = np.concatenate([context, ready])[-context_samples:] if context_samples > 0 else context
+
+        duration = len(ready) / sampling_rate
+        chunk_message = dict(header_message)
+        chunk_message["music_stream"] = True
+        chunk_message["music_chunk"] = chunk_index
+        send_track(chunk_message, float_to_wav(ready), duration)
+        if stream_start is None:
+            stream_start = time.time()
+        sent_seconds += duration
+        chunk_index += 1
+        logger.debug(f"TTM: Streamed chunk #{chunk_index} of {duration:.2f} seconds, {sent_seconds - (time.time() - stream_start):.1f} seconds ahead.")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -150,7 +386,20 @@ if __name__ == "__main__":
     parser.add_argument("--guidance_scale", type=float, default=3.0, help="Guidance scale for the model")
     parser.add_argument("--seed", type=int, default=0, help="Seed for the model")
     parser.add_argument("--genre", type=str, default="upbeat happy pop music, energetic rocking beat. ", help="Genre for the model")
-    parser.add_argument("--max_latency", type=int, default=10, help="Max latency for messages before they are throttled / combined, should match --seconds in most cases.")
+    parser.add_argument("--player_host", type=str, default="127.0.0.1", help="Host of the player status for music demand")
+    parser.add_argument("--player_port", type=int, default=6004, help="Port of the player status for music demand")
+    parser.add_argument("--nodemand", action="store_true", default=False, help="Send a track for every text segment instead of when the player's music change is due")
+    parser.add_argument("--library_dir", type=str, default="cache/music", help="Directory of the generated music library")
+    parser.add_argument("--library_min", type=int, default=2, help="Fresh tracks to keep ready per genre/personality while the player wants music")
+    parser.add_argument("--library_max", type=int, default=8, help="Max tracks kept per genre/personality, the oldest are removed")
+    parser.add_argument("--library_fresh", type=int, default=6 * 3600, help="Seconds a library track stays eligible to be served")
+    parser.add_argument("--library_plays", type=int, default=3, help="Times a library track is served before a new one is needed")
+    parser.add_argument("--stream", action="store_true", default=False, help="Stream continuous music in short crossfaded chunks instead of whole tracks")
+    parser.add_argument("--chunk_seconds", type=float, default=5.0, help="Seconds of new music per streamed chunk")
+    parser.add_argument("--context_seconds", type=float, default=5.0, help="Seconds of the previous music a streamed chunk or --continuation track continues from")
+    parser.add_argument("--overlap_seconds", type=float, default=0.5, help="Seconds of crossfade between streamed chunks")
+    parser.add_argument("--stream_lead", type=float, default=10.0, help="Max seconds the stream is generated ahead of real time")
+    parser.add_argument("--report_interval", type=int, default=300, help="Seconds between reports of requests received versus tracks generated")
     parser.add_argument("--continuation", action="store_true", default=False, help="Continuation of the last audio")
     parser.add_argument("--negative_prompt", type=str, default="noise, static, crackles, pops, depressing, sad, slow, boring, annoying, stuttering", help="Negative prompt for the model")
     args = parser.parse_args()
@@ -162,9 +411,6 @@ if __name__ == "__main__":
         args.seconds = 30
         print("Max seconds is 30, setting to 30")
 
-    if args.seconds != 30 and args.max_latency == 30:
-        args.max_latency = args.seconds
-
     if args.loglevel == "info":
         LOGLEVEL = logging.INFO
     elif args.loglevel == "debug":
@@ -195,6 +441,16 @@ if __name__ == "__main__":
     sender.connect(f"tcp://{args.output_host}:{args.output_port}")
     logger.info("connected to ZMQ out: %s:%d" % (args.output_host, args.output_port))
 
+    player_status = None
+    if not args.nodemand:
+        player_status = context.socket(zmq.SUB)
+        player_status.connect(f"tcp://{args.player_host}:{args.player_port}")
+        player_status.setsockopt_string(zmq.SUBSCRIBE, "")
+        logger.info("connected to player status: %s:%d" % (args.player_host, args.player_port))
+
+    library = MusicLibrary(args.library_dir, args.library_max, args.library_fresh, args.library_plays)
+    stats = {"received": 0, "generate_seconds": 0.0}
+
     processor = AutoProcessor.from_pretrained(args.model)
     model = MusicgenForConditionalGeneration.from_pretrained(args.model)
 
@@ -215,4 +471,7 @@ if __name__ == "__main__":
     else:
         model = model.to("cpu")
 
-    main()
+    if args.stream:
+        stream_main()
+    else:
+        main()
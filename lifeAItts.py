@@ -28,6 +28,13 @@ from pydub import AudioSegment
 import gender_guesser.detector as gender_guess
 from openai import OpenAI
 import json
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from lifeAIspeakers import SpeakerIndex, VoiceTable, VoiceAllocator
+from lifeAImimic3 import Mimic3Pool
+from lifeAIaudio import wav_to_pcm, pcm_to_wav, postprocess, DeadAirStats
+import numpy as np
 
 trlogging.set_verbosity_error()
 
@@ -78,6 +85,15 @@ def get_aac_duration(aac_data):
     audio_segment = AudioSegment.from_file(io.BytesIO(aac_data), format='aac')
     return len(audio_segment) / 1000.0  # Convert from milliseconds to seconds
 
+def get_mimic3_pool():
+    # made up front only for --service mimic3, a voice from a header or the speakers file can still ask for it later
+    global mimic3_pool
+    with mimic3_lock:
+        if mimic3_pool is None:
+            mimic3_pool = Mimic3Pool(args.mimic3_url, timeout=args.tts_timeout, probe_interval=args.probe_interval)
+            logger.info(f"TTS Pool: mimic3 servers {mimic3_pool.status()}")
+        return mimic3_pool
+
 def get_tts_audio(service, text, voice=None, noise_scale=None, noise_w=None, length_scale=None, ssml=None, audio_target=None):
     
     if service == "mimic3":
@@ -91,9 +107,7 @@ def get_tts_audio(service, text, voice=None, noise_scale=None, noise_w=None, len
             'audioTarget': audio_target or 'client'
         }
 
-        response = requests.get('http://earth:59125/api/tts', params=params)
-        response.raise_for_status()
-        return response.content
+        return get_mimic3_pool().tts(params)
     elif service == "openai":
         print(f"OpenAI: '{voice}': {text}")
         response = openai_client.audio.speech.create(
@@ -110,7 +124,7 @@ def get_tts_audio(service, text, voice=None, noise_scale=None, noise_w=None, len
 
         output = None
         try:
-            with torch.no_grad():
+            with mms_lock, torch.no_grad():
                 output = model(**inputs).waveform
             waveform_np = output.squeeze().numpy().T
         except Exception as e:
@@ -124,30 +138,92 @@ def get_tts_audio(service, text, voice=None, noise_scale=None, noise_w=None, len
         
         return audiobuf.getvalue()
 
+def synthesize(tts_api, text, voice_model, voice_speed):
+    duration = 0
+    audio_blob = get_tts_audio(
+        tts_api,
+        text,
+        voice=voice_model,
+        noise_scale=args.noise_scale,
+        noise_w=args.noise_w,
+        length_scale=voice_speed,
+        ssml=args.ssml,
+        audio_target=args.audio_target
+    )
+
+    # trim dead air and level the loudness, the header duration comes from the trimmed samples
+    if not args.nopostprocess and audio_blob:
+        start = time.time()
+        if tts_api == "openai":
+            audio_segment = AudioSegment.from_file(io.BytesIO(audio_blob), format='aac').set_sample_width(2)
+            samples = np.array(audio_segment.get_array_of_samples(), dtype=np.int16).reshape(-1, audio_segment.channels)
+            sample_rate = audio_segment.frame_rate
+        else:
+            samples, sample_rate = wav_to_pcm(audio_blob)
+        input_duration = len(samples) / sample_rate
+        samples = postprocess(samples, sample_rate, args)
+        audio_blob = pcm_to_wav(samples, sample_rate)
+        duration = len(samples) / sample_rate
+        dead_air.add(input_duration, duration, time.time() - start)
+        return audio_blob, duration
+
+    if tts_api == "mimic3" or tts_api == "mms-tts":
+        duration = len(audio_blob) / (22050 * 2)  # Assuming 22.5kHz 16-bit audio for duration calculation
+    elif tts_api == "openai":
+        duration = get_aac_duration(audio_blob)
+
+    return audio_blob, duration
+
+def send_worker():
+    """ Send the synthesized segments out in the order they were received """
+    while True:
+        header_message, text, tts_api, voice_model, voice_speed, future = pending.get()
+        segment_number = header_message["segment_number"]
+
+        duration = 0
+        try:
+            audio_blob, duration = future.result()
+        except Exception as e:
+            logger.error(f"Exception: ERROR TTS error with API request for text: {text}")
+            logger.error(e)
+            continue
+
+        if duration == 0:
+            logger.error(f"Exception: ERROR TTS {tts_api} {voice_model} x{voice_speed} returned 0 duration audio blobt: {text}")
+            continue
+
+        audiobuf = io.BytesIO(audio_blob)
+        audiobuf.seek(0)
+
+        # Fill in the header
+        header_message["duration"] = duration
+        header_message["stream"] = "speek"
+
+        # Send the header and the audio
+        sender.send_json(header_message, zmq.SNDMORE)
+        sender.send(audiobuf.getvalue())
+
+        logger.debug(f"Text to Speech: sent audio #{segment_number}\n{header_message}")
+        logger.info(f"Text to Speech: sent audio #{segment_number} of {duration} duration.")
+
 def main():
     voice_set = False
     gender = args.gender
     last_gender = gender
     voice_model = args.voice
     last_voice_model = voice_model
-    male_voice_index = 0
-    female_voice_index = 0
-    speaker_map = {}
     speaker = "narrator"
     last_speaker = speaker
     mediaid = 0
     last_mediaid = mediaid
     # voice, gender
-    male_voices = []
-    female_voices = []
-    speaker_count = 0
+    voices = None
+    allocator = None
 
     tts_api = args.service
     last_tts_api = "" # start off with no last TTS API so initializes
     voice_speed = "1.5" # default speed for mimic3, else they are too fast (higher slower)
 
-    speaker_map[speaker] = {"gender": gender, "voice": voice_model}
-
     while True:
         header_message = receiver.recv_json()
         segment_number = header_message["segment_number"]
@@ -170,8 +246,6 @@ def main():
             last_voice_model = voice_model
             gender = args.gender
             last_gender = gender
-            male_voice_index = 0
-            female_voice_index = 0
             speaker = "narrator"
             last_speaker = speaker
             tts_api = args.service
@@ -179,7 +253,6 @@ def main():
             ## set the defaults
             voice_model = None
             voice_speed = "1.5"
-            speaker_count = 0
 
         header_voice_model = None
         if 'voice_model' in header_message:
@@ -190,148 +263,16 @@ def main():
         # switched TTS Services
         if tts_api != last_tts_api:
             last_tts_api = tts_api
-            speaker_map = {} # reset the speaker map
-            speaker_map[speaker] = {"gender": gender, "voice": voice_model}
-            # OpenAI API
-            if tts_api == "openai":
-                male_voices = ['alloy', 'echo', 'fabel', 'onyx']
-                female_voices = ['nova', 'shimmer']
-                default_voice = 'nova'
-                voice_model = default_voice
-            elif tts_api == "mimic3":
-                male_voices = [
-                    #'en_US/hifi-tts_low#6097',
-                    #'en_US/hifi-tts_low#9017',
-                    'en_US/vctk_low#p326',
-                    'en_US/vctk_low#p259',
-                    'en_US/vctk_low#p247',
-                    'en_US/vctk_low#p263',
-                    'en_US/vctk_low#p286',
-                    'en_US/vctk_low#p270',
-                    'en_US/vctk_low#p281',
-                    'en_US/vctk_low#p271',
-                    'en_US/vctk_low#p273',
-                    'en_US/vctk_low#p284',
-                    'en_US/vctk_low#p287',
-                    'en_US/vctk_low#p360',
-                    'en_US/vctk_low#p376',
-                    'en_US/vctk_low#p304',
-                    'en_US/vctk_low#p347',
-                    'en_US/vctk_low#p311',
-                    'en_US/vctk_low#p334',
-                    'en_US/vctk_low#p316',
-                    'en_US/vctk_low#p363',
-                    'en_US/vctk_low#p275',
-                    'en_US/vctk_low#p258',
-                    'en_US/vctk_low#p232',
-                    'en_US/vctk_low#p292',
-                    'en_US/vctk_low#p272',
-                    'en_US/vctk_low#p278',
-                    'en_US/vctk_low#p298',
-                    'en_US/vctk_low#p279',
-                    'en_US/vctk_low#p285',
-                    'en_US/vctk_low#p326', # super deep voice
-                    'en_US/vctk_low#p254',
-                    'en_US/vctk_low#p252',
-                    'en_US/vctk_low#p345',
-                    'en_US/vctk_low#p243',
-                    'en_US/vctk_low#p227',
-                    'en_US/vctk_low#p225',
-                    'en_US/vctk_low#p251',
-                    'en_US/vctk_low#p246',
-                    'en_US/vctk_low#p226',
-                    'en_US/vctk_low#p260',
-                    'en_US/vctk_low#p245',
-                    'en_US/vctk_low#p241',
-                    'en_US/vctk_low#p237',
-                    'en_US/vctk_low#p256',
-                    'en_US/vctk_low#p302',
-                    'en_US/vctk_low#p264',
-                    'en_US/vctk_low#p225',
-                    'en_US/cmu-arctic_low#rms',
-                    'en_US/cmu-arctic_low#ksp',
-                    'en_US/cmu-arctic_low#aew',
-                    'en_US/cmu-arctic_low#bdl',
-                    'en_US/cmu-arctic_low#jmk',
-                    'en_US/cmu-arctic_low#fem',
-                    'en_US/cmu-arctic_low#ahw',
-                    'en_US/cmu-arctic_low#aup',
-                    'en_US/cmu-arctic_low#gke'
-                ]
-                female_voices = [
-                    'en_US/vctk_low#p303', #'en_US/hifi-tts_low#92',
-                    'en_US/vctk_low#s5',
-                    'en_US/vctk_low#p264',
-                    'en_US/vctk_low#p239',
-                    'en_US/vctk_low#p236',
-                    'en_US/vctk_low#p250',
-                    'en_US/vctk_low#p261',
-                    'en_US/vctk_low#p283',
-                    'en_US/vctk_low#p276',
-                    'en_US/vctk_low#p277',
-                    'en_US/vctk_low#p231',
-                    'en_US/vctk_low#p238',
-                    'en_US/vctk_low#p257',
-                    'en_US/vctk_low#p329',
-                    'en_US/vctk_low#p261',
-                    'en_US/vctk_low#p310',
-                    'en_US/vctk_low#p340',
-                    'en_US/vctk_low#p330',
-                    'en_US/vctk_low#p308',
-                    'en_US/vctk_low#p314',
-                    'en_US/vctk_low#p317',
-                    'en_US/vctk_low#p339',
-                    'en_US/vctk_low#p294',
-                    'en_US/vctk_low#p305',
-                    'en_US/vctk_low#p266',
-                    'en_US/vctk_low#p318',
-                    'en_US/vctk_low#p323',
-                    'en_US/vctk_low#p351',
-                    'en_US/vctk_low#p333',
-                    'en_US/vctk_low#p313',
-                    'en_US/vctk_low#p244',
-                    'en_US/vctk_low#p307',
-                    'en_US/vctk_low#p336',
-                    'en_US/vctk_low#p312',
-                    'en_US/vctk_low#p267',
-                    'en_US/vctk_low#p297',
-                    'en_US/vctk_low#p295',
-                    'en_US/vctk_low#p288',
-                    'en_US/vctk_low#p301',
-                    'en_US/vctk_low#p280',
-                    'en_US/vctk_low#p241',
-                    'en_US/vctk_low#p268',
-                    'en_US/vctk_low#p299',
-                    'en_US/vctk_low#p300',
-                    'en_US/vctk_low#p230',
-                    'en_US/vctk_low#p269',
-                    'en_US/vctk_low#p293',
-                    'en_US/vctk_low#p262',
-                    'en_US/vctk_low#p343',
-                    'en_US/vctk_low#p229',
-                    'en_US/vctk_low#p240',
-                    'en_US/vctk_low#p248',
-                    'en_US/vctk_low#p253',
-                    'en_US/vctk_low#p233',
-                    'en_US/vctk_low#p228',
-                    'en_US/vctk_low#p282',
-                    'en_US/vctk_low#p234',
-                    'en_US/vctk_low#p303', # nice crackly voice
-                    'en_US/vctk_low#p265',
-                    'en_US/vctk_low#p306',
-                    'en_US/vctk_low#p249',
-                    'en_US/vctk_low#p362',
-                    'en_US/ljspeech_low',
-                    'en_US/cmu-arctic_low#ljm',
-                    'en_US/cmu-arctic_low#slp',
-                    'en_US/cmu-arctic_low#axp',
-                    'en_US/cmu-arctic_low#eey',
-                    'en_US/cmu-arctic_low#lnh',
-                    'en_US/cmu-arctic_low#elb',
-                    'en_US/cmu-arctic_low#slt'
-                ]
-                default_voice = 'en_US/vctk_low#p303',
-                voice_model = default_voice
+            voices = speaker_index.voices(tts_api)
+            if voices is None:
+                voices = VoiceTable([], [], voice_model)
+            allocator = VoiceAllocator(voices) # reset the speaker maps
+            if voices.default:
+                voice_model = voices.default
+
+        # per mediaid speaker map and voice rotation
+        voice_map = allocator.table(mediaid, {"gender": gender, "voice": voice_model})
+        speaker_map = voice_map.speakers
 
         # request to change the gender
         gender_custom = None
@@ -363,12 +304,11 @@ def main():
                 mapped_gender = last_gender
                 if gender_override:
                     mapped_gender = gender_custom
-                speaker_map[ainame] = {
-                    "gender": mapped_gender, "voice": voice_model_custom}
-                
+                voice_map.set(ainame, mapped_gender, voice_model_custom)
+
                 logger.info(
                     f"Added speaker from ainame {ainame} of gender {mapped_gender} with voice {voice_model_custom}.")
-                
+
                 # if not an espiode then switch to the custom voice
                 if not is_episode:
                     speaker = ainame
@@ -382,144 +322,35 @@ def main():
         story_voice_model = None
         story_gender = None
         new_speaker_count = 0
-        current_speaker_count = 0
-
-        # Regex pattern to find speaker names with different markers
-        #speaker_pattern = r'^(?:\[/INST\])?<<([A-Za-z]+)>>|^(?:\[\w+\])?([A-Za-z]+):'
-        # find speaker names that may have a space in them at the start of lines like . new speaker: lines or after other punctuation endings or newlines
-        speaker_pattern = r'(?:(?:\[/INST\])?<<([A-Za-z0-9_\)\(\-]+)>>|^(?:\[\w+\])?([A-Za-z0-9_\)\(\-)]+):)'
-
-        # Find speaker names in the text and derive gender from name, setup speaker map
-        for line in text.split('\n'):
-            speaker_match = re.search(speaker_pattern, line)
-            if speaker_match:
-                # Extracting speaker name from either of the capturing groups
-                new_speaker = speaker_match.group(1) or speaker_match.group(2)
-                new_speaker = new_speaker.strip()
-                new_speaker = new_speaker.lower()
-
-                if (new_speaker == "opening_shot" or new_speaker == "closing_shot" or new_speaker == "next_episode_summary" or new_speaker == "scene" or new_speaker == "title" or new_speaker == "episode" or new_speaker == "question" or new_speaker == "plotline" or new_speaker == "host") and new_speaker not in speaker_map:
-                    speaker_map[new_speaker] = speaker_map["narrator"]
-
-                logger.info(f"Text to Speech: Speaker #{speaker_count}/{new_speaker_count}/{current_speaker_count} found: {new_speaker}.")
-
-                # check fuzzy match through speaker map
-                speaker_found = False
-                found_speaker = None
-                for speaker_key in speaker_map:
-                    if speaker_key in new_speaker or new_speaker in speaker_key:
-                        speaker_found = True
-                        found_speaker = speaker_key
-                        break
-
-                if speaker_found:
-                    # check if we are really the same speaker
-                    logger.info(f"Text to Speech: Speaker {speaker} #{speaker_count}/{new_speaker_count}/{current_speaker_count} fuzzy match found: {found_speaker}.")
-                    #new_speaker = found_speaker
-                
-                if new_speaker not in speaker_map:                    
-                    gender_marker = None
-                    # Identify gender from text if not determined by name
-                    if re.search(r'\[m\]', line):
-                        gender_marker = "male"
-                    elif re.search(r'\[f\]', line):
-                        gender_marker = "female"
-                    elif re.search(r'\[n\]', line):
-                        gender_marker = "nonbinary"
-
-                    gender_g = None
-                    if gender_marker == None:
-                        new_speaker_lc = new_speaker.lower()
-                        if new_speaker_lc == "he-man":
-                            gender_g = "male"
-                        elif new_speaker_lc == "she-ra":
-                            gender_g = "female"
-                        elif new_speaker_lc == "skeletor":
-                            gender_g = "male"
-                        elif new_speaker_lc == "teela":
-                            gender_g = "female"
-                        elif new_speaker_lc == "shiva":
-                            gender_g = "male"
-                        elif new_speaker_lc == "shakti":
-                            gender_g = "female"
-                        elif new_speaker_lc == "elon":
-                            gender_g = "male"
-                        elif new_speaker_lc == "sailor_moon":
-                            gender_g = "female"
-                        elif new_speaker_lc == "santa_claus":
-                            gender_g = "male"
-                        elif new_speaker_lc == "santa":
-                            gender_g = "male"
-                        elif new_speaker_lc == "mrs_claus":
-                            gender_g = "female"
-                        elif new_speaker_lc == "goku":
-                            gender_g = "male"
-                        elif new_speaker_lc == "excel":
-                            gender_g = "female"
-                        elif new_speaker_lc == "amuro_ray":
-                            gender_g = "male"
-                        elif new_speaker_lc == "amuro":
-                            gender_g = "male"
-                        elif new_speaker_lc == "gundam_0079":
-                            gender_g = "male"
-                        else:
-                            guessed_gender = d.get_gender(new_speaker.split('_')[0])  # assuming the first word is the name
-                            if guessed_gender in ['male', 'mostly_male']:
-                                gender_g = "male"
-                            elif guessed_gender in ['female', 'mostly_female']:
-                                gender_g = "female"
-
-                    if gender_marker:
-                        story_gender = gender_marker
-                    elif gender_g:
-                        story_gender = gender_g
-                    else:
-                        story_gender = last_gender
-                    
-                    if story_gender == "male":
-                        if male_voice_index > len(male_voices):
-                            male_voice_index = 0
-                        voice_choice = male_voices[male_voice_index % len(male_voices)]
-                        male_voice_index += 1
-                    else:  # Female and nonbinary use female voices
-                        if female_voice_index > len(female_voices):
-                            female_voice_index = 0
-                        voice_choice = female_voices[female_voice_index % len(female_voices)]
-                        female_voice_index += 1
-
-                    logger.info(f"Adding new speaker {new_speaker} {voice_choice} {story_gender}")
-
-                    speaker = new_speaker
-                    speaker_map[speaker] = {'voice': voice_choice, 'gender': story_gender}
-                    story_voice_model = voice_choice
-                    speaker_count += 1
-                    new_speaker_count += 1
-                else:
-                    if new_speaker in speaker_map:
-                        story_voice_model = speaker_map[new_speaker]['voice']
-                        story_gender = speaker_map[new_speaker]['gender']
-                    else:
-                        logger.error(f"Text to Speech: ERROR Speaker {new_speaker} not found in speaker map, reassigning.")
-                        story_voice_model = last_voice_model
-                        story_gender = last_gender
-                    speaker = new_speaker
-                    if story_voice_model not in female_voices and story_voice_model not in male_voices:
-                        logger.error(f"Text to Speech: ERROR Voice model {story_voice_model} not found in voice list, reassigning.")
-                        if story_gender == "male":
-                            if male_voice_index > len(male_voices):
-                                male_voice_index = 0
-                            story_voice_model = male_voices[male_voice_index]
-                            male_voice_index += 1
-                        else:
-                            if female_voice_index > len(female_voices):
-                                female_voice_index = 0
-                            story_voice_model = female_voices[female_voice_index]
-                            female_voice_index += 1
-
-                current_speaker_count += 1
-                logger.info(
-                    f"Text to Speech: Speaker switch from {last_speaker} to #{current_speaker_count}/{speaker_count} {speaker} who is {story_gender} with voice {story_voice_model}.")
-                break # only one speaker
+        speaker_count = voice_map.speaker_count
+
+        # Find the first speaker name in the text and derive gender from name, setup speaker map
+        new_speaker, line = speaker_index.find_speaker(text)
+        if new_speaker:
+            if new_speaker in speaker_index.narrator_aliases and new_speaker not in speaker_map:
+                speaker_map[new_speaker] = speaker_map["narrator"]
+
+            logger.info(f"Text to Speech: Speaker #{speaker_count} found: {new_speaker}.")
+
+            speaker_entry = speaker_map.get(new_speaker)
+            if speaker_entry is None:
+                story_gender = speaker_index.gender_of(new_speaker, line) or last_gender
+                speaker_entry = voice_map.add(new_speaker, story_gender)
+                story_voice_model = speaker_entry['voice']
+
+                logger.info(f"Adding new speaker {new_speaker} {story_voice_model} {story_gender}")
+
+                new_speaker_count += 1
+            else:
+                story_voice_model = speaker_entry['voice']
+                story_gender = speaker_entry['gender']
+                if story_voice_model not in voices:
+                    logger.error(f"Text to Speech: ERROR Voice model {story_voice_model} not found in voice list, reassigning.")
+                    story_voice_model = voice_map.next_voice(story_gender)
+
+            speaker = new_speaker
+            logger.info(
+                f"Text to Speech: Speaker switch from {last_speaker} to #{voice_map.speaker_count} {speaker} who is {story_gender} with voice {story_voice_model}.")
 
         # show speaker map
         if new_speaker_count > 0:
@@ -530,7 +361,7 @@ def main():
             if story_voice_model:
                 if story_gender:
                     gender = story_gender
-                logger.info(f"Text to Speech: {speaker}/{gender} Speaker #{speaker_count}/{new_speaker_count}/{current_speaker_count} found, using {story_voice_model} instead of {voice_model}.")
+                logger.info(f"Text to Speech: {speaker}/{gender} Speaker #{voice_map.speaker_count}/{new_speaker_count} found, using {story_voice_model} instead of {voice_model}.")
                 voice_model = story_voice_model
             else:
                 # keep the last values used
@@ -539,7 +370,7 @@ def main():
         else:
             if voice_override:
                 logger.info(
-                    f"Text to Speech: {speaker}/{gender} Speaker #{speaker_count}/{new_speaker_count}/{current_speaker_count} found, using {voice_model_custom} instead of {voice_model}.")
+                    f"Text to Speech: {speaker}/{gender} Speaker #{voice_map.speaker_count}/{new_speaker_count} found, using {voice_model_custom} instead of {voice_model}.")
                 # custom voice for single speaker mode
                 voice_model = voice_model_custom
                 voice_speed = voice_speed_custom
@@ -570,44 +401,9 @@ def main():
             logger.info(f"Text to Speech: SSML enabled, using pitch={args.pitch}, range={args.range}, rate={args.rate}.")
             logger.debug(f"Text to Speech: SSML text:\n{text}")
 
-        duration = 0
-        try:
-            audio_blob = get_tts_audio(
-                tts_api,
-                text,
-                voice=voice_model,
-                noise_scale=args.noise_scale,
-                noise_w=args.noise_w,
-                length_scale=voice_speed,
-                ssml=args.ssml,
-                audio_target=args.audio_target
-            )
-            if tts_api == "mimic3" or tts_api == "mms-tts":
-                duration = len(audio_blob) / (22050 * 2)  # Assuming 22.5kHz 16-bit audio for duration calculation
-            elif tts_api == "openai":
-                duration = get_aac_duration(audio_blob)
-        except Exception as e:
-            logger.error(f"Exception: ERROR TTS error with API request for text: {text}")
-            logger.error(e)
-            continue
-
-        if duration == 0:
-            logger.error(f"Exception: ERROR TTS {tts_api} {voice_model} x{voice_speed} returned 0 duration audio blobt: {text}")
-            continue
-
-        audiobuf = io.BytesIO(audio_blob)
-        audiobuf.seek(0)
-
-        # Fill in the header
-        header_message["duration"] = duration
-        header_message["stream"] = "speek"
-
-        # Send the header and the audio
-        sender.send_json(header_message, zmq.SNDMORE)
-        sender.send(audiobuf.getvalue())
-
-        logger.debug(f"Text to Speech: sent audio #{segment_number}\n{header_message}")
-        logger.info(f"Text to Speech: sent audio #{segment_number} of {duration} duration.")
+        # synthesize on the worker pool, the send worker keeps the output in order
+        future = tts_executor.submit(synthesize, tts_api, text, voice_model, voice_speed)
+        pending.put((header_message, text, tts_api, voice_model, voice_speed, future))
 
         header_message = None
         text = ""
@@ -633,6 +429,17 @@ if __name__ == "__main__":
     parser.add_argument("--metal", action="store_true", default=False, help="offload to metal mps GPU")
     parser.add_argument("--cuda", action="store_true", default=False, help="offload to cuda GPU")
     parser.add_argument("--gender", type=str, default="female", help="Gender default for characters without [m], [f], or [n] markers")
+    parser.add_argument("--mimic3_url", type=str, action="append", default=[], help="mimic3-server URL, repeat for a pool of servers, default http://earth:59125")
+    parser.add_argument("--tts_timeout", type=float, default=30.0, help="Timeout in seconds for each mimic3-server request")
+    parser.add_argument("--probe_interval", type=float, default=10.0, help="Seconds between health probes of ejected mimic3-servers")
+    parser.add_argument("--tts_workers", type=int, default=0, help="Concurrent TTS requests, default is one per mimic3-server")
+    parser.add_argument("--nopostprocess", action="store_true", default=False, help="Disable silence trimming and loudness normalization of the TTS audio")
+    parser.add_argument("--silence_threshold", type=float, default=-45.0, help="Frame energy in dBFS below which leading/trailing audio is trimmed as silence")
+    parser.add_argument("--silence_pad", type=float, default=0.1, help="Seconds of silence to keep before and after the speech")
+    parser.add_argument("--target_loudness", type=float, default=-20.0, help="Target RMS loudness in dBFS for the speech")
+    parser.add_argument("--max_gain", type=float, default=20.0, help="Maximum gain in dB applied by the loudness normalization")
+    parser.add_argument("--limiter_ceiling", type=float, default=-1.0, help="Peak ceiling in dBFS for the limiter")
+    parser.add_argument("--speakers_file", type=str, default="speakers.json", help="Speaker name to gender table and voice lists, default speakers.json")
 
     args = parser.parse_args()
 
@@ -684,6 +491,24 @@ if __name__ == "__main__":
 
     openai_client = OpenAI()
 
+    if not args.mimic3_url:
+        args.mimic3_url = ["http://earth:59125"]
+    # the pool's health prober only runs when mimic3 is in use
+    mimic3_pool = None
+    mimic3_lock = threading.Lock()
+    if args.service == "mimic3":
+        get_mimic3_pool()
+
+    tts_workers = args.tts_workers
+    if tts_workers <= 0:
+        tts_workers = len(args.mimic3_url)
+    mms_lock = threading.Lock()
+    dead_air = DeadAirStats()
+    tts_executor = ThreadPoolExecutor(max_workers=tts_workers)
+    pending = queue.Queue(maxsize=tts_workers * 2)
+    threading.Thread(target=send_worker, daemon=True).start()
+
     d = gender_guess.Detector(case_sensitive=False)
+    speaker_index = SpeakerIndex.from_file(args.speakers_file, d)
 
     main()
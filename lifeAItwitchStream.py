@@ -25,6 +25,7 @@ import numpy as np
 from pydub import AudioSegment
 import logging
 import time
+from lifeAIimageVariants import LRUCache, image_id
 
 load_dotenv()
 
@@ -70,6 +71,20 @@ def draw_default_frame():
     
     return default_img
 
+def decode_frame(image):
+    # Convert the byte data to a NumPy array and decode it
+    image_array = np.frombuffer(image, dtype=np.uint8)
+    image = cv2.imdecode(image_array, cv2.IMREAD_COLOR)
+    # Convert the image from BGR to RGB (OpenCV loads images in BGR by default)
+    image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    if image_rgb.shape[:2] != (args.height, args.width):
+        image_rgb = cv2.resize(image_rgb, (args.width, args.height))
+    assert image_rgb.shape == (args.height, args.width, 3), f"Unexpected frame shape: {image_rgb.shape}"
+    return image_rgb
+
+# Decoded and resized frames by image id, the same image is often sent for several segments
+frame_cache = LRUCache(8)
+
 def main():
     ## Twitch streaming
     if stream_id != "":
@@ -115,25 +130,8 @@ def main():
                     image = image_socket.recv()
 
                     if image:
-                       # 2. Convert and possibly resize the image data
-                        # Convert the byte data to a NumPy array
-                        image_array = np.frombuffer(image, dtype=np.uint8)
-                        # Decode the image data
-                        image = cv2.imdecode(image_array, cv2.IMREAD_UNCHANGED)
-                        # Convert the image from BGR to RGB (OpenCV loads images in BGR by default)
-                        image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-                        # Check if the image needs to be resized
-                        desired_dimensions = (args.width, args.height)  # Adjust as necessary
-                        if image_rgb.shape[:2] != desired_dimensions:
-                            image = cv2.resize(image_rgb, (desired_dimensions[1], desired_dimensions[0]))
-                        else:
-                            image = image_rgb
-
-                        # Inside the if image: block
-                        image_rgb_resized = cv2.resize(image_rgb, (args.width, args.height))
-                        assert image_rgb_resized.shape == (args.height, args.width, 3), f"Unexpected frame shape: {image_rgb_resized.shape}"
-                        videostream.send_video_frame(image_rgb_resized)
-                        image = image_rgb_resized
+                        # 2. Decode and resize once per distinct image, repeats come from the frame cache
+                        image = frame_cache.get(image_id(image), lambda: decode_frame(image))
 
                         last_image = image
                         videostream.send_video_frame(image)